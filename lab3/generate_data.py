@@ -0,0 +1,479 @@
+"""
+Генератор синтетических данных библиотеки произвольного объёма
+
+В отличие от seed_data.py (несколько записей для примеров) генератор
+создаёт данные, на которых планы запросов похожи на рабочие:
+    - популярность книг и активность читателей распределены по закону
+      Ципфа: немногие книги выдаются очень часто, большинство - редко;
+    - у популярных книг больше экземпляров;
+    - часть выдач активна, часть активных - просрочена, часть
+      возвращённых - возвращена с опозданием и со штрафом.
+
+Генерация детерминирована: одинаковые --seed и --today дают одинаковые
+данные. Строки создаются потоково и вставляются пачками по --chunk-size
+(executemany, по транзакции на пачку), поэтому память не зависит от
+объёма (кроме множества активных выдач).
+
+Объём задаётся множителем --scale к базовому набору (10 тыс. книг,
+30 тыс. экземпляров, 5 тыс. читателей, 200 тыс. выдач) или отдельными
+параметрами. --scale 100 даёт 1 млн книг, 3 млн экземпляров, 500 тыс.
+читателей и 20 млн выдач.
+
+Использование:
+    python generate_data.py --scale 1
+    python generate_data.py --scale 100 --seed 42 --drop
+    python generate_data.py --books 50000 --loans 1000000
+
+Автор: Софья Шипенкова
+"""
+
+import argparse
+import random
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, Iterator, Set
+
+from sqlalchemy import insert, text, update
+from sqlmodel import SQLModel, create_engine, select, func
+
+from database import DATABASE_URL
+from models import (
+    Author, Book, BookCopy, BookAuthorLink, Publisher,
+    Reader, Librarian, Loan, Reservation
+)
+
+
+# Базовый набор (--scale 1)
+BASE_SCALE = {
+    "publishers": 100,
+    "authors": 2_000,
+    "librarians": 20,
+    "books": 10_000,
+    "copies": 30_000,
+    "readers": 5_000,
+    "loans": 200_000,
+    "reservations": 5_000,
+}
+
+# Множитель для перемешивания рангов популярности по id (простое число,
+# большее любого количества строк, поэтому перестановка взаимно однозначна)
+SCATTER_PRIME = 2_654_435_761
+
+LOAN_DAYS = 14
+FINE_PER_DAY = Decimal("10.00")
+
+FIRST_NAMES = [
+    "Александр", "Алексей", "Анна", "Дарья", "Дмитрий", "Екатерина", "Елена",
+    "Иван", "Ирина", "Мария", "Михаил", "Наталья", "Николай", "Ольга",
+    "Павел", "Сергей", "София", "Татьяна", "Фёдор", "Юлия",
+]
+LAST_NAMES = [
+    "Иванов", "Смирнов", "Кузнецов", "Попов", "Васильев", "Петров", "Соколов",
+    "Михайлов", "Новиков", "Фёдоров", "Морозов", "Волков", "Алексеев",
+    "Лебедев", "Семёнов", "Егоров", "Павлов", "Козлов", "Степанов", "Николаев",
+]
+MIDDLE_NAMES = [
+    "Александрович", "Сергеевич", "Иванович", "Дмитриевич", "Михайлович",
+    "Николаевич", "Петрович", "Андреевич", None, None,
+]
+TITLE_ADJECTIVES = [
+    "Тихий", "Последний", "Северный", "Забытый", "Белый", "Тёмный", "Старый",
+    "Далёкий", "Первый", "Золотой", "Синий", "Вечный", "Пустой", "Новый",
+]
+TITLE_NOUNS = [
+    "дом", "сад", "берег", "город", "путь", "лес", "океан", "мир", "свет",
+    "ветер", "остров", "век", "огонь", "край", "сон", "дождь", "голос",
+]
+TITLE_TAILS = [
+    "", "", "", " и другие рассказы", " в ночи", " у моря", " на краю света",
+    ": хроники", " после войны", " без имени",
+]
+GENRES = [
+    "Роман", "Повесть", "Рассказы", "Поэзия", "Детектив", "Фантастика",
+    "Фэнтези", "История", "Биография", "Научно-популярная", "Детская",
+]
+CONDITIONS = ["excellent", "good", "good", "good", "fair", "poor"]
+
+
+# ==================== РАСПРЕДЕЛЕНИЯ ====================
+
+def zipf_rank(rng: random.Random, count: int) -> int:
+    """Ранг 1..count с вероятностью примерно 1/ранг (закон Ципфа)"""
+    return min(count, int(count ** rng.random()))
+
+
+def scatter(rank: int, count: int) -> int:
+    """id (1..count) для ранга: популярные записи не идут подряд по id"""
+    return (rank - 1) * SCATTER_PRIME % count + 1
+
+
+def popular_id(rng: random.Random, count: int) -> int:
+    return scatter(zipf_rank(rng, count), count)
+
+
+def person(rng: random.Random) -> Dict[str, str]:
+    last_name = rng.choice(LAST_NAMES)
+    first_name = rng.choice(FIRST_NAMES)
+    middle_name = rng.choice(MIDDLE_NAMES)
+    # Фамилия и отчество по роду имени
+    if first_name[-1] in "ая":
+        last_name += "а"
+        if middle_name:
+            middle_name = middle_name[:-2] + "на"
+    return {"first_name": first_name, "last_name": last_name, "middle_name": middle_name}
+
+
+def reader_is_active(reader_id: int) -> bool:
+    """Каждый двадцатый читатель заблокирован"""
+    return reader_id % 20 != 0
+
+
+def reader_max_books(reader_id: int) -> int:
+    return 10 if reader_id % 10 == 0 else 5
+
+
+# ==================== СТРОКИ ТАБЛИЦ ====================
+
+def publisher_rows(rng: random.Random, count: int, now: datetime) -> Iterator[dict]:
+    for publisher_id in range(1, count + 1):
+        yield {
+            "id": publisher_id,
+            "name": f"Издательство {rng.choice(TITLE_ADJECTIVES)} {rng.choice(TITLE_NOUNS)} №{publisher_id}",
+            "country": "Россия",
+            "city": rng.choice(["Москва", "Санкт-Петербург", "Казань", "Новосибирск"]),
+            "created_at": now,
+            "updated_at": now,
+        }
+
+
+def author_rows(rng: random.Random, count: int, now: datetime) -> Iterator[dict]:
+    for author_id in range(1, count + 1):
+        yield {
+            "id": author_id,
+            **person(rng),
+            "birth_date": date(rng.randint(1800, 1995), rng.randint(1, 12), rng.randint(1, 28)),
+            "nationality": "Русский",
+            "created_at": now,
+            "updated_at": now,
+        }
+
+
+def librarian_rows(rng: random.Random, count: int, now: datetime) -> Iterator[dict]:
+    for librarian_id in range(1, count + 1):
+        yield {
+            "id": librarian_id,
+            "employee_number": f"EMP-{librarian_id:05d}",
+            **person(rng),
+            "position": "Главный библиотекарь" if librarian_id == 1 else "Библиотекарь",
+            "hire_date": date(rng.randint(2000, 2023), rng.randint(1, 12), rng.randint(1, 28)),
+            "status": "working",
+            "created_at": now,
+            "updated_at": now,
+        }
+
+
+def reader_rows(rng: random.Random, count: int, today: date, now: datetime) -> Iterator[dict]:
+    for reader_id in range(1, count + 1):
+        yield {
+            "id": reader_id,
+            "library_card_number": f"CARD-{reader_id:08d}",
+            **person(rng),
+            "email": f"reader{reader_id}@example.com",
+            "phone": f"+7-9{rng.randint(10, 99)}-{rng.randint(100, 999)}-{rng.randint(10, 99)}-{rng.randint(10, 99)}",
+            "registration_date": today - timedelta(days=rng.randint(0, 3650)),
+            "status": "active" if reader_is_active(reader_id) else "blocked",
+            "max_books": reader_max_books(reader_id),
+            "created_at": now,
+            "updated_at": now,
+        }
+
+
+def book_rows(rng: random.Random, count: int, publishers: int, today: date, now: datetime) -> Iterator[dict]:
+    for book_id in range(1, count + 1):
+        title = (
+            f"{rng.choice(TITLE_ADJECTIVES)} {rng.choice(TITLE_NOUNS)}"
+            f"{rng.choice(TITLE_TAILS)}"
+        )
+        yield {
+            "id": book_id,
+            "isbn": f"978-{book_id:010d}",
+            "title": title,
+            "publisher_id": popular_id(rng, publishers),
+            "year": rng.randint(1850, today.year),
+            "genre": rng.choice(GENRES),
+            "pages": rng.randint(48, 1200),
+            "language": "ru" if rng.random() < 0.9 else "en",
+            "date_added": today - timedelta(days=rng.randint(0, 3650)),
+            "location": f"Стеллаж {rng.randint(1, 200)}, Полка {rng.randint(1, 8)}",
+            "status": "available",
+            "created_at": now,
+            "updated_at": now,
+        }
+
+
+def book_author_rows(rng: random.Random, books: int, authors: int, now: datetime) -> Iterator[dict]:
+    link_id = 0
+    for book_id in range(1, books + 1):
+        # У большинства книг один автор, у некоторых - два
+        author_ids = {popular_id(rng, authors) for _ in range(1 if rng.random() < 0.85 else 2)}
+        for author_id in sorted(author_ids):
+            link_id += 1
+            yield {"id": link_id, "book_id": book_id, "author_id": author_id, "created_at": now}
+
+
+def copy_book_id(rng: random.Random, copy_id: int, books: int) -> int:
+    """Первые экземпляры - по одному на книгу, остальные - популярным книгам"""
+    if copy_id <= books:
+        return copy_id
+    return popular_id(rng, books)
+
+
+def copy_rows(rng: random.Random, count: int, books: int, today: date, now: datetime) -> Iterator[dict]:
+    for copy_id in range(1, count + 1):
+        yield {
+            "id": copy_id,
+            "book_id": copy_book_id(rng, copy_id, books),
+            "inventory_number": f"INV-{copy_id:09d}",
+            "condition": rng.choice(CONDITIONS),
+            "status": "in_library",
+            "acquisition_date": today - timedelta(days=rng.randint(0, 3650)),
+            "price": Decimal(rng.randint(200, 3000)),
+            "created_at": now,
+            "updated_at": now,
+        }
+
+
+def loan_rows(
+    rng: random.Random,
+    args,
+    today: date,
+    now: datetime,
+    active_copies: Set[int]
+) -> Iterator[dict]:
+    """Выдачи; id экземпляров с активными выдачами добавляются в active_copies
+
+    Экземпляр может быть выдан активно только один раз, а читателю - не
+    больше max_books книг.
+    """
+    active_share = args.active_loans / args.loans if args.loans else 0
+    active_by_reader: Dict[int, int] = {}
+    history_days = max(args.history_days, LOAN_DAYS + 1)
+
+    for loan_id in range(1, args.loans + 1):
+        copy_id = popular_id(rng, args.copies)
+        reader_id = popular_id(rng, args.readers)
+        row = {
+            "id": loan_id,
+            "copy_id": copy_id,
+            "reader_id": reader_id,
+            "librarian_id": rng.randint(1, args.librarians),
+            "fine_amount": Decimal("0.00"),
+            "created_at": now,
+            "updated_at": now,
+        }
+
+        active = (
+            rng.random() < active_share
+            and reader_is_active(reader_id)
+            and copy_id not in active_copies
+            and active_by_reader.get(reader_id, 0) < reader_max_books(reader_id)
+        )
+        if active:
+            active_copies.add(copy_id)
+            active_by_reader[reader_id] = active_by_reader.get(reader_id, 0) + 1
+            if rng.random() < args.overdue_rate:
+                loan_date = today - timedelta(days=rng.randint(LOAN_DAYS + 1, LOAN_DAYS + 90))
+            else:
+                loan_date = today - timedelta(days=rng.randint(0, LOAN_DAYS))
+            row.update(
+                loan_date=loan_date,
+                due_date=loan_date + timedelta(days=LOAN_DAYS),
+                return_date=None,
+                status="active",
+            )
+        else:
+            loan_date = today - timedelta(days=rng.randint(1, history_days))
+            due_date = loan_date + timedelta(days=LOAN_DAYS)
+            if rng.random() < args.overdue_rate:
+                return_date = due_date + timedelta(days=rng.randint(1, 30))
+            else:
+                return_date = loan_date + timedelta(days=rng.randint(1, LOAN_DAYS))
+            return_date = min(return_date, today)
+            late_days = (return_date - due_date).days
+            row.update(
+                loan_date=loan_date,
+                due_date=due_date,
+                return_date=return_date,
+                status="returned",
+                fine_amount=FINE_PER_DAY * late_days if late_days > 0 else Decimal("0.00"),
+            )
+        yield row
+
+
+def reservation_rows(rng: random.Random, args, today: date, now: datetime) -> Iterator[dict]:
+    for reservation_id in range(1, args.reservations + 1):
+        status = rng.choices(
+            ["active", "fulfilled", "expired", "cancelled"], weights=[3, 5, 1, 1]
+        )[0]
+        if status == "active":
+            reservation_date = today - timedelta(days=rng.randint(0, 6))
+        else:
+            reservation_date = today - timedelta(days=rng.randint(7, args.history_days))
+        yield {
+            "id": reservation_id,
+            "book_id": popular_id(rng, args.books),
+            "reader_id": popular_id(rng, args.readers),
+            "reservation_date": reservation_date,
+            "expiry_date": reservation_date + timedelta(days=7),
+            "status": status,
+            "notification_sent": status != "active",
+            "created_at": now,
+            "updated_at": now,
+        }
+
+
+# ==================== ЗАПИСЬ В БАЗУ ====================
+
+def chunks(rows: Iterable[dict], size: int) -> Iterator[list]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def insert_chunks(engine, model, rows: Iterable[dict], chunk_size: int) -> int:
+    """Вставить строки пачками (по транзакции на пачку), вернуть количество"""
+    table = model.__table__
+    started = time.perf_counter()
+    total = 0
+    for chunk in chunks(rows, chunk_size):
+        with engine.begin() as connection:
+            connection.execute(insert(table), chunk)
+        total += len(chunk)
+    seconds = time.perf_counter() - started
+    rate = total / seconds if seconds else 0
+    print(f"{table.name}: {total} строк за {seconds:.1f} с ({rate:,.0f} строк/с)")
+    return total
+
+
+def mark_copies_on_loan(engine, copy_ids: Set[int], chunk_size: int) -> None:
+    """Экземпляры с активными выдачами - в статус on_loan"""
+    for chunk in chunks(sorted(copy_ids), chunk_size):
+        with engine.begin() as connection:
+            connection.execute(
+                update(BookCopy.__table__)
+                .where(BookCopy.__table__.c.id.in_(chunk))
+                .values(status="on_loan")
+            )
+
+
+def recount_book_copies(engine) -> None:
+    """Число экземпляров книг (всего и в библиотеке) - по вставленным экземплярам"""
+    books = Book.__table__
+    copies = BookCopy.__table__
+
+    def count(*conditions):
+        return (
+            select(func.count())
+            .select_from(copies)
+            .where(copies.c.book_id == books.c.id, *conditions)
+            .scalar_subquery()
+        )
+
+    with engine.begin() as connection:
+        connection.execute(
+            update(books).values(
+                total_copies=count(),
+                available_copies=count(copies.c.status == "in_library"),
+            )
+        )
+
+
+def reset_sequences(engine) -> None:
+    """Последовательности id PostgreSQL - после явно заданных id"""
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as connection:
+        for model in (Publisher, Author, Librarian, Reader, Book, BookAuthorLink, BookCopy, Loan, Reservation):
+            table = model.__table__.name
+            connection.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)"
+            ))
+
+
+def drop_tables(engine) -> None:
+    """Удалить таблицы модели (в PostgreSQL - вместе с зависящими таблицами lab4)"""
+    if engine.dialect.name != "postgresql":
+        SQLModel.metadata.drop_all(engine)
+        return
+    with engine.begin() as connection:
+        for table in reversed(SQLModel.metadata.sorted_tables):
+            connection.execute(text(f"DROP TABLE IF EXISTS {table.name} CASCADE"))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Генератор синтетических данных библиотеки")
+    parser.add_argument("--scale", type=float, default=1.0, help="множитель базового набора")
+    for name, value in BASE_SCALE.items():
+        parser.add_argument(f"--{name}", type=int, help=f"количество (по умолчанию {value} x scale)")
+    parser.add_argument("--active-loans", type=int, help="активных выдач (по умолчанию 5%% выдач, не больше 20%% экземпляров)")
+    parser.add_argument("--overdue-rate", type=float, default=0.15, help="доля просроченных выдач")
+    parser.add_argument("--history-days", type=int, default=3 * 365, help="глубина истории выдач в днях")
+    parser.add_argument("--seed", type=int, default=1, help="начальное значение генератора")
+    parser.add_argument("--today", type=date.fromisoformat, default=date.today(), help="дата отсчёта (ГГГГ-ММ-ДД)")
+    parser.add_argument("--chunk-size", type=int, default=10_000, help="строк в одной вставке")
+    parser.add_argument("--drop", action="store_true", help="пересоздать таблицы перед генерацией")
+    args = parser.parse_args()
+
+    for name, value in BASE_SCALE.items():
+        if getattr(args, name) is None:
+            setattr(args, name, max(1, round(value * args.scale)))
+    if args.active_loans is None:
+        args.active_loans = min(args.loans // 20, args.copies // 5)
+    return args
+
+
+def generate(args) -> None:
+    engine = create_engine(DATABASE_URL)
+    if args.drop:
+        drop_tables(engine)
+    SQLModel.metadata.create_all(engine)
+    with engine.connect() as connection:
+        if connection.execute(select(Book.id).limit(1)).first():
+            raise SystemExit("В базе уже есть книги: запустите с --drop, чтобы пересоздать таблицы")
+
+    rng = random.Random(args.seed)
+    today = args.today
+    now = datetime.combine(today, datetime.min.time())
+    size = args.chunk_size
+    active_copies: Set[int] = set()
+
+    insert_chunks(engine, Publisher, publisher_rows(rng, args.publishers, now), size)
+    insert_chunks(engine, Author, author_rows(rng, args.authors, now), size)
+    insert_chunks(engine, Librarian, librarian_rows(rng, args.librarians, now), size)
+    insert_chunks(engine, Reader, reader_rows(rng, args.readers, today, now), size)
+    insert_chunks(engine, Book, book_rows(rng, args.books, args.publishers, today, now), size)
+    insert_chunks(engine, BookAuthorLink, book_author_rows(rng, args.books, args.authors, now), size)
+    insert_chunks(engine, BookCopy, copy_rows(rng, args.copies, args.books, today, now), size)
+    insert_chunks(engine, Loan, loan_rows(rng, args, today, now, active_copies), size)
+    mark_copies_on_loan(engine, active_copies, size)
+    recount_book_copies(engine)
+    insert_chunks(engine, Reservation, reservation_rows(rng, args, today, now), size)
+    reset_sequences(engine)
+
+    print(f"Активных выдач: {len(active_copies)}")
+    print(
+        "Для lab4 пересчитайте производные данные: python counters.py --fix, "
+        "python availability.py --fix, python rollups.py --rebuild, "
+        "python search.py --rebuild, python etags.py --reset"
+    )
+
+
+if __name__ == "__main__":
+    generate(parse_args())
@@ -0,0 +1,229 @@
+"""
+Число экземпляров книги: books.total_copies и books.available_copies
+
+Колонки меняются относительными UPDATE (x = x + n) в той же транзакции,
+что и выдача, возврат, добавление экземпляра или смена его статуса,
+поэтому «доступно N из M» в ответах /books не требует подсчёта по
+book_copies. Доступным считается экземпляр в статусе in_library.
+
+Вместе с колонками увеличиваются счётчики ETag книги и экземпляров
+книги; запись книги в кеше сбрасывается после commit (invalidate).
+Счётчик списка книг (books) - одна строка на весь каталог - меняется,
+только если изменилось общее число экземпляров или книга стала доступной
+или недоступной, а не при каждой выдаче и возврате: иначе все
+параллельные выдачи ждали бы друг друга на этой строке.
+
+Сверка колонок с book_copies:
+    python availability.py          # только отчёт
+    python availability.py --fix    # отчёт и исправление
+
+Автор: Софья Шипенкова
+"""
+
+import argparse
+import logging
+from typing import Dict, Iterable, List, Mapping, Optional
+
+from sqlalchemy import case, update
+from sqlalchemy.engine import Connection
+from sqlmodel import select, and_, or_, func
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from models import Book, BookCopy
+import cache
+import etags
+
+
+logger = logging.getLogger(__name__)
+
+AVAILABLE_STATUS = "in_library"
+
+# Сколько книг исправляется одним UPDATE при сверке
+RECONCILE_CHUNK_SIZE = 1000
+
+
+def status_delta(old_status: Optional[str], new_status: Optional[str]) -> int:
+    """Изменение числа доступных экземпляров при смене статуса экземпляра"""
+    return (new_status == AVAILABLE_STATUS) - (old_status == AVAILABLE_STATUS)
+
+
+def _nonzero(deltas: Mapping[int, int]) -> Dict[int, int]:
+    return {book_id: delta for book_id, delta in deltas.items() if delta}
+
+
+def _case(deltas: Dict[int, int]):
+    return case(deltas, value=Book.id, else_=0)
+
+
+def adjust_statement(available: Mapping[int, int], total: Optional[Mapping[int, int]] = None):
+    """UPDATE книг на заданные величины {book_id: delta} одним запросом
+    (None, если менять нечего)"""
+    available = _nonzero(available)
+    total = _nonzero(total or {})
+    if not available and not total:
+        return None
+    values = {}
+    if available:
+        values["available_copies"] = Book.available_copies + _case(available)
+    if total:
+        values["total_copies"] = Book.total_copies + _case(total)
+    return (
+        update(Book)
+        .where(Book.id.in_(sorted(set(available) | set(total))))
+        .values(values)
+    )
+
+
+def crossed_zero(available: int, delta: int) -> bool:
+    """Книга стала доступной или недоступной (available - новое значение)"""
+    return (available > 0) != (available - delta > 0)
+
+
+def changed_scopes(book_ids: Iterable[int], list_changed: bool) -> List[str]:
+    """Счётчики ETag, которые меняются вместе с числом экземпляров"""
+    scopes = [etags.BOOKS_SCOPE] if list_changed else []
+    for book_id in book_ids:
+        scopes += [etags.book_scope(book_id), etags.copies_scope(book_id)]
+    return scopes
+
+
+async def adjust(
+    session: AsyncSession,
+    available: Mapping[int, int],
+    total: Optional[Mapping[int, int]] = None
+) -> List[int]:
+    """Изменить число экземпляров книг в текущей транзакции
+
+    Возвращает ID изменённых книг - их записи в кеше нужно сбросить
+    после commit (invalidate).
+    """
+    statement = adjust_statement(available, total)
+    if statement is None:
+        return []
+    rows = (await session.execute(
+        statement.returning(Book.id, Book.available_copies),
+        execution_options={"synchronize_session": False}
+    )).all()
+    list_changed = bool(_nonzero(total or {})) or any(
+        crossed_zero(row.available_copies, available.get(row.id, 0)) for row in rows
+    )
+    book_ids = sorted(row.id for row in rows)
+    await etags.bump(session, *changed_scopes(book_ids, list_changed))
+    return book_ids
+
+
+async def copy_counts(session: AsyncSession, book_id: int) -> Dict[str, int]:
+    """Текущее число экземпляров книги (чтение по первичному ключу)"""
+    row = (await session.exec(
+        select(Book.total_copies, Book.available_copies).where(Book.id == book_id)
+    )).one()
+    return {"total_copies": row.total_copies, "available_copies": row.available_copies}
+
+
+async def invalidate(book_ids: Iterable[int]) -> None:
+    """Сбросить записи книг в кеше (после commit)"""
+    book_ids = list(book_ids)
+    if book_ids:
+        await cache.invalidate_books(*book_ids)
+
+
+# ==================== СВЕРКА ====================
+
+def _copy_counts():
+    """Подзапрос: число экземпляров и доступных экземпляров по книгам"""
+    return (
+        select(
+            BookCopy.book_id,
+            func.count().label("total"),
+            func.sum(case((BookCopy.status == AVAILABLE_STATUS, 1), else_=0)).label("available"),
+        )
+        .group_by(BookCopy.book_id)
+        .subquery()
+    )
+
+
+def find_drift(connection: Connection) -> Dict[int, Dict[str, int]]:
+    """Книги, у которых колонки расходятся с book_copies (сохранено - факт)"""
+    counts = _copy_counts()
+    total = func.coalesce(counts.c.total, 0)
+    available = func.coalesce(counts.c.available, 0)
+    rows = connection.execute(
+        select(Book.id, Book.total_copies, Book.available_copies, total, available)
+        .outerjoin(counts, counts.c.book_id == Book.id)
+        .where(or_(Book.total_copies != total, Book.available_copies != available))
+        .order_by(Book.id)
+    ).all()
+    return {
+        book_id: {
+            "total_copies": stored_total - actual_total,
+            "available_copies": stored_available - actual_available,
+        }
+        for book_id, stored_total, stored_available, actual_total, actual_available in rows
+    }
+
+
+def recount_statement(book_ids: List[int]):
+    """UPDATE книг: колонки пересчитываются по book_copies"""
+    def count(*conditions):
+        return (
+            select(func.count())
+            .select_from(BookCopy)
+            .where(and_(BookCopy.book_id == Book.id, *conditions))
+            .scalar_subquery()
+        )
+
+    return (
+        update(Book)
+        .where(Book.id.in_(book_ids))
+        .values(
+            total_copies=count(),
+            available_copies=count(BookCopy.status == AVAILABLE_STATUS),
+        )
+    )
+
+
+def reconcile(connection: Connection, fix: bool = False) -> Dict[int, Dict[str, int]]:
+    """Сверить колонки с экземплярами, вернуть расхождения по книгам
+
+    При исправлении строки книг сначала блокируются: транзакции, которые
+    успели изменить их экземпляры, завершатся до пересчёта, а остальные
+    применят свои приращения уже к исправленным значениям.
+    """
+    drift = find_drift(connection)
+    if drift:
+        logger.warning("Расхождение числа экземпляров у %d книг", len(drift))
+        if fix:
+            book_ids = sorted(drift)
+            for start in range(0, len(book_ids), RECONCILE_CHUNK_SIZE):
+                chunk = book_ids[start:start + RECONCILE_CHUNK_SIZE]
+                connection.execute(
+                    select(Book.id).where(Book.id.in_(chunk)).with_for_update()
+                ).all()
+                connection.execute(recount_statement(chunk))
+            # Исправленных книг может быть сколько угодно (например, после
+            # добавления колонок), поэтому устаревают сразу все ETag
+            etags.reset(connection)
+    return drift
+
+
+if __name__ == "__main__":
+    from database import engine, init_db
+
+    parser = argparse.ArgumentParser(description="Сверка числа экземпляров книг")
+    parser.add_argument("--fix", action="store_true", help="исправить расхождения")
+    parser.add_argument("--show", type=int, default=20, help="сколько книг вывести")
+    args = parser.parse_args()
+
+    init_db()
+    with engine.begin() as connection:
+        drift = reconcile(connection, fix=args.fix)
+
+    if not drift:
+        print("Число экземпляров совпадает с данными")
+    else:
+        print(f"Расхождения у {len(drift)} книг" + (" (исправлены)" if args.fix else ""))
+    for book_id, difference in list(drift.items())[:args.show]:
+        print(
+            f"книга {book_id}: total_copies {difference['total_copies']:+d}, "
+            f"available_copies {difference['available_copies']:+d}"
+        )
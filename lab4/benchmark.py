@@ -0,0 +1,184 @@
+"""
+Нагрузочное сравнение асинхронного и синхронного пути обработки запросов
+
+Асинхронное приложение - main.app (AsyncSession). Для сравнения здесь же
+собрано синхронное приложение sync_app, которое выполняет те же запросы
+через синхронную Session: каждый запрос занимает поток из пула на всё
+время обращения к базе данных.
+
+По умолчанию оба приложения запускаются в процессе (httpx + ASGITransport).
+С параметрами --url/--sync-url нагружаются уже запущенные серверы:
+    uvicorn main:app --port 8000
+    uvicorn benchmark:sync_app --port 8001
+
+В базе должны быть данные (например, после lab3/seed_data.py).
+
+Использование:
+    python benchmark.py --concurrency 64 --requests 2000
+    python benchmark.py --url http://localhost:8000 --sync-url http://localhost:8001
+
+Автор: Софья Шипенкова
+"""
+
+import argparse
+import asyncio
+import time
+from typing import List, Optional
+
+import httpx
+from fastapi import Depends, FastAPI, HTTPException
+from sqlalchemy import true
+from sqlmodel import Session, select, and_
+
+from database import engine, get_session, init_db
+from models import Book, BookCopy, Loan, Reader
+
+
+# ==================== СИНХРОННОЕ ПРИЛОЖЕНИЕ ДЛЯ СРАВНЕНИЯ ====================
+
+sync_app = FastAPI(title="Библиотечная система API (синхронный путь)")
+
+
+@sync_app.get("/books")
+def sync_get_books(limit: int = 100, session: Session = Depends(get_session)):
+    return list(session.exec(select(Book).order_by(Book.id).limit(limit)).all())
+
+
+@sync_app.get("/books/{book_id}")
+def sync_get_book(book_id: int, session: Session = Depends(get_session)):
+    book = session.get(Book, book_id)
+    if not book:
+        raise HTTPException(status_code=404, detail="Книга не найдена")
+    return book
+
+
+@sync_app.get("/books/{book_id}/available")
+def sync_get_available_copies(book_id: int, session: Session = Depends(get_session)):
+    statement = select(BookCopy).where(
+        and_(BookCopy.book_id == book_id, BookCopy.status == "in_library")
+    )
+    return list(session.exec(statement).all())
+
+
+@sync_app.get("/readers/{reader_id}/active-loans")
+def sync_get_reader_active_loans(reader_id: int, session: Session = Depends(get_session)):
+    statement = select(Loan).where(
+        and_(Loan.reader_id == reader_id, Loan.status == "active")
+    )
+    return list(session.exec(statement).all())
+
+
+@sync_app.get("/loans/overdue")
+def sync_get_overdue_loans(session: Session = Depends(get_session)):
+    statement = select(Loan).where(
+        and_(
+            Loan.status == "active",
+            Loan.is_overdue == true()
+        )
+    ).order_by(Loan.due_date, Loan.id)
+    return list(session.exec(statement).all())
+
+
+# ==================== НАГРУЗКА ====================
+
+def benchmark_paths() -> List[str]:
+    """Пути запросов с идентификаторами, существующими в базе"""
+    with Session(engine) as session:
+        book_id = session.exec(select(Book.id).order_by(Book.id)).first()
+        reader_id = session.exec(select(Reader.id).order_by(Reader.id)).first()
+    if book_id is None or reader_id is None:
+        raise SystemExit("База пуста: сначала заполните её (lab3/seed_data.py)")
+    return [
+        f"/books/{book_id}",
+        "/books?limit=20",
+        f"/books/{book_id}/available",
+        f"/readers/{reader_id}/active-loans",
+        "/loans/overdue",
+    ]
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Перцентиль по отсортированному списку значений"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, round(fraction * (len(values) - 1)))]
+
+
+async def run_load(
+    client: httpx.AsyncClient,
+    paths: List[str],
+    concurrency: int,
+    total: int
+) -> dict:
+    """Выполнить total запросов в concurrency параллельных потоков"""
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for number in counter:
+            path = paths[number % len(paths)]
+            started = time.perf_counter()
+            response = await client.get(path)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": total,
+        "errors": errors,
+        "rps": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def make_client(app: FastAPI, url: Optional[str]) -> httpx.AsyncClient:
+    """Клиент к приложению в процессе или к запущенному серверу"""
+    if url:
+        return httpx.AsyncClient(base_url=url, timeout=60)
+    return httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app),
+        base_url="http://benchmark",
+        timeout=60
+    )
+
+
+async def compare(args) -> None:
+    from main import app
+
+    paths = benchmark_paths()
+    results = {}
+    for name, target, url in (
+        ("sync", sync_app, args.sync_url),
+        ("async", app, args.url),
+    ):
+        async with make_client(target, url) as client:
+            # Прогрев пула соединений
+            await run_load(client, paths, args.concurrency, args.concurrency)
+            results[name] = await run_load(client, paths, args.concurrency, args.requests)
+
+    print(f"{'путь':<8}{'запросов/с':>12}{'p50, мс':>10}{'p99, мс':>10}{'ошибок':>8}")
+    for name, result in results.items():
+        print(
+            f"{name:<8}{result['rps']:>12}{result['p50_ms']:>10}"
+            f"{result['p99_ms']:>10}{result['errors']:>8}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сравнение синхронного и асинхронного пути")
+    parser.add_argument("--concurrency", type=int, default=64, help="параллельных клиентов")
+    parser.add_argument("--requests", type=int, default=2000, help="запросов на каждый путь")
+    parser.add_argument("--url", help="адрес запущенного асинхронного приложения")
+    parser.add_argument("--sync-url", help="адрес запущенного синхронного приложения")
+    args = parser.parse_args()
+
+    init_db()
+    asyncio.run(compare(args))
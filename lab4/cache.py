@@ -0,0 +1,240 @@
+"""
+Кеш редко меняющихся записей каталога (книги, читатели)
+
+Записи кешируются в виде словарей (model_dump в JSON-совместимом виде),
+а не объектов сессии, поэтому одно значение можно отдать любому запросу
+или сохранить во внешнем хранилище. Отсутствующие записи не кешируются.
+
+Хранилище выбирается переменной CACHE_BACKEND:
+    memory - LRU с ограниченным временем жизни в памяти процесса
+             (у каждого worker'а uvicorn свой кеш);
+    redis  - общий для всех worker'ов кеш (нужен пакет redis, адрес
+             в CACHE_URL).
+
+Изменяющие endpoints удаляют затронутые ключи после commit. Кеш у каждого
+worker'а свой, поэтому часто меняющиеся поля (число экземпляров книги)
+в записи не хранятся: их читают из базы на каждый запрос.
+
+Автор: Софья Шипенкова
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from models import Book, Reader
+
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_URL = os.getenv("CACHE_URL", "redis://localhost:6379/0")
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "60"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+
+
+# ==================== ХРАНИЛИЩА ====================
+
+class CacheBackend:
+    """Интерфейс хранилища кеша"""
+
+    async def get(self, key: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: dict) -> None:
+        raise NotImplementedError
+
+    async def delete(self, *keys: str) -> None:
+        raise NotImplementedError
+
+    async def clear(self) -> None:
+        raise NotImplementedError
+
+    def size(self) -> Optional[int]:
+        """Количество записей, если хранилище может его сообщить"""
+        return None
+
+
+class MemoryCacheBackend(CacheBackend):
+    """LRU с временем жизни записей в памяти процесса"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    async def set(self, key: str, value: dict) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def delete(self, *keys: str) -> None:
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    async def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def size(self) -> Optional[int]:
+        return len(self._entries)
+
+
+class RedisCacheBackend(CacheBackend):
+    """Общий для всех worker'ов кеш в Redis"""
+
+    def __init__(self, url: str, ttl: float, prefix: str = "library:"):
+        try:
+            from redis import asyncio as redis
+        except ImportError as error:
+            raise RuntimeError("Для CACHE_BACKEND=redis установите пакет redis") from error
+        self._client = redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[dict]:
+        raw = await self._client.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, value: dict) -> None:
+        await self._client.set(
+            self.prefix + key, json.dumps(value), px=int(self.ttl * 1000)
+        )
+
+    async def delete(self, *keys: str) -> None:
+        if keys:
+            await self._client.delete(*(self.prefix + key for key in keys))
+
+    async def clear(self) -> None:
+        async for key in self._client.scan_iter(match=self.prefix + "*"):
+            await self._client.delete(key)
+
+
+def create_backend(name: str = CACHE_BACKEND) -> CacheBackend:
+    """Хранилище кеша по имени из CACHE_BACKEND"""
+    if name == "memory":
+        return MemoryCacheBackend(CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS)
+    if name == "redis":
+        return RedisCacheBackend(CACHE_URL, CACHE_TTL_SECONDS)
+    raise ValueError(f"Неизвестное хранилище кеша: {name}")
+
+
+# ==================== КЕШ С ЧТЕНИЕМ ЧЕРЕЗ БАЗУ ====================
+
+class EntityCache:
+    """Чтение записей через кеш со статистикой попаданий по видам записей"""
+
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+        self._counts: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def _count(self, kind: str, outcome: str) -> None:
+        with self._lock:
+            counts = self._counts.setdefault(kind, {"hits": 0, "misses": 0})
+            counts[outcome] += 1
+
+    async def get_or_load(
+        self,
+        kind: str,
+        key,
+        load: Callable[[], Awaitable[Optional[SQLModel]]],
+        exclude: Optional[Set[str]] = None
+    ) -> Optional[dict]:
+        """Запись из кеша или, при промахе, из базы через load()
+
+        Поля exclude в кеш не попадают.
+        """
+        cache_key = f"{kind}:{key}"
+        value = await self.backend.get(cache_key)
+        if value is not None:
+            self._count(kind, "hits")
+            return value
+
+        self._count(kind, "misses")
+        instance = await load()
+        if instance is None:
+            return None
+        value = instance.model_dump(mode="json", exclude=exclude)
+        await self.backend.set(cache_key, value)
+        return value
+
+    async def invalidate(self, kind: str, *keys) -> None:
+        """Удалить записи вида kind с ключами keys"""
+        await self.backend.delete(*(f"{kind}:{key}" for key in keys))
+
+    def statistics(self) -> dict:
+        """Попадания и промахи по видам записей и в целом"""
+        with self._lock:
+            kinds = {kind: dict(counts) for kind, counts in self._counts.items()}
+        hits = sum(counts["hits"] for counts in kinds.values())
+        misses = sum(counts["misses"] for counts in kinds.values())
+        for counts in kinds.values():
+            counts["hit_ratio"] = _ratio(counts["hits"], counts["misses"])
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": self.backend.size(),
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": _ratio(hits, misses),
+            "kinds": kinds,
+        }
+
+
+def _ratio(hits: int, misses: int) -> float:
+    total = hits + misses
+    return round(hits / total, 4) if total else 0.0
+
+
+entity_cache = EntityCache(create_backend())
+
+
+# ==================== ЗАПИСИ КАТАЛОГА ====================
+
+# Поля книги, которые меняются при каждой выдаче и возврате
+BOOK_COUNT_FIELDS = {"total_copies", "available_copies"}
+
+
+async def get_book(session: AsyncSession, book_id: int) -> Optional[dict]:
+    """Книга без числа экземпляров (см. availability.copy_counts)"""
+    return await entity_cache.get_or_load(
+        "book", book_id, lambda: session.get(Book, book_id), exclude=BOOK_COUNT_FIELDS
+    )
+
+
+async def get_reader(session: AsyncSession, reader_id: int) -> Optional[dict]:
+    return await entity_cache.get_or_load(
+        "reader", reader_id, lambda: session.get(Reader, reader_id)
+    )
+
+
+async def get_reader_by_card(session: AsyncSession, card_number: str) -> Optional[dict]:
+    async def load():
+        statement = select(Reader).where(Reader.library_card_number == card_number)
+        return (await session.exec(statement)).first()
+
+    return await entity_cache.get_or_load("reader_card", card_number, load)
+
+
+async def invalidate_books(*book_ids: int) -> None:
+    await entity_cache.invalidate("book", *book_ids)
@@ -0,0 +1,228 @@
+"""
+Нагрузочная проверка выдачи книг на гонки
+
+Два сценария одновременных запросов:
+    один экземпляр   - каждый из --copies экземпляров одновременно
+                       запрашивают --contenders читателей (POST /loans
+                       и POST /loans/batch вперемешку): выдан должен быть
+                       ровно один раз;
+    лимит читателя   - одному читателю одновременно выдаются
+                       max_books + --extra разных экземпляров: выдач должно
+                       быть не больше max_books.
+После прогона база проверяется SQL-запросами: нет экземпляров с двумя
+активными выдачами, читателей сверх лимита, расхождений статуса
+экземпляра с выдачами и числа доступных экземпляров книг. Выдачи,
+созданные проверкой, затем закрываются.
+
+При нарушении скрипт завершается с кодом 1.
+
+Использование:
+    python checkout_stress.py
+    python checkout_stress.py --copies 50 --contenders 16 --rounds 5
+    python checkout_stress.py --url http://localhost:8000
+
+Автор: Софья Шипенкова
+"""
+
+import argparse
+import asyncio
+import random
+from collections import Counter
+from typing import List, Optional
+
+import httpx
+from sqlalchemy import text
+from sqlmodel import Session, select, and_
+
+from benchmark import make_client
+from database import engine, init_db
+from models import BookCopy, Librarian, Loan, Reader
+
+
+# ==================== ПРОВЕРКИ ====================
+
+VIOLATIONS = {
+    "двойные выдачи экземпляра": """
+        SELECT copy_id, count(*) FROM loans
+        WHERE status = 'active'
+        GROUP BY copy_id HAVING count(*) > 1
+    """,
+    "читатели сверх лимита": """
+        SELECT loans.reader_id, count(*) FROM loans
+        JOIN readers ON readers.id = loans.reader_id
+        WHERE loans.status = 'active'
+        GROUP BY loans.reader_id, readers.max_books
+        HAVING count(*) > readers.max_books
+    """,
+    "выдачи экземпляров не в статусе on_loan": """
+        SELECT loans.id, book_copies.status FROM loans
+        JOIN book_copies ON book_copies.id = loans.copy_id
+        WHERE loans.status = 'active' AND book_copies.status = 'in_library'
+    """,
+    "расхождения books.available_copies с экземплярами": """
+        SELECT books.id, books.available_copies, count(book_copies.id) FROM books
+        LEFT JOIN book_copies
+            ON book_copies.book_id = books.id AND book_copies.status = 'in_library'
+        GROUP BY books.id, books.available_copies
+        HAVING books.available_copies != count(book_copies.id)
+    """,
+}
+
+
+def check_database() -> List[str]:
+    """Нарушения в данных после прогона"""
+    problems = []
+    with engine.connect() as connection:
+        for name, query in VIOLATIONS.items():
+            rows = connection.execute(text(query)).all()
+            if rows:
+                problems.append(f"{name}: {[tuple(row) for row in rows[:10]]}")
+    return problems
+
+
+# ==================== СЦЕНАРИИ ====================
+
+def free_copies_and_readers(count: int, readers: int):
+    """Экземпляры в библиотеке и активные читатели без выданных книг"""
+    with Session(engine) as session:
+        copy_ids = list(session.exec(
+            select(BookCopy.id)
+            .where(BookCopy.status == "in_library")
+            .order_by(BookCopy.id)
+            .limit(count)
+        ).all())
+        reader_rows = session.exec(
+            select(Reader.id, Reader.max_books)
+            .where(and_(
+                Reader.status == "active",
+                ~select(Loan.id).where(and_(
+                    Loan.reader_id == Reader.id,
+                    Loan.status == "active"
+                )).exists()
+            ))
+            .order_by(Reader.id)
+            .limit(readers)
+        ).all()
+        librarian_id = session.exec(select(Librarian.id).order_by(Librarian.id)).first()
+    return copy_ids, list(reader_rows), librarian_id
+
+
+async def checkout(
+    client: httpx.AsyncClient,
+    copy_id: int,
+    reader_id: int,
+    librarian_id: int,
+    batch: bool
+) -> Optional[int]:
+    """Выдать экземпляр одиночным или пакетным запросом; ID выдачи или None"""
+    if batch:
+        response = await client.post("/loans/batch", json={
+            "copy_ids": [copy_id], "reader_id": reader_id, "librarian_id": librarian_id
+        })
+        if response.status_code != 200:
+            return None
+        item = response.json()["items"][0]
+        return item["loan"]["id"] if item["status"] == "created" else None
+    response = await client.post("/loans", json={
+        "copy_id": copy_id, "reader_id": reader_id, "librarian_id": librarian_id
+    })
+    return response.json()["id"] if response.status_code == 201 else None
+
+
+async def same_copy(client, copy_ids, readers, librarian_id, rng) -> Counter:
+    """Каждый экземпляр одновременно запрашивают все читатели"""
+    attempts = [
+        (copy_id, reader_id, rng.random() < 0.5)
+        for copy_id in copy_ids
+        for reader_id, _ in readers
+    ]
+    rng.shuffle(attempts)
+    loan_ids = await asyncio.gather(*(
+        checkout(client, copy_id, reader_id, librarian_id, batch)
+        for copy_id, reader_id, batch in attempts
+    ))
+    granted = Counter(
+        copy_id for (copy_id, _, _), loan_id in zip(attempts, loan_ids) if loan_id
+    )
+    await return_loans(client, [loan_id for loan_id in loan_ids if loan_id])
+    return granted
+
+
+async def reader_limit(client, copy_ids, reader, librarian_id, rng) -> int:
+    """Одному читателю одновременно выдаются экземпляры сверх лимита"""
+    reader_id, _ = reader
+    loan_ids = await asyncio.gather(*(
+        checkout(client, copy_id, reader_id, librarian_id, rng.random() < 0.5)
+        for copy_id in copy_ids
+    ))
+    created = [loan_id for loan_id in loan_ids if loan_id]
+    await return_loans(client, created)
+    return len(created)
+
+
+async def return_loans(client: httpx.AsyncClient, loan_ids: List[int]) -> None:
+    for start in range(0, len(loan_ids), 1000):
+        await client.post("/loans/return-batch", json={"loan_ids": loan_ids[start:start + 1000]})
+
+
+async def run(args) -> List[str]:
+    from main import app
+
+    rng = random.Random(args.seed)
+    copy_ids, readers, librarian_id = free_copies_and_readers(
+        max(args.copies, 100), args.contenders
+    )
+    if len(readers) < 2 or not copy_ids or librarian_id is None:
+        raise SystemExit("Нужны экземпляры в библиотеке и хотя бы два читателя без выдач")
+
+    problems = []
+    async with make_client(app, args.url) as client:
+        async def rounds():
+            for number in range(1, args.rounds + 1):
+                granted = await same_copy(
+                    client, copy_ids[:args.copies], readers, librarian_id, rng
+                )
+                doubled = {copy_id: count for copy_id, count in granted.items() if count > 1}
+                print(
+                    f"раунд {number}: один экземпляр - выдано {sum(granted.values())} "
+                    f"из {len(copy_ids[:args.copies])} экземпляров"
+                )
+                if doubled:
+                    problems.append(f"экземпляры выданы несколько раз: {doubled}")
+
+                reader = readers[number % len(readers)]
+                limit_copies = copy_ids[:reader[1] + args.extra]
+                created = await reader_limit(client, limit_copies, reader, librarian_id, rng)
+                print(
+                    f"раунд {number}: лимит читателя - выдано {created} "
+                    f"при лимите {reader[1]}"
+                )
+                if created > reader[1]:
+                    problems.append(f"читатель {reader[0]}: {created} выдач при лимите {reader[1]}")
+
+        if args.url:
+            await rounds()
+        else:
+            async with app.router.lifespan_context(app):
+                await rounds()
+
+    return problems + check_database()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Проверка выдачи книг на гонки")
+    parser.add_argument("--copies", type=int, default=20, help="экземпляров в сценарии одного экземпляра")
+    parser.add_argument("--contenders", type=int, default=8, help="читателей на каждый экземпляр")
+    parser.add_argument("--extra", type=int, default=5, help="экземпляров сверх лимита читателя")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--url", help="адрес уже запущенного приложения")
+    args = parser.parse_args()
+
+    init_db()
+    problems = asyncio.run(run(args))
+    if problems:
+        for problem in problems:
+            print(f"НАРУШЕНИЕ: {problem}")
+        raise SystemExit(1)
+    print("Нарушений нет")
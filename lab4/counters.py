@@ -0,0 +1,169 @@
+"""
+Транзакционно обновляемые счётчики статистики библиотеки
+
+Строка library_counters меняется относительными UPDATE (x = x + 1)
+в той же транзакции, что и изменение данных, поэтому /statistics читает
+одну строку при любом объёме таблиц. Просроченная выдача - та же, что
+в /loans/overdue: активная выдача, отмеченная заданием overdue.py
+(is_overdue). Задание увеличивает overdue_loans в транзакции каждой
+порции отметок, возврат отмеченной выдачи уменьшает его, поэтому
+/statistics и /loans/overdue не расходятся и между проходами задания.
+
+Сверка пересчитывает счётчики с нуля и сообщает о расхождениях:
+    python counters.py          # только отчёт
+    python counters.py --fix    # отчёт и исправление
+
+Автор: Софья Шипенкова
+"""
+
+import argparse
+import logging
+from datetime import date, datetime
+from typing import Dict, List
+
+from sqlalchemy import exc, update
+from sqlalchemy.engine import Connection
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from models import LibraryCounters, Loan
+from schemas import LibraryStatistics
+from stats import statistics_statement
+
+
+logger = logging.getLogger(__name__)
+
+COUNTERS_ID = 1
+
+# Счётчики, которые можно пересчитать с нуля
+COUNTER_FIELDS = (
+    "total_books",
+    "total_copies",
+    "available_copies",
+    "total_readers",
+    "active_readers",
+    "active_loans",
+    "overdue_loans",
+)
+
+
+def adjust_statement(**deltas):
+    """UPDATE строки счётчиков на заданные величины"""
+    values = {
+        name: getattr(LibraryCounters, name) + delta
+        for name, delta in deltas.items()
+        if delta
+    }
+    values["updated_at"] = datetime.now()
+    return (
+        update(LibraryCounters)
+        .where(LibraryCounters.id == COUNTERS_ID)
+        .values(values)
+    )
+
+
+async def adjust(session: AsyncSession, **deltas: int) -> None:
+    """Изменить счётчики на заданные величины в текущей транзакции"""
+    await session.execute(adjust_statement(**deltas))
+
+
+async def loans_returned(session: AsyncSession, loans: List[Loan], copies_returned: int) -> None:
+    """Учесть возврат выдач (отмеченные просроченными уменьшают overdue_loans)"""
+    if not loans:
+        return
+    await adjust(
+        session,
+        active_loans=-len(loans),
+        overdue_loans=-sum(1 for loan in loans if loan.is_overdue),
+        available_copies=copies_returned,
+    )
+
+
+async def read_statistics(session: AsyncSession) -> LibraryStatistics:
+    """Статистика из строки счётчиков"""
+    counters = await session.get(LibraryCounters, COUNTERS_ID)
+    return LibraryStatistics(
+        total_books=counters.total_books,
+        total_copies=counters.total_copies,
+        available_copies=counters.available_copies,
+        on_loan_copies=counters.total_copies - counters.available_copies,
+        total_readers=counters.total_readers,
+        active_readers=counters.active_readers,
+        active_loans=counters.active_loans,
+        overdue_loans=counters.overdue_loans,
+    )
+
+
+# ==================== ПЕРЕСЧЁТ И СВЕРКА ====================
+
+def recount(connection: Connection) -> Dict[str, int]:
+    """Посчитать значения счётчиков по таблицам"""
+    row = connection.execute(statistics_statement(connection.dialect.name)).one()
+    return {name: getattr(row, name) for name in COUNTER_FIELDS}
+
+
+def ensure_counters(connection: Connection) -> None:
+    """Создать строку счётчиков, если её ещё нет (например, после seed_data.py)"""
+    if connection.execute(
+        select(LibraryCounters.id).where(LibraryCounters.id == COUNTERS_ID)
+    ).first():
+        return
+    values = recount(connection)
+    try:
+        with connection.begin_nested():
+            connection.execute(
+                LibraryCounters.__table__.insert().values(
+                    id=COUNTERS_ID, overdue_as_of=date.today(), updated_at=datetime.now(), **values
+                )
+            )
+    except exc.IntegrityError:
+        # Строку одновременно создал другой worker
+        pass
+
+
+def reconcile(connection: Connection, fix: bool = False) -> Dict[str, int]:
+    """Сверить счётчики с данными, вернуть расхождения (сохранено - факт)
+
+    Строка счётчиков блокируется на время сверки, поэтому транзакции,
+    которые успели изменить счётчики, завершатся до подсчёта, а
+    остальные применят свои приращения уже к исправленным значениям.
+    """
+    stored = connection.execute(
+        select(LibraryCounters)
+        .where(LibraryCounters.id == COUNTERS_ID)
+        .with_for_update()
+    ).one()
+    actual = recount(connection)
+
+    drift = {
+        name: getattr(stored, name) - actual[name]
+        for name in COUNTER_FIELDS
+        if getattr(stored, name) != actual[name]
+    }
+    if drift:
+        logger.warning("Расхождение счётчиков статистики: %s", drift)
+        if fix:
+            connection.execute(
+                update(LibraryCounters)
+                .where(LibraryCounters.id == COUNTERS_ID)
+                .values(updated_at=datetime.now(), **actual)
+            )
+    return drift
+
+
+if __name__ == "__main__":
+    from database import engine, init_db
+
+    parser = argparse.ArgumentParser(description="Сверка счётчиков статистики")
+    parser.add_argument("--fix", action="store_true", help="исправить расхождения")
+    args = parser.parse_args()
+
+    init_db()
+    with engine.begin() as connection:
+        ensure_counters(connection)
+        drift = reconcile(connection, fix=args.fix)
+
+    if not drift:
+        print("Счётчики совпадают с данными")
+    for name, difference in drift.items():
+        print(f"{name}: {difference:+d}")
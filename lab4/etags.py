@@ -0,0 +1,147 @@
+"""
+ETag и условные GET-запросы (If-None-Match) для каталога
+
+ETag строится из счётчиков изменений таблицы catalog_versions, которые
+увеличиваются в тех же транзакциях, что и изменения каталога:
+    books         - список книг (создание книги, добавление экземпляра,
+                    книга стала доступной или недоступной);
+    book:{id}     - данные книги вместе с числом экземпляров;
+    copies:{id}   - экземпляры книги и их статусы (выдача, возврат).
+Проверка ETag читает не больше двух строк по первичному ключу, поэтому
+при совпадении ответ 304 отдаётся без запроса данных и сериализации.
+Выдача и возврат не меняют счётчик books, если книга остаётся доступной:
+число доступных экземпляров в списке может быть старее его ETag, точное
+значение - в GET /books/{id}.
+
+Счётчик epoch входит во все ETag. Если каталог изменён в обход API
+(например, lab3/seed_data.py), увеличьте его:
+    python etags.py --reset
+
+Автор: Софья Шипенкова
+"""
+
+import argparse
+from datetime import datetime
+from typing import Iterable, Optional
+
+from fastapi import Request, Response
+from sqlalchemy import literal
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from models import CatalogVersion
+
+
+EPOCH_SCOPE = "epoch"
+BOOKS_SCOPE = "books"
+
+
+def book_scope(book_id: int) -> str:
+    return f"book:{book_id}"
+
+
+def copies_scope(book_id: int) -> str:
+    return f"copies:{book_id}"
+
+
+def bump_statement(dialect_name: str, scopes: Iterable[str]):
+    """INSERT счётчиков или их увеличение одним запросом"""
+    if dialect_name == "postgresql":
+        statement = postgresql.insert(CatalogVersion)
+    elif dialect_name == "sqlite":
+        statement = sqlite.insert(CatalogVersion)
+    else:
+        raise NotImplementedError(f"ETag не поддерживаются для {dialect_name}")
+
+    now = datetime.now()
+    # Одинаковый порядок блокировок строк во всех транзакциях
+    statement = statement.values([
+        {"scope": scope, "version": 1, "updated_at": now}
+        for scope in sorted(set(scopes))
+    ])
+    return statement.on_conflict_do_update(
+        index_elements=["scope"],
+        set_={"version": CatalogVersion.version + 1, "updated_at": now},
+    )
+
+
+def bump_from_select(scopes):
+    """То же для счётчиков из запроса scopes с колонкой scope (PostgreSQL,
+    для CTE: INSERT ... SELECT)"""
+    now = datetime.now()
+    source = scopes.subquery()
+    statement = postgresql.insert(CatalogVersion).from_select(
+        ["scope", "version", "updated_at"],
+        select(source.c.scope, literal(1), literal(now)).order_by(source.c.scope)
+    )
+    return statement.on_conflict_do_update(
+        index_elements=["scope"],
+        set_={"version": CatalogVersion.version + 1, "updated_at": now},
+    )
+
+
+async def bump(session: AsyncSession, *scopes: str) -> None:
+    """Отметить изменение частей каталога (в текущей транзакции)"""
+    if scopes:
+        await session.execute(bump_statement(session.bind.dialect.name, scopes))
+
+
+async def current(session: AsyncSession, scope: str) -> str:
+    """Текущий ETag части каталога"""
+    rows = (await session.exec(
+        select(CatalogVersion.scope, CatalogVersion.version)
+        .where(CatalogVersion.scope.in_([EPOCH_SCOPE, scope]))
+    )).all()
+    versions = dict(rows)
+    return f'W/"{versions.get(EPOCH_SCOPE, 0)}.{scope}.{versions.get(scope, 0)}"'
+
+
+def _matches(if_none_match: str, etag: str) -> bool:
+    """Совпадает ли ETag со значением If-None-Match (слабое сравнение)"""
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(
+        candidate.strip().removeprefix("W/") == opaque
+        for candidate in if_none_match.split(",")
+    )
+
+
+async def conditional(
+    request: Request,
+    response: Response,
+    session: AsyncSession,
+    scope: str
+) -> Optional[Response]:
+    """Ответ 304, если у клиента актуальная версия, иначе None
+
+    ETag добавляется и к ответу 304, и к обычному ответу endpoint'а.
+    """
+    etag = await current(session, scope)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+def reset(connection: Connection) -> None:
+    """Сделать устаревшими все выданные ETag"""
+    connection.execute(bump_statement(connection.dialect.name, [EPOCH_SCOPE]))
+
+
+if __name__ == "__main__":
+    from database import engine, init_db
+
+    parser = argparse.ArgumentParser(description="ETag каталога")
+    parser.add_argument("--reset", action="store_true", help="сделать устаревшими все ETag")
+    args = parser.parse_args()
+
+    if args.reset:
+        init_db()
+        with engine.begin() as connection:
+            reset(connection)
+        print("Все ETag каталога обновлены")
@@ -0,0 +1,230 @@
+"""
+Проверка планов выполнения запросов горячих endpoints
+
+Для каждого запроса, который выполняют endpoints из main.py, запускается
+EXPLAIN. Если хотя бы одна таблица читается последовательным сканированием
+(Seq Scan в PostgreSQL, SCAN без индекса в SQLite), скрипт завершается
+с кодом 1.
+
+По умолчанию в PostgreSQL последовательное сканирование запрещается
+(enable_seqscan = off): на маленькой базе планировщик всё равно выберет
+Seq Scan, а так проверяется именно наличие подходящего индекса.
+На заполненной базе используйте --natural, чтобы увидеть реальный план.
+
+Использование:
+    python explain_check.py
+    python explain_check.py --natural
+
+Автор: Софья Шипенкова
+"""
+
+import argparse
+import re
+import sys
+from datetime import date, timedelta
+from typing import Callable, List, Tuple
+
+from sqlalchemy import false, text, true
+from sqlalchemy.engine import Connection
+from sqlalchemy import tuple_
+from sqlmodel import select, and_, func
+
+from database import engine, init_db
+from models import Book, BookCopy, Loan, Reader, Reservation
+import overdue
+import reservation_expiry
+import reservations
+
+
+# Значения параметров не влияют на выбор индекса
+SAMPLE_ID = 1
+
+
+def hot_queries() -> List[Tuple[str, object]]:
+    """Запросы endpoints, которые должны обслуживаться индексами"""
+    today = date.today()
+    return [
+        (
+            "GET /books?cursor=...&sort=title",
+            select(Book).where(tuple_(Book.title, Book.id) > tuple_("М", SAMPLE_ID))
+            .order_by(Book.title, Book.id).limit(100),
+        ),
+        (
+            "GET /readers?cursor=...&sort=last_name",
+            select(Reader).where(tuple_(Reader.last_name, Reader.id) > tuple_("М", SAMPLE_ID))
+            .order_by(Reader.last_name, Reader.id).limit(100),
+        ),
+        (
+            "POST /loans (лимит выдач)",
+            select(func.count(Loan.id)).where(
+                and_(Loan.reader_id == SAMPLE_ID, Loan.status == "active")
+            ),
+        ),
+        (
+            "GET /readers/{id}/active-loans",
+            select(Loan).where(
+                and_(Loan.reader_id == SAMPLE_ID, Loan.status == "active")
+            ),
+        ),
+        (
+            "GET /readers/card/{card_number}",
+            select(Reader).where(Reader.library_card_number == "CARD-001"),
+        ),
+        (
+            "GET /books/{id}/available",
+            select(BookCopy).where(
+                and_(BookCopy.book_id == SAMPLE_ID, BookCopy.status == "in_library")
+            ),
+        ),
+        (
+            "GET /books/available?genre=...",
+            select(Book).where(
+                and_(
+                    Book.genre == "Роман",
+                    Book.id > SAMPLE_ID,
+                    Book.available_copies > 0
+                )
+            ).order_by(Book.id).limit(20),
+        ),
+        (
+            "POST /reservations (есть экземпляр в библиотеке)",
+            select(
+                select(BookCopy.id).where(
+                    and_(BookCopy.book_id == SAMPLE_ID, BookCopy.status == "in_library")
+                ).exists()
+            ),
+        ),
+        (
+            "POST /reservations (существующая резервация)",
+            select(Reservation).where(
+                and_(
+                    Reservation.book_id == SAMPLE_ID,
+                    Reservation.reader_id == SAMPLE_ID,
+                    Reservation.status == "active"
+                )
+            ),
+        ),
+        (
+            "GET /reservations/book/{id}",
+            select(Reservation).where(
+                and_(Reservation.book_id == SAMPLE_ID, Reservation.status == "active")
+            ).order_by(Reservation.reservation_date, Reservation.id),
+        ),
+        (
+            "POST /loans/{id}/return (следующий в очереди резерваций)",
+            select(Reservation.id, Reservation.book_id).where(
+                and_(
+                    Reservation.book_id == SAMPLE_ID,
+                    Reservation.status == "active",
+                    Reservation.expiry_date >= today
+                )
+            ).order_by(Reservation.reservation_date, Reservation.id).limit(1),
+        ),
+        (
+            "GET /reservations/reader/{id}",
+            reservations.reader_reservations_statement(SAMPLE_ID, today),
+        ),
+        (
+            "reservation_expiry.py (порция истёкших резерваций)",
+            select(Reservation.id).where(
+                reservation_expiry.expired(reservations.QUEUED, today)
+            ).order_by(Reservation.expiry_date).limit(reservation_expiry.RESERVATION_SWEEP_BATCH),
+        ),
+        (
+            "GET /loans/overdue",
+            select(Loan).where(
+                and_(Loan.status == "active", Loan.is_overdue == true())
+            ).order_by(Loan.due_date, Loan.id),
+        ),
+        (
+            "overdue.py (порция новых просроченных выдач)",
+            select(Loan.id).where(
+                and_(
+                    Loan.status == "active",
+                    Loan.is_overdue == false(),
+                    Loan.due_date < today,
+                    Loan.due_date >= today - timedelta(days=1)
+                )
+            ).order_by(Loan.due_date, Loan.id).limit(overdue.OVERDUE_CHUNK_SIZE),
+        ),
+    ]
+
+
+def _compile(connection: Connection, statement) -> Tuple[str, object]:
+    """Компиляция запроса в SQL драйвера и его параметры"""
+    compiled = statement.compile(
+        dialect=connection.dialect, compile_kwargs={"render_postcompile": True}
+    )
+    params = compiled.construct_params()
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    return str(compiled), params
+
+
+def _postgres_seq_scans(connection: Connection, statement) -> List[str]:
+    """Таблицы, которые PostgreSQL читает последовательным сканированием"""
+    sql, params = _compile(connection, statement)
+    plan = connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}", params).scalar()
+
+    scans = []
+    nodes = [plan[0]["Plan"]]
+    while nodes:
+        node = nodes.pop()
+        if node["Node Type"] == "Seq Scan":
+            scans.append(node["Relation Name"])
+        nodes.extend(node.get("Plans", []))
+    return scans
+
+
+def _sqlite_seq_scans(connection: Connection, statement) -> List[str]:
+    """Таблицы, которые SQLite читает полным сканированием"""
+    sql, params = _compile(connection, statement)
+    rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}", params).all()
+
+    scans = []
+    for row in rows:
+        match = re.fullmatch(r"SCAN (\S+)", row[-1])
+        if match:
+            scans.append(match.group(1))
+    return scans
+
+
+def check_plans(natural: bool = False) -> bool:
+    """Проверить планы всех горячих запросов, вернуть True при успехе"""
+    dialect = engine.dialect.name
+    if dialect == "postgresql":
+        find_seq_scans: Callable = _postgres_seq_scans
+    elif dialect == "sqlite":
+        find_seq_scans = _sqlite_seq_scans
+    else:
+        raise SystemExit(f"EXPLAIN не поддерживается для диалекта {dialect}")
+
+    ok = True
+    with engine.begin() as connection:
+        if dialect == "postgresql":
+            if natural:
+                connection.execute(text("ANALYZE"))
+            else:
+                connection.execute(text("SET LOCAL enable_seqscan = off"))
+
+        for name, statement in hot_queries():
+            scans = find_seq_scans(connection, statement)
+            if scans:
+                ok = False
+                print(f"FAIL  {name}: последовательное сканирование {', '.join(scans)}")
+            else:
+                print(f"OK    {name}")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Проверка использования индексов")
+    parser.add_argument(
+        "--natural",
+        action="store_true",
+        help="не запрещать Seq Scan (для проверки на заполненной базе)"
+    )
+    args = parser.parse_args()
+
+    init_db()
+    sys.exit(0 if check_plans(natural=args.natural) else 1)
@@ -0,0 +1,83 @@
+"""
+Потоковая выгрузка таблиц в NDJSON и CSV
+
+Строки читаются курсором на стороне сервера (stream_results) пачками
+по EXPORT_BATCH_SIZE и сразу отправляются клиенту, поэтому ни полная
+выборка, ни ORM-объекты в памяти не создаются. Выгрузка открывает своё
+соединение: оно живёт, пока клиент читает ответ.
+
+Автор: Софья Шипенкова
+"""
+
+import csv
+import io
+import json
+import os
+from datetime import date
+from typing import AsyncIterator, List, Optional
+
+from sqlmodel import select
+
+from database import async_engine
+from models import Book, BookCopy, Loan, Reservation
+
+
+# Строк в одной пачке курсора (и в одном фрагменте ответа)
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# Выгружаемые таблицы и колонка даты для фильтра date_from/date_to
+EXPORTS = {
+    "books": (Book, "date_added"),
+    "copies": (BookCopy, "acquisition_date"),
+    "loans": (Loan, "loan_date"),
+    "reservations": (Reservation, "reservation_date"),
+}
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+
+def export_statement(name: str, date_from: Optional[date] = None, date_to: Optional[date] = None):
+    """SELECT колонок таблицы (без ORM-объектов) с фильтром по дате"""
+    model, date_column = EXPORTS[name]
+    table = model.__table__
+    statement = select(*table.c).order_by(table.c.id)
+    if date_from:
+        statement = statement.where(table.c[date_column] >= date_from)
+    if date_to:
+        statement = statement.where(table.c[date_column] <= date_to)
+    return statement
+
+
+def _json_default(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+def _ndjson(columns: List[str], rows) -> str:
+    return "".join(
+        json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=_json_default) + "\n"
+        for row in rows
+    )
+
+
+def _csv(rows) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+async def stream_export(statement, file_format: str) -> AsyncIterator[str]:
+    """Фрагменты ответа: заголовок CSV, затем по фрагменту на пачку строк"""
+    async with async_engine.connect() as connection:
+        result = await connection.stream(
+            statement.execution_options(yield_per=EXPORT_BATCH_SIZE)
+        )
+        columns = list(result.keys())
+        if file_format == "csv":
+            yield _csv([columns])
+        async for rows in result.partitions():
+            yield _ndjson(columns, rows) if file_format == "ndjson" else _csv(rows)
@@ -0,0 +1,517 @@
+"""
+Массовая загрузка каталога (книги, авторы, издательства, экземпляры)
+
+Файл читается потоково пачками по IMPORT_CHUNK_SIZE записей, поэтому
+расход памяти не зависит от размера файла. Каждая пачка загружается
+в своей транзакции:
+    - издательства и авторы находятся по естественному ключу (название;
+      фамилия, имя, отчество), недостающие создаются;
+    - книги, экземпляры и связи book_authors загружаются через COPY
+      (PostgreSQL + psycopg2) или executemany (остальные базы);
+    - книги с уже существующим ISBN и экземпляры с существующим
+      инвентарным номером пропускаются;
+    - в той же транзакции обновляются поисковый индекс, счётчики
+      статистики и ETag списка книг.
+Записи проверяются до загрузки: запись без названия, с неверным числом
+или датой, со значением длиннее колонки отклоняется (invalid, с номером
+строки в errors), остальные записи пачки загружаются.
+Ошибка базы данных при загрузке пачки откатывает только эту пачку:
+её записи учитываются в отчёте как rejected (с номерами строк в errors),
+а загрузка продолжается со следующей пачки. Уже загруженные пачки
+остаются в базе, поэтому файл с исправленными строками можно загрузить
+повторно: книги с существующим ISBN и экземпляры с существующим
+инвентарным номером будут пропущены.
+
+Формат записи (JSONL - объект на строку, CSV - те же колонки):
+    {"isbn": "978-5-...", "title": "Война и мир", "publisher": "Эксмо",
+     "year": 1869, "genre": "Роман", "pages": 1300, "language": "ru",
+     "description": "...", "location": "Зал 1",
+     "authors": ["Толстой Лев Николаевич"],
+     "copies": ["INV-000001", "INV-000002"],
+     "condition": "good", "acquisition_date": "2024-01-15", "price": "500.00"}
+В CSV авторы и инвентарные номера перечисляются через ";". Автор
+записывается как "Фамилия Имя [Отчество]".
+
+Использование:
+    python importer.py books.jsonl
+    python importer.py books.csv --chunk-size 10000
+
+Автор: Софья Шипенкова
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, TextIO, Tuple
+
+from sqlalchemy import insert, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError
+from sqlmodel import select
+
+from models import Author, Book, BookAuthorLink, BookCopy, Publisher
+import counters
+import etags
+import search
+
+
+# Записей в одной пачке (и одной транзакции)
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "5000"))
+
+# Размер тела запроса загрузки, до которого оно хранится в памяти
+# (больше - во временном файле)
+IMPORT_SPOOL_BYTES = int(os.getenv("IMPORT_SPOOL_BYTES", str(16 * 1024 * 1024)))
+
+# Сколько сообщений об ошибочных записях возвращать в отчёте
+MAX_REPORTED_ERRORS = 20
+
+# Диапазон колонок INTEGER
+MAX_INTEGER = 2 ** 31 - 1
+
+FORMATS = ("jsonl", "csv")
+
+AuthorKey = Tuple[str, str, Optional[str]]
+
+# Поля записи и колонки, в которые они попадают (проверка длины)
+RECORD_COLUMNS = (
+    ("isbn", Book, "isbn"),
+    ("title", Book, "title"),
+    ("publisher", Publisher, "name"),
+    ("genre", Book, "genre"),
+    ("language", Book, "language"),
+    ("location", Book, "location"),
+    ("condition", BookCopy, "condition"),
+)
+
+
+# ==================== ЧТЕНИЕ ЗАПИСЕЙ ====================
+
+def detect_format(filename: str) -> str:
+    """Формат файла по расширению"""
+    return "csv" if filename.lower().endswith(".csv") else "jsonl"
+
+
+def read_records(stream: TextIO, file_format: str) -> Iterator[Tuple[int, object]]:
+    """Записи файла с номерами строк (без загрузки файла в память)
+
+    Строки JSONL разбираются в parse_record, чтобы ошибка в одной
+    строке не прерывала загрузку.
+    """
+    if file_format == "csv":
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for number, line in enumerate(stream, start=1):
+        if line.strip():
+            yield number, line
+
+
+def _text(value) -> Optional[str]:
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _int(value) -> Optional[int]:
+    value = _text(value)
+    if value is None:
+        return None
+    number = int(value)
+    if abs(number) > MAX_INTEGER:
+        raise ValueError(f"число вне допустимого диапазона: {value}")
+    return number
+
+
+def _check_length(name: str, value: Optional[str], model, column: str) -> None:
+    """Значение помещается в колонку column модели model
+
+    Иначе база данных отклонила бы всю пачку, а не одну запись.
+    """
+    limit = model.__table__.c[column].type.length
+    if value is not None and limit is not None and len(value) > limit:
+        raise ValueError(f"{name} длиннее {limit} символов ({len(value)})")
+
+
+def _list(value) -> List[str]:
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.split(";")
+    return [item for item in (_text(item) for item in value) if item]
+
+
+def parse_author(value) -> AuthorKey:
+    """Естественный ключ автора из строки "Фамилия Имя [Отчество]" или объекта"""
+    if isinstance(value, dict):
+        last_name = _text(value.get("last_name"))
+        first_name = _text(value.get("first_name"))
+        middle_name = _text(value.get("middle_name"))
+    else:
+        parts = str(value).split()
+        if len(parts) < 2:
+            raise ValueError(f"автор должен быть задан как 'Фамилия Имя': {value!r}")
+        last_name, first_name = parts[0], parts[1]
+        middle_name = " ".join(parts[2:]) or None
+    if not last_name or not first_name:
+        raise ValueError(f"у автора нет фамилии или имени: {value!r}")
+    _check_length("фамилия автора", last_name, Author, "last_name")
+    _check_length("имя автора", first_name, Author, "first_name")
+    _check_length("отчество автора", middle_name, Author, "middle_name")
+    return last_name, first_name, middle_name
+
+
+def parse_record(raw) -> dict:
+    """Проверенная и приведённая к типам запись файла"""
+    if isinstance(raw, str):
+        raw = json.loads(raw)
+    if not isinstance(raw, dict):
+        raise ValueError("запись должна быть объектом")
+    title = _text(raw.get("title"))
+    if not title:
+        raise ValueError("не задано название")
+    acquisition_date = _text(raw.get("acquisition_date"))
+    price = _text(raw.get("price"))
+    authors = raw.get("authors")
+    if isinstance(authors, str):
+        authors = _list(authors)
+    record = {
+        "isbn": _text(raw.get("isbn")),
+        "title": title,
+        "publisher": _text(raw.get("publisher")),
+        "year": _int(raw.get("year")),
+        "genre": _text(raw.get("genre")),
+        "pages": _int(raw.get("pages")),
+        "language": _text(raw.get("language")) or "ru",
+        "description": _text(raw.get("description")),
+        "location": _text(raw.get("location")),
+        "authors": list(dict.fromkeys(parse_author(author) for author in authors or [])),
+        "copies": _list(raw.get("copies")),
+        "condition": _text(raw.get("condition")) or "good",
+        "acquisition_date": date.fromisoformat(acquisition_date) if acquisition_date else date.today(),
+        "price": Decimal(price) if price else None,
+    }
+    for name, model, column in RECORD_COLUMNS:
+        _check_length(name, record[name], model, column)
+    for number in record["copies"]:
+        _check_length("inventory_number", number, BookCopy, "inventory_number")
+    return record
+
+
+# ==================== ЗАПИСЬ СТРОК ====================
+
+def _uses_copy(connection: Connection) -> bool:
+    return connection.dialect.name == "postgresql" and connection.dialect.driver == "psycopg2"
+
+
+def _copy_value(value):
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return value
+
+
+def insert_rows(connection: Connection, table, rows: List[dict]) -> None:
+    """Вставить строки через COPY (PostgreSQL) или executemany"""
+    if not rows:
+        return
+    if not _uses_copy(connection):
+        connection.execute(insert(table), rows)
+        return
+
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([_copy_value(row[column]) for column in columns])
+    buffer.seek(0)
+    # COPY выполняется тем же соединением, а значит, в той же транзакции
+    cursor = connection.connection.driver_connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            buffer
+        )
+    finally:
+        cursor.close()
+
+
+def insert_returning_ids(connection: Connection, table, rows: List[dict]) -> List[int]:
+    """Вставить строки и вернуть их id в порядке строк"""
+    if not rows:
+        return []
+    if connection.dialect.name == "postgresql":
+        # id выделяются заранее из последовательности, строки идут через COPY
+        ids = list(connection.execute(
+            text("SELECT nextval(pg_get_serial_sequence(:table, 'id')) FROM generate_series(1, :count)"),
+            {"table": table.name, "count": len(rows)}
+        ).scalars())
+        insert_rows(connection, table, [dict(row, id=row_id) for row, row_id in zip(rows, ids)])
+        return ids
+    return list(connection.execute(
+        insert(table).returning(table.c.id, sort_by_parameter_order=True), rows
+    ).scalars())
+
+
+def _insert_ignore_conflicts(connection: Connection, table, rows: List[dict]) -> None:
+    if not rows:
+        return
+    if connection.dialect.name == "postgresql":
+        statement = postgresql.insert(table).on_conflict_do_nothing()
+    elif connection.dialect.name == "sqlite":
+        statement = sqlite.insert(table).on_conflict_do_nothing()
+    else:
+        statement = insert(table)
+    connection.execute(statement, rows)
+
+
+# ==================== ЗАГРУЗКА ПАЧКИ ====================
+
+def resolve_publishers(connection: Connection, names: set, now: datetime) -> Tuple[Dict[str, int], int]:
+    """id издательств по названиям (недостающие создаются)"""
+    if not names:
+        return {}, 0
+
+    def lookup():
+        return dict(connection.execute(
+            select(Publisher.name, Publisher.id).where(Publisher.name.in_(names))
+        ).all())
+
+    found = lookup()
+    missing = names - set(found)
+    if not missing:
+        return found, 0
+    _insert_ignore_conflicts(connection, Publisher.__table__, [
+        {"name": name, "created_at": now, "updated_at": now} for name in sorted(missing)
+    ])
+    return lookup(), len(missing)
+
+
+def resolve_authors(connection: Connection, keys: set, now: datetime) -> Tuple[Dict[AuthorKey, int], int]:
+    """id авторов по (фамилия, имя, отчество) (недостающие создаются)"""
+    if not keys:
+        return {}, 0
+
+    found: Dict[AuthorKey, int] = {}
+    rows = connection.execute(
+        select(Author.id, Author.last_name, Author.first_name, Author.middle_name)
+        .where(Author.last_name.in_({key[0] for key in keys}))
+        .order_by(Author.id)
+    ).all()
+    for author_id, last_name, first_name, middle_name in rows:
+        found.setdefault((last_name, first_name, middle_name), author_id)
+
+    missing = sorted(keys - set(found), key=lambda key: (key[0], key[1], key[2] or ""))
+    ids = insert_returning_ids(connection, Author.__table__, [
+        {
+            "last_name": last_name,
+            "first_name": first_name,
+            "middle_name": middle_name,
+            "created_at": now,
+            "updated_at": now,
+        }
+        for last_name, first_name, middle_name in missing
+    ])
+    found.update(zip(missing, ids))
+    return {key: found[key] for key in keys}, len(missing)
+
+
+def load_chunk(connection: Connection, records: List[dict]) -> Dict[str, int]:
+    """Загрузить пачку проверенных записей в текущей транзакции"""
+    now = datetime.now()
+    today = date.today()
+    result = dict.fromkeys(
+        ("books", "copies", "authors", "publishers", "book_authors",
+         "skipped_books", "skipped_copies"),
+        0
+    )
+
+    # Книги с ISBN, который уже есть в базе или встречался в пачке, пропускаются
+    isbns = {record["isbn"] for record in records if record["isbn"]}
+    taken_isbns = set(connection.execute(
+        select(Book.isbn).where(Book.isbn.in_(isbns))
+    ).scalars()) if isbns else set()
+    books = []
+    for record in records:
+        if record["isbn"]:
+            if record["isbn"] in taken_isbns:
+                result["skipped_books"] += 1
+                continue
+            taken_isbns.add(record["isbn"])
+        books.append(record)
+    if not books:
+        return result
+
+    publishers, result["publishers"] = resolve_publishers(
+        connection, {book["publisher"] for book in books if book["publisher"]}, now
+    )
+    authors, result["authors"] = resolve_authors(
+        connection, {key for book in books for key in book["authors"]}, now
+    )
+
+    # Экземпляры с уже существующим инвентарным номером пропускаются;
+    # число экземпляров книги известно до её вставки
+    numbers = {number for book in books for number in book["copies"]}
+    taken_numbers = set(connection.execute(
+        select(BookCopy.inventory_number).where(BookCopy.inventory_number.in_(numbers))
+    ).scalars()) if numbers else set()
+    book_copies = []
+    for book in books:
+        accepted = []
+        for number in book["copies"]:
+            if number in taken_numbers:
+                result["skipped_copies"] += 1
+                continue
+            taken_numbers.add(number)
+            accepted.append(number)
+        book_copies.append(accepted)
+
+    book_ids = insert_returning_ids(connection, Book.__table__, [
+        {
+            "isbn": book["isbn"],
+            "title": book["title"],
+            "publisher_id": publishers.get(book["publisher"]),
+            "year": book["year"],
+            "genre": book["genre"],
+            "pages": book["pages"],
+            "language": book["language"],
+            "description": book["description"],
+            "date_added": today,
+            "location": book["location"],
+            "status": "available",
+            "total_copies": len(accepted),
+            "available_copies": len(accepted),
+            "created_at": now,
+            "updated_at": now,
+        }
+        for book, accepted in zip(books, book_copies)
+    ])
+    result["books"] = len(book_ids)
+
+    links = [
+        {"book_id": book_id, "author_id": authors[key], "created_at": now}
+        for book, book_id in zip(books, book_ids)
+        for key in book["authors"]
+    ]
+    insert_rows(connection, BookAuthorLink.__table__, links)
+    result["book_authors"] = len(links)
+
+    copies = [
+        {
+            "book_id": book_id,
+            "inventory_number": number,
+            "condition": book["condition"],
+            "status": "in_library",
+            "acquisition_date": book["acquisition_date"],
+            "price": book["price"],
+            "created_at": now,
+            "updated_at": now,
+        }
+        for book, book_id, accepted in zip(books, book_ids, book_copies)
+        for number in accepted
+    ]
+    insert_rows(connection, BookCopy.__table__, copies)
+    result["copies"] = len(copies)
+
+    # Производные данные - в той же транзакции
+    search.index_titles(connection, [(book_id, book["title"]) for book, book_id in zip(books, book_ids)])
+    connection.execute(counters.adjust_statement(
+        total_books=result["books"],
+        total_copies=result["copies"],
+        available_copies=result["copies"],
+    ))
+    connection.execute(etags.bump_statement(connection.dialect.name, [etags.BOOKS_SCOPE]))
+    return result
+
+
+# ==================== ЗАГРУЗКА ФАЙЛА ====================
+
+def import_catalog(
+    engine: Engine,
+    stream: TextIO,
+    file_format: str = "jsonl",
+    chunk_size: int = IMPORT_CHUNK_SIZE
+) -> dict:
+    """Загрузить каталог из потока, вернуть отчёт"""
+    if file_format not in FORMATS:
+        raise ValueError(f"Неизвестный формат: {file_format} (допустимо: {', '.join(FORMATS)})")
+
+    started = time.perf_counter()
+    with engine.begin() as connection:
+        search.init_search_index(connection)
+        counters.ensure_counters(connection)
+
+    report = {
+        "records": 0, "invalid": 0, "rejected": 0, "books": 0, "copies": 0, "authors": 0,
+        "publishers": 0, "book_authors": 0, "skipped_books": 0, "skipped_copies": 0,
+    }
+    errors: List[str] = []
+    records = read_records(stream, file_format)
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            break
+        valid = []
+        numbers = []
+        for number, raw in chunk:
+            try:
+                valid.append(parse_record(raw))
+                numbers.append(number)
+            except (ValueError, ArithmeticError, AttributeError, TypeError) as error:
+                report["invalid"] += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append(f"строка {number}: {error}")
+        report["records"] += len(chunk)
+        if not valid:
+            continue
+        try:
+            with engine.begin() as connection:
+                loaded = load_chunk(connection, valid)
+        except DBAPIError as error:
+            # Транзакция пачки откачена, предыдущие пачки уже загружены
+            report["rejected"] += len(valid)
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append(f"строки {numbers[0]}-{numbers[-1]}: пачка не загружена: {error.orig}")
+            continue
+        for name, value in loaded.items():
+            report[name] += value
+
+    seconds = time.perf_counter() - started
+    rows = report["books"] + report["copies"] + report["book_authors"]
+    report.update(
+        errors=errors,
+        seconds=round(seconds, 3),
+        records_per_second=round(report["records"] / seconds, 1) if seconds else 0.0,
+        rows_per_second=round(rows / seconds, 1) if seconds else 0.0,
+    )
+    return report
+
+
+if __name__ == "__main__":
+    from database import engine, init_db
+
+    parser = argparse.ArgumentParser(description="Массовая загрузка каталога")
+    parser.add_argument("path", help="файл JSONL или CSV")
+    parser.add_argument("--format", choices=FORMATS, help="формат (по умолчанию - по расширению)")
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE, help="записей в транзакции")
+    args = parser.parse_args()
+
+    init_db()
+    with open(args.path, encoding="utf-8", newline="") as stream:
+        report = import_catalog(
+            engine, stream, args.format or detect_format(args.path), args.chunk_size
+        )
+
+    for error in report.pop("errors"):
+        print(f"Ошибка: {error}")
+    for name, value in report.items():
+        print(f"{name}: {value}")
@@ -0,0 +1,452 @@
+"""
+Нагрузочный прогон API по воспроизводимым профилям
+
+Профиль - взвешенная смесь сценариев: просмотр каталога, поиск,
+выдача и возврат, опрос статистики. Последовательность сценариев и
+идентификаторов строится генератором случайных чисел с заданным --seed,
+поэтому при одинаковых данных два прогона отправляют одни и те же запросы
+и результаты можно сравнивать между коммитами.
+
+Приложение main.app запускается в процессе (httpx + ASGITransport),
+под uvicorn (--uvicorn, отдельный процесс) или берётся уже запущенное (--url).
+В базе должны быть данные (lab3/seed_data.py или lab3/generate_data.py).
+Выдачи, созданные прогоном, им же и закрываются.
+
+Результат - JSON: запросов в секунду и p50/p95/p99 по каждому endpoint'у.
+С --baseline результат сравнивается с прошлым прогоном, и при ухудшении
+больше чем на --tolerance скрипт завершается с кодом 1.
+
+Использование:
+    python loadtest.py --profile mixed --requests 5000 --output before.json
+    python loadtest.py --profile mixed --requests 5000 --baseline before.json
+    python loadtest.py --profile browsing --uvicorn --workers 4
+    python loadtest.py --profile circulation --url http://localhost:8000
+
+Автор: Софья Шипенкова
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+from sqlmodel import Session, select, and_
+
+from benchmark import make_client, percentile
+from database import engine, init_db
+from models import Book, BookCopy, Librarian, Loan, Reader
+
+
+# ==================== ПРОФИЛИ НАГРУЗКИ ====================
+
+# Вес сценария в смеси: сценарий выбирается с вероятностью вес / сумма весов
+PROFILES: Dict[str, Dict[str, int]] = {
+    "browsing": {
+        "books_page": 30,
+        "book": 40,
+        "book_copies": 15,
+        "book_available": 15,
+    },
+    "search": {
+        "search": 80,
+        "book": 20,
+    },
+    "circulation": {
+        "checkout_return": 70,
+        "reader_active_loans": 30,
+    },
+    "statistics": {
+        "statistics": 40,
+        "popular_books": 25,
+        "active_readers": 20,
+        "overdue": 15,
+    },
+    "mixed": {
+        "books_page": 20,
+        "book": 25,
+        "book_available": 10,
+        "search": 15,
+        "checkout_return": 10,
+        "reader_active_loans": 10,
+        "statistics": 5,
+        "popular_books": 3,
+        "overdue": 2,
+    },
+}
+
+# Сколько идентификаторов каждого вида берётся из базы
+SAMPLE_SIZE = 1000
+
+
+class Dataset:
+    """Идентификаторы из базы, по которым строятся запросы"""
+
+    def __init__(self, rng: random.Random):
+        with Session(engine) as session:
+            self.book_ids = list(session.exec(
+                select(Book.id).order_by(Book.id).limit(SAMPLE_SIZE)
+            ).all())
+            titles = session.exec(
+                select(Book.title).order_by(Book.id).limit(SAMPLE_SIZE)
+            ).all()
+            librarian_id = session.exec(select(Librarian.id).order_by(Librarian.id)).first()
+            # Для выдачи - активные читатели без выданных книг и экземпляры
+            # в библиотеке: так прогон не упирается в лимит max_books
+            reader_ids = list(session.exec(
+                select(Reader.id)
+                .where(and_(
+                    Reader.status == "active",
+                    ~select(Loan.id).where(and_(
+                        Loan.reader_id == Reader.id,
+                        Loan.status == "active"
+                    )).exists()
+                ))
+                .order_by(Reader.id)
+                .limit(SAMPLE_SIZE)
+            ).all())
+            copy_ids = list(session.exec(
+                select(BookCopy.id)
+                .where(BookCopy.status == "in_library")
+                .order_by(BookCopy.id)
+                .limit(SAMPLE_SIZE)
+            ).all())
+
+        if not self.book_ids or librarian_id is None:
+            raise SystemExit("База пуста: сначала заполните её (lab3/generate_data.py)")
+        self.librarian_id = librarian_id
+        self.search_terms = sorted({
+            word.lower() for title in titles for word in title.split() if len(word) >= 4
+        }) or ["книга"]
+        self.reader_ids = reader_ids
+        self.copy_ids = copy_ids
+
+        # Пулы читателей и экземпляров для выдачи: каждый занят одним
+        # сценарием выдачи и возврата, затем возвращается в пул
+        rng.shuffle(self.reader_ids)
+        rng.shuffle(self.copy_ids)
+        self.readers: Optional[asyncio.Queue] = None
+        self.copies: Optional[asyncio.Queue] = None
+
+    def open_pools(self) -> None:
+        """Создать пулы в текущем цикле событий"""
+        self.readers = asyncio.Queue()
+        self.copies = asyncio.Queue()
+        for reader_id in self.reader_ids:
+            self.readers.put_nowait(reader_id)
+        for copy_id in self.copy_ids:
+            self.copies.put_nowait(copy_id)
+
+
+# Результат одного запроса: endpoint, время (с), код ответа
+Sample = Tuple[str, float, int]
+Scenario = Callable[[httpx.AsyncClient, random.Random, Dataset, List[Sample]], Awaitable[None]]
+
+
+async def timed(
+    samples: List[Sample],
+    endpoint: str,
+    request: Awaitable[httpx.Response]
+) -> httpx.Response:
+    """Выполнить запрос и записать его время"""
+    started = time.perf_counter()
+    response = await request
+    samples.append((endpoint, time.perf_counter() - started, response.status_code))
+    return response
+
+
+# ==================== СЦЕНАРИИ ====================
+
+async def books_page(client, rng, data, samples):
+    await timed(samples, "GET /books", client.get("/books", params={"limit": 20}))
+
+
+async def book(client, rng, data, samples):
+    book_id = rng.choice(data.book_ids)
+    await timed(samples, "GET /books/{book_id}", client.get(f"/books/{book_id}"))
+
+
+async def book_copies(client, rng, data, samples):
+    book_id = rng.choice(data.book_ids)
+    await timed(samples, "GET /books/{book_id}/copies", client.get(f"/books/{book_id}/copies"))
+
+
+async def book_available(client, rng, data, samples):
+    book_id = rng.choice(data.book_ids)
+    await timed(
+        samples, "GET /books/{book_id}/available", client.get(f"/books/{book_id}/available")
+    )
+
+
+async def search(client, rng, data, samples):
+    term = rng.choice(data.search_terms)
+    await timed(
+        samples, "GET /books/search/{title_query}", client.get(f"/books/search/{term}")
+    )
+
+
+async def checkout_return(client, rng, data, samples):
+    """Выдать экземпляр и сразу вернуть его"""
+    if not data.reader_ids or not data.copy_ids:
+        raise SystemExit("Для выдачи нужны свободные читатели и экземпляры")
+    reader_id = await data.readers.get()
+    copy_id = await data.copies.get()
+    try:
+        response = await timed(samples, "POST /loans", client.post("/loans", json={
+            "copy_id": copy_id,
+            "reader_id": reader_id,
+            "librarian_id": data.librarian_id,
+        }))
+        if response.status_code == 201:
+            loan_id = response.json()["id"]
+            await timed(
+                samples, "POST /loans/{loan_id}/return",
+                client.post(f"/loans/{loan_id}/return", json={})
+            )
+    finally:
+        data.readers.put_nowait(reader_id)
+        data.copies.put_nowait(copy_id)
+
+
+async def reader_active_loans(client, rng, data, samples):
+    reader_id = rng.choice(data.reader_ids or [1])
+    await timed(
+        samples, "GET /readers/{reader_id}/active-loans",
+        client.get(f"/readers/{reader_id}/active-loans")
+    )
+
+
+async def statistics(client, rng, data, samples):
+    await timed(samples, "GET /statistics", client.get("/statistics"))
+
+
+async def popular_books(client, rng, data, samples):
+    await timed(samples, "GET /statistics/popular-books", client.get("/statistics/popular-books"))
+
+
+async def active_readers(client, rng, data, samples):
+    await timed(
+        samples, "GET /statistics/active-readers", client.get("/statistics/active-readers")
+    )
+
+
+async def overdue(client, rng, data, samples):
+    await timed(samples, "GET /loans/overdue", client.get("/loans/overdue"))
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    "books_page": books_page,
+    "book": book,
+    "book_copies": book_copies,
+    "book_available": book_available,
+    "search": search,
+    "checkout_return": checkout_return,
+    "reader_active_loans": reader_active_loans,
+    "statistics": statistics,
+    "popular_books": popular_books,
+    "active_readers": active_readers,
+    "overdue": overdue,
+}
+
+
+# ==================== ПРОГОН ====================
+
+def build_plan(profile: str, total: int, seed: int) -> List[Tuple[str, int]]:
+    """Последовательность сценариев и зёрен для них (зависит только от seed)"""
+    weights = PROFILES[profile]
+    rng = random.Random(seed)
+    names = rng.choices(list(weights), weights=list(weights.values()), k=total)
+    return [(name, rng.getrandbits(32)) for name in names]
+
+
+async def run_plan(
+    client: httpx.AsyncClient,
+    data: Dataset,
+    plan: List[Tuple[str, int]],
+    concurrency: int
+) -> Tuple[List[Sample], float]:
+    """Выполнить сценарии плана в concurrency параллельных клиентах"""
+    samples: List[Sample] = []
+    steps = iter(plan)
+
+    async def worker():
+        for name, seed in steps:
+            await SCENARIOS[name](client, random.Random(seed), data, samples)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples, time.perf_counter() - started
+
+
+def summarize(samples: List[Sample], elapsed: float) -> dict:
+    """Запросов в секунду и перцентили времени ответа по endpoint'ам"""
+    by_endpoint: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    for endpoint, latency, status_code in samples:
+        by_endpoint[endpoint].append(latency)
+        if status_code >= 400:
+            errors[endpoint] += 1
+
+    endpoints = {}
+    for endpoint in sorted(by_endpoint):
+        latencies = sorted(by_endpoint[endpoint])
+        endpoints[endpoint] = {
+            "requests": len(latencies),
+            "errors": errors[endpoint],
+            "rps": round(len(latencies) / elapsed, 1),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        }
+
+    latencies = sorted(latency for _, latency, _ in samples)
+    return {
+        "requests": len(samples),
+        "errors": sum(errors.values()),
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(samples) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "endpoints": endpoints,
+    }
+
+
+def git_revision() -> Optional[str]:
+    """Текущий коммит, чтобы результаты можно было сопоставить с кодом"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Endpoint'ы, где p95 вырос или запросов в секунду стало меньше больше чем на tolerance"""
+    regressions = []
+    for endpoint, current in result["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(endpoint)
+        if not before:
+            continue
+        if before["p95_ms"] and current["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{endpoint}: p95 {before['p95_ms']} -> {current['p95_ms']} мс"
+            )
+        if current["rps"] < before["rps"] * (1 - tolerance):
+            regressions.append(
+                f"{endpoint}: запросов/с {before['rps']} -> {current['rps']}"
+            )
+    return regressions
+
+
+# ==================== ЗАПУСК ПРИЛОЖЕНИЯ ====================
+
+def start_uvicorn(port: int, workers: int) -> subprocess.Popen:
+    """Запустить main:app под uvicorn и дождаться готовности"""
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "main:app",
+            "--port", str(port), "--workers", str(workers), "--log-level", "warning",
+        ],
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit("uvicorn завершился при запуске")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/", timeout=1)
+            return process
+        except httpx.TransportError:
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit("uvicorn не ответил за 30 с")
+
+
+async def run(args) -> dict:
+    from main import app
+
+    data = Dataset(random.Random(args.seed))
+    data.open_pools()
+    plan = build_plan(args.profile, args.requests, args.seed)
+    warmup = build_plan(args.profile, args.warmup, args.seed + 1)
+
+    async with make_client(app, args.url) as client:
+        if args.url:
+            await run_plan(client, data, warmup, args.concurrency)
+            samples, elapsed = await run_plan(client, data, plan, args.concurrency)
+        else:
+            # В процессе события startup выполняются вручную
+            async with app.router.lifespan_context(app):
+                await run_plan(client, data, warmup, args.concurrency)
+                samples, elapsed = await run_plan(client, data, plan, args.concurrency)
+
+    return {
+        "profile": args.profile,
+        "weights": PROFILES[args.profile],
+        "seed": args.seed,
+        "concurrency": args.concurrency,
+        "target": args.url or "in-process",
+        "database": engine.dialect.name,
+        "revision": git_revision(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        **summarize(samples, elapsed),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон API по профилям")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="mixed")
+    parser.add_argument("--requests", type=int, default=2000, help="сценариев в прогоне")
+    parser.add_argument("--warmup", type=int, default=200, help="сценариев для прогрева")
+    parser.add_argument("--concurrency", type=int, default=32, help="параллельных клиентов")
+    parser.add_argument("--seed", type=int, default=42, help="зерно последовательности запросов")
+    parser.add_argument("--url", help="адрес уже запущенного приложения")
+    parser.add_argument("--uvicorn", action="store_true", help="запустить приложение под uvicorn")
+    parser.add_argument("--port", type=int, default=8765, help="порт для --uvicorn")
+    parser.add_argument("--workers", type=int, default=1, help="процессов uvicorn")
+    parser.add_argument("--output", help="файл для результата (по умолчанию stdout)")
+    parser.add_argument("--baseline", help="результат прошлого прогона для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="допустимое ухудшение относительно --baseline (доля)")
+    args = parser.parse_args()
+
+    init_db()
+    server = None
+    if args.uvicorn:
+        server = start_uvicorn(args.port, args.workers)
+        args.url = f"http://127.0.0.1:{args.port}"
+    try:
+        result = asyncio.run(run(args))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    report = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(report + "\n")
+    else:
+        print(report)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+        if baseline.get("profile") != result["profile"] or baseline.get("seed") != result["seed"]:
+            sys.exit("Базовый прогон выполнен с другим профилем или seed")
+        regressions = compare(result, baseline, args.tolerance)
+        for line in regressions:
+            print(f"Ухудшение: {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,556 @@
+"""
+Выдача и возврат книг
+
+Выдача экземпляра не допускает гонок: строка читателя блокируется
+(SELECT ... FOR NO KEY UPDATE), поэтому параллельные выдачи одному
+читателю идут по очереди и не превышают max_books, а экземпляр переводится
+в on_loan условным UPDATE ... WHERE status = 'in_library' (или экземпляр
+отложен для этого читателя, см. reservations.py), который успевает
+выполнить только одна транзакция. В PostgreSQL проверка лимита,
+UPDATE экземпляра, INSERT выдачи и изменение резервации, счётчиков, числа
+экземпляров книги, ETag и рейтингов выполняются одним запросом (CTE):
+вместе с блокировкой читателя выдача - два запроса и commit.
+
+Выдача нескольких экземпляров одному читателю выполняется фиксированным
+числом запросов независимо от размера пакета: проверки читателя,
+библиотекаря и лимита выполняются один раз, экземпляры переводятся
+в on_loan одним UPDATE ... WHERE id IN (...), выдачи вставляются одним
+INSERT, а счётчики, число экземпляров книг, рейтинги и ETag обновляются
+по одному запросу на таблицу. Всё фиксируется одним commit.
+
+Возврат (например, книг из ящика возврата) устроен так же: выдачи
+закрываются и экземпляры возвращаются в библиотеку двумя UPDATE
+в одной транзакции, в ней же экземпляры откладываются для первых
+в очередях резерваций их книг. Возврат одной выдачи (close_loans)
+устроен так же, поэтому параллельные возвраты одной выдачи не меняют
+счётчики дважды.
+
+Автор: Софья Шипенкова
+"""
+
+from collections import Counter
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import insert, literal, literal_column, union_all, update
+from sqlmodel import select, and_, or_, func
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from models import (
+    Book, BookCopy, BookLoanRollup, LibraryCounters, Librarian, Loan, Reader,
+    ReaderLoanRollup, Reservation
+)
+from schemas import (
+    LoanBatchCreate, LoanBatchItem, LoanBatchResponse, LoanCreate, LoanResponse,
+    LoanReturnBatch, LoanReturnBatchItem, LoanReturnBatchResponse
+)
+import availability
+import counters
+import etags
+import overdue
+import reservations
+import rollups
+
+
+async def lock_reader(session: AsyncSession, reader_id: int) -> int:
+    """Проверить читателя и заблокировать его строку до конца транзакции
+
+    Возвращает max_books. Пока строка заблокирована, другие выдачи этому
+    читателю ждут, поэтому подсчёт его активных выдач остаётся верным
+    до commit. FOR NO KEY UPDATE не мешает вставке строк, ссылающихся
+    на читателя (выдач и резерваций других транзакций).
+    """
+    if session.bind.dialect.name == "postgresql":
+        statement = (
+            select(Reader.status, Reader.max_books)
+            .where(Reader.id == reader_id)
+            .with_for_update(key_share=True)
+        )
+    else:
+        # SQLite не поддерживает блокировку строк: UPDATE без изменений
+        # сразу захватывает блокировку записи всей базы
+        statement = (
+            update(Reader)
+            .where(Reader.id == reader_id)
+            .values(max_books=Reader.max_books)
+            .returning(Reader.status, Reader.max_books)
+        )
+    reader = (await session.execute(statement)).first()
+    if reader is None:
+        raise HTTPException(status_code=404, detail="Читатель не найден")
+    if reader.status != "active":
+        raise HTTPException(status_code=400, detail="Читатель не активен")
+    return reader.max_books
+
+
+def active_loans_count(reader_id: int):
+    """Подзапрос: число активных выдач читателя"""
+    return select(func.count(Loan.id)).where(
+        and_(
+            Loan.reader_id == reader_id,
+            Loan.status == "active"
+        )
+    ).scalar_subquery()
+
+
+# ==================== ВЫДАЧА ЭКЗЕМПЛЯРА ====================
+
+def obtainable(reader_id: int):
+    """Условие: экземпляр в библиотеке или отложен для этого читателя"""
+    return or_(
+        BookCopy.status == "in_library",
+        and_(
+            BookCopy.status == reservations.HELD_COPY_STATUS,
+            reservations.held_for(BookCopy.id, reader_id)
+        )
+    )
+
+
+def held_column(reader_id: int):
+    """Колонка held для RETURNING: экземпляр был отложен для читателя
+
+    В RETURNING колонки выводятся без имени таблицы, и в подзапросе
+    id относился бы к reservations, поэтому экземпляр указан явно.
+    """
+    copy_id = literal_column(f"{BookCopy.__tablename__}.id")
+    return reservations.held_for(copy_id, reader_id).label("held")
+
+
+def _take_copy(loan_data: LoanCreate, max_books: int):
+    """UPDATE экземпляра в on_loan, если его можно выдать читателю, лимит
+    не исчерпан и библиотекарь существует
+
+    held в RETURNING - экземпляр был отложен для читателя (резервация
+    ещё в статусе ready).
+    """
+    return (
+        update(BookCopy)
+        .where(and_(
+            BookCopy.id == loan_data.copy_id,
+            obtainable(loan_data.reader_id),
+            active_loans_count(loan_data.reader_id) < max_books,
+            select(Librarian.id).where(Librarian.id == loan_data.librarian_id).exists()
+        ))
+        .values(status="on_loan")
+        .returning(
+            BookCopy.id,
+            BookCopy.book_id,
+            held_column(loan_data.reader_id)
+        )
+    )
+
+
+def _new_loan(loan_data: LoanCreate) -> dict:
+    today = date.today()
+    return Loan(
+        copy_id=loan_data.copy_id,
+        reader_id=loan_data.reader_id,
+        librarian_id=loan_data.librarian_id,
+        loan_date=today,
+        due_date=today + timedelta(days=loan_data.loan_days),
+        status="active"
+    ).model_dump(exclude={"id"})
+
+
+def checkout_statement(loan_data: LoanCreate, max_books: int):
+    """Один запрос PostgreSQL: выдача вместе с производными данными (CTE)
+
+        WITH taken    AS (UPDATE book_copies ... RETURNING id, book_id, held),
+             created  AS (INSERT INTO loans ... SELECT ... FROM taken RETURNING *),
+             picked   AS (UPDATE reservations ... WHERE copy_id IN (отложенный из taken)),
+             counted  AS (UPDATE library_counters ... WHERE EXISTS (created)),
+             adjusted AS (UPDATE books ... WHERE id IN (неотложенный из taken)),
+             versions AS (INSERT INTO catalog_versions ... ON CONFLICT ...),
+             book_rollup, reader_rollup AS (INSERT ... ON CONFLICT ...)
+        SELECT created.*, taken.book_id, taken.held FROM created JOIN taken ...
+
+    Подзапросы CTE выполняются одновременно, поэтому порядок блокировок
+    задан ссылками между ними: экземпляр, резервация, строка счётчиков,
+    затем остальное. Строку счётчиков меняют все выдачи и возвраты, так
+    что следующие за ней блокировки порядка не требуют. Счётчик ETag списка
+    книг увеличивается, только если у книги не осталось доступных
+    экземпляров (см. availability.py).
+
+    Если экземпляр недоступен или лимит исчерпан, строк нет и ничего
+    не меняется.
+    """
+    taken = _take_copy(loan_data, max_books).cte("taken")
+    values = _new_loan(loan_data)
+    columns = Loan.__table__.c
+    created = (
+        insert(Loan)
+        .from_select(
+            list(values),
+            select(*(
+                taken.c.id.label(name) if name == "copy_id"
+                else literal(value, columns[name].type).label(name)
+                for name, value in values.items()
+            ))
+        )
+        .returning(*columns)
+        .cte("created")
+    )
+    picked = (
+        reservations.picked_up_statement(
+            loan_data.reader_id, select(taken.c.id).where(taken.c.held)
+        )
+        .returning(Reservation.copy_id)
+        .cte("picked")
+    )
+    # Отложенный экземпляр уже не числился доступным
+    loans_count = select(func.count()).select_from(created).scalar_subquery()
+    held_count = select(func.count()).select_from(picked).scalar_subquery()
+    counted = (
+        counters.adjust_statement()
+        .where(select(created.c.id).exists())
+        .values(
+            active_loans=LibraryCounters.active_loans + loans_count,
+            available_copies=LibraryCounters.available_copies - loans_count + held_count,
+        )
+        .returning(LibraryCounters.id)
+        .cte("counted")
+    )
+    adjusted = (
+        update(Book)
+        .where(and_(
+            Book.id.in_(select(taken.c.book_id).where(~taken.c.held)),
+            select(counted.c.id).exists()
+        ))
+        .values(available_copies=Book.available_copies - 1)
+        .returning(Book.id, Book.available_copies)
+        .cte("adjusted")
+    )
+    versions = etags.bump_from_select(union_all(
+        select(func.concat("copies:", taken.c.book_id).label("scope")),
+        select(func.concat("book:", adjusted.c.id).label("scope")),
+        select(literal(etags.BOOKS_SCOPE).label("scope"))
+        .where(adjusted.c.available_copies == 0),
+    )).cte("versions")
+    month = rollups.month_start(date.today())
+    book_rollup = rollups.upsert_from_select(BookLoanRollup, "book_id", select(
+        literal(month), taken.c.book_id, literal(1)
+    ).where(select(counted.c.id).exists())).cte("book_rollup")
+    reader_rollup = rollups.upsert_from_select(ReaderLoanRollup, "reader_id", select(
+        literal(month), literal(loan_data.reader_id), literal(1)
+    ).where(select(counted.c.id).exists())).cte("reader_rollup")
+    return (
+        select(created, taken.c.book_id, taken.c.held)
+        .join(taken, taken.c.id == created.c.copy_id)
+        .add_cte(picked, counted, adjusted, versions, book_rollup, reader_rollup)
+    )
+
+
+async def _checkout_refused(session: AsyncSession, loan_data: LoanCreate, max_books: int) -> HTTPException:
+    """Причина, по которой экземпляр не выдан (только при отказе)"""
+    status = (await session.exec(
+        select(BookCopy.status).where(BookCopy.id == loan_data.copy_id)
+    )).first()
+    if status is None:
+        return HTTPException(status_code=404, detail="Экземпляр не найден")
+    if status == reservations.HELD_COPY_STATUS:
+        return HTTPException(status_code=400, detail="Экземпляр отложен для другого читателя")
+    if status != "in_library":
+        return HTTPException(status_code=400, detail="Экземпляр недоступен для выдачи")
+    if not await session.get(Librarian, loan_data.librarian_id):
+        return HTTPException(status_code=404, detail="Библиотекарь не найден")
+    return HTTPException(
+        status_code=400,
+        detail=f"Превышен лимит выдач. Максимум: {max_books}"
+    )
+
+
+async def _checkout_steps(session: AsyncSession, loan_data: LoanCreate, max_books: int):
+    """Выдача отдельными запросами (SQLite: UPDATE в CTE не поддерживается,
+    а запросы к базе в процессе не требуют обращений по сети)
+
+    Возвращает строку экземпляра (book_id, held) и выдачу или (None, None).
+    """
+    row = (await session.execute(_take_copy(loan_data, max_books))).first()
+    if not row:
+        return None, None
+    loan = (await session.scalars(
+        insert(Loan).returning(Loan), [_new_loan(loan_data)]
+    )).one()
+
+    # Отложенный экземпляр уже не числился доступным
+    if row.held:
+        await reservations.picked_up(session, loan.reader_id, [loan.copy_id])
+        await counters.adjust(session, active_loans=1)
+        await etags.bump(session, etags.copies_scope(row.book_id))
+    else:
+        await counters.adjust(session, available_copies=-1, active_loans=1)
+        await availability.adjust(session, {row.book_id: -1})
+    await rollups.loan_created(session, row.book_id, loan.reader_id, loan.loan_date)
+    return row, loan
+
+
+async def checkout(session: AsyncSession, loan_data: LoanCreate) -> Loan:
+    """Выдать экземпляр читателю
+
+    В PostgreSQL - два запроса: блокировка читателя и CTE, который выдаёт
+    экземпляр и обновляет резервацию, счётчики, число экземпляров книги,
+    ETag и рейтинги. Блокировка читателя - отдельный запрос: подсчёт его
+    выдач в CTE должен видеть выдачи, завершённые во время ожидания.
+    """
+    max_books = await lock_reader(session, loan_data.reader_id)
+
+    if session.bind.dialect.name == "postgresql":
+        row = (await session.execute(checkout_statement(loan_data, max_books))).first()
+        loan = Loan.model_validate(row._mapping) if row else None
+    else:
+        row, loan = await _checkout_steps(session, loan_data, max_books)
+    if not row:
+        raise await _checkout_refused(session, loan_data, max_books)
+    book_id = row.book_id
+    await session.commit()
+    await availability.invalidate([book_id])
+    return loan
+
+
+# ==================== ПАКЕТНАЯ ВЫДАЧА ====================
+
+async def checkout_batch(session: AsyncSession, batch: LoanBatchCreate) -> LoanBatchResponse:
+    """Выдать читателю несколько экземпляров, вернуть результат по каждому
+
+    Экземпляры выдаются в порядке запроса, пока не исчерпан лимит
+    читателя (max_books с учётом уже выданных книг).
+    """
+    # Проверка и блокировка читателя: параллельные выдачи ему ждут commit
+    max_books = await lock_reader(session, batch.reader_id)
+
+    # Проверка библиотекаря
+    librarian = await session.get(Librarian, batch.librarian_id)
+    if not librarian:
+        raise HTTPException(status_code=404, detail="Библиотекарь не найден")
+
+    # Сколько книг ещё можно выдать
+    active_loans = (await session.exec(select(active_loans_count(batch.reader_id)))).one()
+    allowance = max(0, max_books - active_loans)
+
+    # Состояние всех запрошенных экземпляров одним запросом; отложенные
+    # экземпляры выдаются, только если они отложены для этого читателя
+    statuses = dict((await session.exec(
+        select(BookCopy.id, BookCopy.status).where(BookCopy.id.in_(set(batch.copy_ids)))
+    )).all())
+    reserved = [
+        copy_id for copy_id, status in statuses.items()
+        if status == reservations.HELD_COPY_STATUS
+    ]
+    held_for_reader = set((await session.exec(
+        select(Reservation.copy_id).where(and_(
+            Reservation.reader_id == batch.reader_id,
+            Reservation.status == reservations.HELD,
+            Reservation.copy_id.in_(reserved)
+        ))
+    )).all()) if reserved else set()
+
+    items = [LoanBatchItem(copy_id=copy_id, status="") for copy_id in batch.copy_ids]
+    chosen: Dict[int, LoanBatchItem] = {}
+    seen = set()
+    for item in items:
+        if item.copy_id in seen:
+            item.status = "duplicate"
+        elif item.copy_id not in statuses:
+            item.status = "not_found"
+        elif statuses[item.copy_id] != "in_library" and item.copy_id not in held_for_reader:
+            item.status = "unavailable"
+        elif len(chosen) >= allowance:
+            item.status = "limit_exceeded"
+        else:
+            chosen[item.copy_id] = item
+        seen.add(item.copy_id)
+
+    if not chosen:
+        return LoanBatchResponse(reader_id=batch.reader_id, created=0, items=items)
+
+    # Статус мог измениться после чтения, поэтому выдаются только
+    # экземпляры, которые UPDATE действительно застал в библиотеке
+    taken_rows = (await session.execute(
+        update(BookCopy)
+        .where(and_(
+            BookCopy.id.in_(chosen),
+            obtainable(batch.reader_id)
+        ))
+        .values(status="on_loan")
+        .returning(
+            BookCopy.id,
+            BookCopy.book_id,
+            held_column(batch.reader_id)
+        )
+    )).all()
+    taken = {row.id: row.book_id for row in taken_rows}
+    held = [row.id for row in taken_rows if row.held]
+    for copy_id, item in chosen.items():
+        if copy_id not in taken:
+            item.status = "unavailable"
+    if not taken:
+        return LoanBatchResponse(reader_id=batch.reader_id, created=0, items=items)
+
+    # Все выдачи одним INSERT
+    today = date.today()
+    rows = [
+        Loan(
+            copy_id=copy_id,
+            reader_id=batch.reader_id,
+            librarian_id=batch.librarian_id,
+            loan_date=today,
+            due_date=today + timedelta(days=batch.loan_days),
+            status="active"
+        ).model_dump(exclude={"id"})
+        for copy_id in chosen
+        if copy_id in taken
+    ]
+    loans: List[Loan] = list(
+        (await session.scalars(insert(Loan).returning(Loan), rows)).all()
+    )
+
+    count = len(loans)
+    await reservations.picked_up(session, batch.reader_id, held)
+    await counters.adjust(session, available_copies=-(count - len(held)), active_loans=count)
+    await rollups.loans_created(
+        session,
+        [(taken[loan.copy_id], loan.reader_id, loan.loan_date) for loan in loans]
+    )
+    available = Counter(book_id for copy_id, book_id in taken.items() if copy_id not in held)
+    book_ids = await availability.adjust(
+        session, {book_id: -taken_count for book_id, taken_count in available.items()}
+    )
+    if held:
+        await etags.bump(session, *(etags.copies_scope(taken[copy_id]) for copy_id in held))
+    await session.commit()
+    await availability.invalidate(book_ids)
+
+    for loan in loans:
+        item = chosen[loan.copy_id]
+        item.status = "created"
+        item.loan = LoanResponse.model_validate(loan)
+    return LoanBatchResponse(reader_id=batch.reader_id, created=count, items=items)
+
+
+# ==================== ПАКЕТНЫЙ ВОЗВРАТ ====================
+
+async def return_batch(session: AsyncSession, batch: LoanReturnBatch) -> LoanReturnBatchResponse:
+    """Закрыть выдачи по ID или инвентарным номерам экземпляров
+
+    Результат возвращается по каждому ключу: сначала loan_ids, затем
+    inventory_numbers, в порядке запроса.
+    """
+    # Статусы выдач, заданных по ID
+    loan_statuses: Dict[int, str] = {}
+    if batch.loan_ids:
+        loan_statuses = dict((await session.exec(
+            select(Loan.id, Loan.status).where(Loan.id.in_(set(batch.loan_ids)))
+        )).all())
+
+    # Активные выдачи экземпляров, заданных инвентарными номерами
+    copy_loans: Dict[str, Optional[int]] = {}
+    if batch.inventory_numbers:
+        copy_loans = dict((await session.exec(
+            select(BookCopy.inventory_number, Loan.id)
+            .outerjoin(Loan, and_(Loan.copy_id == BookCopy.id, Loan.status == "active"))
+            .where(BookCopy.inventory_number.in_(set(batch.inventory_numbers)))
+        )).all())
+
+    items: List[LoanReturnBatchItem] = []
+    chosen: Dict[int, LoanReturnBatchItem] = {}
+    seen = set()
+    for loan_id in batch.loan_ids:
+        item = LoanReturnBatchItem(loan_id=loan_id, status="")
+        if loan_id in seen:
+            item.status = "duplicate"
+        elif loan_id not in loan_statuses:
+            item.status = "not_found"
+        elif loan_statuses[loan_id] != "active":
+            item.status = "already_returned"
+        else:
+            chosen[loan_id] = item
+        seen.add(loan_id)
+        items.append(item)
+    for inventory_number in batch.inventory_numbers:
+        item = LoanReturnBatchItem(inventory_number=inventory_number, status="")
+        loan_id = copy_loans.get(inventory_number)
+        item.loan_id = loan_id
+        if inventory_number in seen or loan_id in chosen:
+            item.status = "duplicate"
+        elif inventory_number not in copy_loans:
+            item.status = "not_found"
+        elif loan_id is None:
+            item.status = "not_on_loan"
+        else:
+            chosen[loan_id] = item
+        seen.add(inventory_number)
+        items.append(item)
+
+    if not chosen:
+        return LoanReturnBatchResponse(returned=0, items=items)
+
+    returned = await close_loans(session, list(chosen))
+    returned_ids = {loan.id for loan in returned}
+    for loan_id, item in chosen.items():
+        if loan_id not in returned_ids:
+            item.status = "already_returned"
+
+    for loan in returned:
+        item = chosen[loan.id]
+        item.status = "returned"
+        item.loan = LoanResponse.model_validate(loan)
+    return LoanReturnBatchResponse(returned=len(returned), items=items)
+
+
+async def close_loans(
+    session: AsyncSession,
+    loan_ids: List[int],
+    fine_amount: Optional[Decimal] = None
+) -> List[Loan]:
+    """Закрыть выдачи и вернуть их экземпляры, зафиксировать транзакцию
+
+    Закрываются только выдачи, которые UPDATE застал активными: при
+    параллельных возвратах одной выдачи счётчики, число экземпляров
+    и очередь резерваций меняет только одна транзакция. Без fine_amount
+    штраф считается по тарифу на дату возврата (overdue.py). Возвращает
+    закрытые выдачи.
+    """
+    today = date.today()
+    if fine_amount is None:
+        fine_amount = overdue.fine_expression(session.bind.dialect.name, today)
+    returned: List[Loan] = list((await session.scalars(
+        update(Loan)
+        .where(and_(Loan.id.in_(sorted(loan_ids)), Loan.status == "active"))
+        .values(
+            status="returned",
+            return_date=today,
+            fine_amount=fine_amount,
+            fine_assessed_on=today,
+            updated_at=datetime.now(),
+        )
+        .returning(Loan),
+        execution_options={"synchronize_session": False}
+    )).all())
+    if not returned:
+        await session.rollback()
+        return []
+
+    # Экземпляры возвращаются в библиотеку одним UPDATE, затем
+    # откладываются для первых в очередях резерваций их книг
+    copies = dict((await session.execute(
+        update(BookCopy)
+        .where(and_(
+            BookCopy.id.in_([loan.copy_id for loan in returned]),
+            BookCopy.status != "in_library"
+        ))
+        .values(status="in_library")
+        .returning(BookCopy.id, BookCopy.book_id)
+    )).all())
+
+    allocated = await reservations.allocate(session, copies)
+    await reservations.hold_copies(session, allocated)
+
+    await counters.loans_returned(session, returned, len(copies) - len(allocated))
+    book_ids = await availability.adjust(session, Counter(
+        book_id for copy_id, book_id in copies.items() if copy_id not in allocated
+    ))
+    await session.commit()
+    await availability.invalidate(book_ids)
+    return returned
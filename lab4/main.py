@@ -1,481 +1,819 @@
-"""
-FastAPI приложение для системы управления библиотекой
-
-Автор: Софья Шипенкова
-"""
-
-from datetime import date, timedelta
-from typing import List, Optional
-from fastapi import FastAPI, HTTPException, Depends
-from sqlmodel import Session, select, and_, func
-from decimal import Decimal
-
-from database import get_session, init_db
-from models import (
-    Book, BookCopy, Reader, Librarian, Loan, Reservation,
-    BookAuthorLink, Author
-)
-from schemas import (
-    BookCreate, BookResponse, ReaderCreate, ReaderResponse,
-    LoanCreate, LoanResponse, LoanReturn, ReservationCreate,
-    ReservationResponse, LibraryStatistics, PopularBook, ActiveReader, UpdateReservation
-)
-
-app = FastAPI(
-    title="Библиотечная система API",
-    description="API для управления библиотекой",
-    version="1.0.0"
-)
-
-
-@app.on_event("startup")
-def on_startup():
-    """Инициализация базы данных при запуске"""
-    init_db()
-
-
-# ==================== ENDPOINTS ДЛЯ КНИГ ====================
-
-@app.get("/books", response_model=List[BookResponse])
-def get_books(
-    skip: int = 0,
-    limit: int = 100,
-    session: Session = Depends(get_session)
-):
-    """Получить список всех книг"""
-    statement = select(Book).offset(skip).limit(limit)
-    books = session.exec(statement).all()
-    return list(books)
-
-
-@app.get("/books/{book_id}", response_model=BookResponse)
-def get_book(book_id: int, session: Session = Depends(get_session)):
-    """Получить книгу по ID"""
-    book = session.get(Book, book_id)
-    if not book:
-        raise HTTPException(status_code=404, detail="Книга не найдена")
-    return book
-
-
-@app.get("/books/search/{title_query}", response_model=List[BookResponse])
-def search_books(title_query: str, session: Session = Depends(get_session)):
-    """Поиск книг по названию"""
-    statement = select(Book).where(Book.title.ilike(f"%{title_query}%"))
-    books = session.exec(statement).all()
-    return list(books)
-
-
-@app.post("/books", response_model=BookResponse, status_code=201)
-def create_book(book: BookCreate, session: Session = Depends(get_session)):
-    """Создать новую книгу"""
-    db_book = Book(**book.dict())
-    session.add(db_book)
-    session.commit()
-    session.refresh(db_book)
-    return db_book
-
-
-@app.get("/books/{book_id}/copies", response_model=List[dict])
-def get_book_copies(book_id: int, session: Session = Depends(get_session)):
-    """Получить все экземпляры книги"""
-    statement = select(BookCopy).where(BookCopy.book_id == book_id)
-    copies = session.exec(statement).all()
-    return [
-        {
-            "id": copy.id,
-            "inventory_number": copy.inventory_number,
-            "condition": copy.condition,
-            "status": copy.status
-        }
-        for copy in copies
-    ]
-
-
-@app.get("/books/{book_id}/available", response_model=List[dict])
-def get_available_copies(book_id: int, session: Session = Depends(get_session)):
-    """Получить доступные экземпляры книги"""
-    statement = select(BookCopy).where(
-        and_(
-            BookCopy.book_id == book_id,
-            BookCopy.status == "in_library"
-        )
-    )
-    copies = session.exec(statement).all()
-    return [
-        {
-            "id": copy.id,
-            "inventory_number": copy.inventory_number,
-            "condition": copy.condition
-        }
-        for copy in copies
-    ]
-
-
-# ==================== ENDPOINTS ДЛЯ ЧИТАТЕЛЕЙ ====================
-
-@app.get("/readers", response_model=List[ReaderResponse])
-def get_readers(
-    skip: int = 0,
-    limit: int = 100,
-    session: Session = Depends(get_session)
-):
-    """Получить список всех читателей"""
-    statement = select(Reader).offset(skip).limit(limit)
-    readers = session.exec(statement).all()
-    return list(readers)
-
-
-@app.get("/readers/{reader_id}", response_model=ReaderResponse)
-def get_reader(reader_id: int, session: Session = Depends(get_session)):
-    """Получить читателя по ID"""
-    reader = session.get(Reader, reader_id)
-    if not reader:
-        raise HTTPException(status_code=404, detail="Читатель не найден")
-    return reader
-
-
-@app.get("/readers/card/{card_number}", response_model=ReaderResponse)
-def get_reader_by_card(card_number: str, session: Session = Depends(get_session)):
-    """Получить читателя по номеру читательского билета"""
-    statement = select(Reader).where(Reader.library_card_number == card_number)
-    reader = session.exec(statement).first()
-    if not reader:
-        raise HTTPException(status_code=404, detail="Читатель не найден")
-    return reader
-
-
-@app.post("/readers", response_model=ReaderResponse, status_code=201)
-def create_reader(reader: ReaderCreate, session: Session = Depends(get_session)):
-    """Создать нового читателя"""
-    # Проверка уникальности номера билета
-    statement = select(Reader).where(Reader.library_card_number == reader.library_card_number)
-    existing = session.exec(statement).first()
-    if existing:
-        raise HTTPException(status_code=400, detail="Читатель с таким номером билета уже существует")
-    
-    db_reader = Reader(**reader.dict())
-    session.add(db_reader)
-    session.commit()
-    session.refresh(db_reader)
-    return db_reader
-
-
-@app.get("/readers/{reader_id}/loans", response_model=List[LoanResponse])
-def get_reader_loans(reader_id: int, session: Session = Depends(get_session)):
-    """Получить все выдачи читателя"""
-    statement = select(Loan).where(Loan.reader_id == reader_id)
-    loans = session.exec(statement).all()
-    return list(loans)
-
-
-@app.get("/readers/{reader_id}/active-loans", response_model=List[LoanResponse])
-def get_reader_active_loans(reader_id: int, session: Session = Depends(get_session)):
-    """Получить активные выдачи читателя"""
-    statement = select(Loan).where(
-        and_(
-            Loan.reader_id == reader_id,
-            Loan.status == "active"
-        )
-    )
-    loans = session.exec(statement).all()
-    return list(loans)
-
-
-# ==================== ENDPOINTS ДЛЯ ВЫДАЧ ====================
-
-@app.post("/loans", response_model=LoanResponse, status_code=201)
-def create_loan(loan_data: LoanCreate, session: Session = Depends(get_session)):
-    """Создать новую выдачу книги"""
-    # Проверка доступности экземпляра
-    copy = session.get(BookCopy, loan_data.copy_id)
-    if not copy:
-        raise HTTPException(status_code=404, detail="Экземпляр не найден")
-    if copy.status != "in_library":
-        raise HTTPException(status_code=400, detail="Экземпляр недоступен для выдачи")
-    
-    # Проверка читателя
-    reader = session.get(Reader, loan_data.reader_id)
-    if not reader:
-        raise HTTPException(status_code=404, detail="Читатель не найден")
-    if reader.status != "active":
-        raise HTTPException(status_code=400, detail="Читатель не активен")
-    
-    # Проверка лимита
-    active_loans_count = session.exec(
-        select(func.count(Loan.id)).where(
-            and_(
-                Loan.reader_id == loan_data.reader_id,
-                Loan.status == "active"
-            )
-        )
-    ).one()
-    
-    if active_loans_count >= reader.max_books:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Превышен лимит выдач. Максимум: {reader.max_books}"
-        )
-    
-    # Проверка библиотекаря
-    librarian = session.get(Librarian, loan_data.librarian_id)
-    if not librarian:
-        raise HTTPException(status_code=404, detail="Библиотекарь не найден")
-    
-    # Создание выдачи
-    loan = Loan(
-        copy_id=loan_data.copy_id,
-        reader_id=loan_data.reader_id,
-        librarian_id=loan_data.librarian_id,
-        loan_date=date.today(),
-        due_date=date.today() + timedelta(days=loan_data.loan_days),
-        status="active"
-    )
-    
-    # Обновление статуса экземпляра
-    copy.status = "on_loan"
-    
-    session.add(loan)
-    session.commit()
-    session.refresh(loan)
-    
-    return loan
-
-
-@app.post("/loans/{loan_id}/return", response_model=LoanResponse)
-def return_loan(
-    loan_id: int,
-    loan_return: LoanReturn,
-    session: Session = Depends(get_session)
-):
-    """Вернуть книгу"""
-    loan = session.get(Loan, loan_id)
-    if not loan:
-        raise HTTPException(status_code=404, detail="Выдача не найдена")
-    if loan.status != "active":
-        raise HTTPException(status_code=400, detail="Выдача уже закрыта")
-    
-    # Обновление выдачи
-    loan.return_date = date.today()
-    loan.status = "returned"
-    loan.fine_amount = loan_return.fine_amount
-    
-    # Обновление статуса экземпляра
-    copy = session.get(BookCopy, loan.copy_id)
-    if copy:
-        copy.status = "in_library"
-    
-    session.commit()
-    session.refresh(loan)
-    
-    return loan
-
-
-@app.get("/loans/overdue", response_model=List[LoanResponse])
-def get_overdue_loans(session: Session = Depends(get_session)):
-    """Получить все просроченные выдачи"""
-    today = date.today()
-    statement = select(Loan).where(
-        and_(
-            Loan.status == "active",
-            Loan.due_date < today
-        )
-    )
-    loans = session.exec(statement).all()
-    return list(loans)
-
-
-# ==================== ENDPOINTS ДЛЯ РЕЗЕРВАЦИЙ ====================
-
-@app.post("/reservations", response_model=ReservationResponse, status_code=201)
-def create_reservation(
-    reservation_data: ReservationCreate,
-    session: Session = Depends(get_session)
-):
-    """Создать резервацию книги"""
-    # Проверка наличия доступных экземпляров
-    available_copies = session.exec(
-        select(BookCopy).where(
-            and_(
-                BookCopy.book_id == reservation_data.book_id,
-                BookCopy.status == "in_library"
-            )
-        )
-    ).all()
-    
-    if available_copies:
-        raise HTTPException(
-            status_code=400,
-            detail="Книга доступна, резервация не требуется"
-        )
-    
-    # Проверка существующей резервации
-    existing = session.exec(
-        select(Reservation).where(
-            and_(
-                Reservation.book_id == reservation_data.book_id,
-                Reservation.reader_id == reservation_data.reader_id,
-                Reservation.status == "active"
-            )
-        )
-    ).first()
-    
-    if existing:
-        return existing
-    
-    # Проверка читателя
-    reader = session.get(Reader, reservation_data.reader_id)
-    if not reader:
-        raise HTTPException(status_code=404, detail="Читатель не найден")
-    
-    # Проверка книги
-    book = session.get(Book, reservation_data.book_id)
-    if not book:
-        raise HTTPException(status_code=404, detail="Книга не найдена")
-    
-    # Создание резервации
-    reservation = Reservation(
-        book_id=reservation_data.book_id,
-        reader_id=reservation_data.reader_id,
-        reservation_date=date.today(),
-        expiry_date=date.today() + timedelta(days=reservation_data.expiry_days),
-        status="active"
-    )
-    
-    session.add(reservation)
-    session.commit()
-    session.refresh(reservation)
-    
-    return reservation
-
-
-@app.get("/reservations/book/{book_id}", response_model=List[ReservationResponse])
-def get_book_reservations(book_id: int, session: Session = Depends(get_session)):
-    """Получить все активные резервации для книги"""
-    statement = select(Reservation).where(
-        and_(
-            Reservation.book_id == book_id,
-            Reservation.status == "active"
-        )
-    ).order_by(Reservation.reservation_date)
-    reservations = session.exec(statement).all()
-    return list(reservations)
-
-
-@app.delete("/reservations/{pk}")
-def delete_reservation(pk: int, session: Session = Depends(get_session)) -> None:
-    session.delete(session.exec(select(Reservation).where(Reservation.id == pk)))
-    session.commit()
-
-@app.patch("/reservations")
-def update_reservation(pk: int, payload: UpdateReservation, session: Session = Depends(get_session)) -> ReservationResponse:
-    payload_data = payload.model_validate()
-    reservation = session.execute(select(Reservation).where(Reservation.id == pk))
-    if not reservation:
-        raise Exception('reservation not found')
-    for key, val in payload_data.items():
-        setattr(reservation, key, val)
-    session.commit()
-    session.refresh(reservation)
-    response = ReservationResponse(**vars(reservation))
-    return response
-
-# ==================== ENDPOINTS ДЛЯ СТАТИСТИКИ ====================
-
-@app.get("/statistics", response_model=LibraryStatistics)
-def get_statistics(session: Session = Depends(get_session)):
-    """Получить общую статистику библиотеки"""
-    total_books = session.exec(select(func.count(Book.id))).one()
-    total_copies = session.exec(select(func.count(BookCopy.id))).one()
-    available_copies = session.exec(
-        select(func.count(BookCopy.id)).where(BookCopy.status == "in_library")
-    ).one()
-    total_readers = session.exec(select(func.count(Reader.id))).one()
-    active_readers = session.exec(
-        select(func.count(Reader.id)).where(Reader.status == "active")
-    ).one()
-    active_loans = session.exec(
-        select(func.count(Loan.id)).where(Loan.status == "active")
-    ).one()
-    
-    today = date.today()
-    overdue_loans = session.exec(
-        select(func.count(Loan.id)).where(
-            and_(
-                Loan.status == "active",
-                Loan.due_date < today
-            )
-        )
-    ).one()
-    
-    return LibraryStatistics(
-        total_books=total_books,
-        total_copies=total_copies,
-        available_copies=available_copies,
-        on_loan_copies=total_copies - available_copies,
-        total_readers=total_readers,
-        active_readers=active_readers,
-        active_loans=active_loans,
-        overdue_loans=overdue_loans
-    )
-
-
-@app.get("/statistics/popular-books", response_model=List[PopularBook])
-def get_popular_books(limit: int = 10, session: Session = Depends(get_session)):
-    """Получить самые популярные книги"""
-    statement = (
-        select(
-            Book.id,
-            Book.title,
-            func.count(Loan.id).label("loan_count")
-        )
-        .join(BookCopy)
-        .join(Loan)
-        .group_by(Book.id, Book.title)
-        .order_by(func.count(Loan.id).desc())
-        .limit(limit)
-    )
-    results = session.exec(statement).all()
-    return [
-        PopularBook(book_id=r[0], title=r[1], loan_count=r[2])
-        for r in results
-    ]
-
-
-@app.get("/statistics/active-readers", response_model=List[ActiveReader])
-def get_active_readers(limit: int = 10, session: Session = Depends(get_session)):
-    """Получить самых активных читателей"""
-    statement = (
-        select(
-            Reader.id,
-            Reader.first_name,
-            Reader.last_name,
-            Reader.library_card_number,
-            func.count(Loan.id).label("loan_count")
-        )
-        .join(Loan)
-        .group_by(Reader.id, Reader.first_name, Reader.last_name, Reader.library_card_number)
-        .order_by(func.count(Loan.id).desc())
-        .limit(limit)
-    )
-    results = session.exec(statement).all()
-    return [
-        ActiveReader(
-            reader_id=r[0],
-            name=f"{r[1]} {r[2]}",
-            card_number=r[3],
-            loan_count=r[4]
-        )
-        for r in results
-    ]
-
-
-@app.get("/")
-def root():
-    """Корневой endpoint"""
-    return {
-        "message": "Библиотечная система API",
-        "author": "Софья Шипенкова",
-        "version": "1.0.0",
-        "docs": "/docs"
-    }
-
+"""
+FastAPI приложение для системы управления библиотекой
+
+Автор: Софья Шипенкова
+"""
+
+import io
+import tempfile
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import true, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select, and_
+from sqlmodel.ext.asyncio.session import AsyncSession
+from decimal import Decimal
+
+from database import async_engine, engine, get_async_session, init_async_db, pool_statistics
+from models import (
+    Book, BookCopy, Reader, Loan, Reservation,
+    BookAuthorLink, Author
+)
+from schemas import (
+    BookCreate, BookResponse, ImportReport, ReaderCreate, ReaderResponse,
+    LoanCreate, LoanResponse, LoanReturn, LoanBatchCreate, LoanBatchResponse,
+    LoanReturnBatch, LoanReturnBatchResponse, ReservationCreate,
+    ReservationResponse, LibraryStatistics, PopularBook, ActiveReader, UpdateReservation,
+    PoolStatistics, CountersReconciliation, CacheStatistics, QueryStatistics,
+    SlowQueryReport, BookCopyCreate, BookCopyUpdate, BookCopyResponse,
+    AvailabilityReconciliation, ReaderReservation, JobStatus, JobRun
+)
+import availability
+import cache
+import counters
+import etags
+import export
+import importer
+import loans
+import metrics
+import overdue
+import pagination
+import query_profiler
+import reservation_expiry
+import reservations
+import rollups
+import scheduler
+import search
+import slow_queries
+import stats
+
+app = FastAPI(
+    title="Библиотечная система API",
+    description="API для управления библиотекой",
+    version="1.0.0"
+)
+
+# Число SQL-запросов на каждый запрос: заголовок Server-Timing и /internal/queries
+app.add_middleware(query_profiler.QueryProfilerMiddleware)
+# Метрики Prometheus: GET /metrics
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Периодические задания (scheduler.py)
+scheduler.add(overdue.job)
+scheduler.add(reservation_expiry.job)
+
+# Допустимые сортировки для постраничного вывода по курсору
+BOOK_SORT_KEYS = {
+    "id": (Book.id,),
+    "title": (Book.title, Book.id),
+}
+READER_SORT_KEYS = {
+    "id": (Reader.id,),
+    "last_name": (Reader.last_name, Reader.id),
+}
+
+
+def available_copy_exists(book_id):
+    """Условие EXISTS: у книги есть экземпляр в библиотеке
+
+    Полусоединение читает индекс ix_book_copies_book_id_status только
+    до первого подходящего экземпляра, сколько бы их ни было у книги.
+    """
+    return select(BookCopy.id).where(
+        and_(
+            BookCopy.book_id == book_id,
+            BookCopy.status == "in_library"
+        )
+    ).exists()
+
+
+@app.on_event("startup")
+async def on_startup():
+    """Инициализация базы данных при запуске"""
+    await init_async_db()
+    async with async_engine.begin() as connection:
+        await connection.run_sync(search.init_search_index)
+        await connection.run_sync(counters.ensure_counters)
+        await connection.run_sync(rollups.ensure_rollups)
+    scheduler.scheduler.start()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    """Остановка worker'а"""
+    await scheduler.scheduler.stop()
+    metrics.mark_process_dead()
+
+
+# ==================== ENDPOINTS ДЛЯ КНИГ ====================
+
+@app.get("/books", response_model=List[BookResponse])
+async def get_books(
+    request: Request,
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    sort: str = "id",
+    session: AsyncSession = Depends(get_async_session)
+):
+    """Получить список всех книг
+
+    Для следующей страницы передайте курсор из заголовка X-Next-Cursor
+    в параметре cursor (skip при этом не используется).
+    """
+    columns = pagination.sort_columns(BOOK_SORT_KEYS, sort)
+    not_modified = await etags.conditional(request, response, session, etags.BOOKS_SCOPE)
+    if not_modified:
+        return not_modified
+    statement = pagination.apply_keyset(select(Book), columns, sort, cursor)
+    if cursor is None:
+        statement = statement.offset(skip)
+    books = list((await session.exec(statement.limit(limit + 1))).all())
+
+    next_cursor = pagination.next_cursor(books, columns, sort, limit)
+    if next_cursor:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = next_cursor
+    return books[:limit]
+
+
+@app.get("/books/available", response_model=List[BookResponse])
+async def get_available_books(
+    response: Response,
+    genre: Optional[str] = None,
+    language: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    sort: str = "id",
+    session: AsyncSession = Depends(get_async_session)
+):
+    """Получить книги, которые можно взять (есть экземпляр в библиотеке)
+
+    Вывод только по курсору: следующая страница - по заголовку X-Next-Cursor.
+    """
+    columns = pagination.sort_columns(BOOK_SORT_KEYS, sort)
+    statement = select(Book).where(
+        and_(
+            Book.status == "available",
+            Book.available_copies > 0
+        )
+    )
+    if genre:
+        statement = statement.where(Book.genre == genre)
+    if language:
+        statement = statement.where(Book.language == language)
+    statement = pagination.apply_keyset(statement, columns, sort, cursor)
+    books = list((await session.exec(statement.limit(limit + 1))).all())
+
+    next_cursor = pagination.next_cursor(books, columns, sort, limit)
+    if next_cursor:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = next_cursor
+    return books[:limit]
+
+
+@app.get("/books/{book_id}", response_model=BookResponse)
+async def get_book(
+    book_id: int,
+    request: Request,
+    response: Response,
+    session: AsyncSession = Depends(get_async_session)
+):
+    """Получить книгу по ID"""
+    not_modified = await etags.conditional(
+        request, response, session, etags.book_scope(book_id)
+    )
+    if not_modified:
+        return not_modified
+    book = await cache.get_book(session, book_id)
+    if not book:
+        raise HTTPException(status_code=404, detail="Книга не найдена")
+    # Число экземпляров не кешируется и читается после ETag, поэтому
+    # ответ не старее своего ETag, в каком бы worker'е ни изменилась книга
+    return {**book, **await availability.copy_counts(session, book_id)}
+
+
+@app.get("/books/search/{title_query}", response_model=List[BookResponse])
+async def search_books(
+    title_query: str,
+    limit: int = 20,
+    session: AsyncSession = Depends(get_async_session)
+):
+    """Поиск книг по названию (по убыванию сходства)"""
+    return await search.search_books(session, title_query, limit)
+
+
+@app.post("/books", response_model=BookResponse, status_code=201)
+async def create_book(book: BookCreate, session: AsyncSession = Depends(get_async_session)):
+    """Создать новую книгу"""
+    db_book = Book(**book.dict())
+    session.add(db_book)
+    await session.flush()
+    await search.index_book(session, db_book)
+    await counters.adjust(session, total_books=1)
+    await etags.bump(session, etags.BOOKS_SCOPE, etags.book_scope(db_book.id))
+    await session.commit()
+    await session.refresh(db_book)
+    await cache.invalidate_books(db_book.id)
+    return db_book
+
+
+@app.post("/books/import", response_model=ImportReport)
+async def import_books(
+    request: Request,
+    file_format: str = Query("jsonl", alias="format")
+):
+    """Массовая загрузка каталога из тела запроса (JSONL или CSV)
+
+    Тело сохраняется во временный файл и загружается пачками через
+    синхронный движок (COPY в PostgreSQL) в отдельном потоке.
+    """
+    if file_format not in importer.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Неизвестный формат: {file_format}")
+    with tempfile.SpooledTemporaryFile(max_size=importer.IMPORT_SPOOL_BYTES) as buffer:
+        async for chunk in request.stream():
+            buffer.write(chunk)
+        buffer.seek(0)
+        stream = io.TextIOWrapper(buffer, encoding="utf-8", newline="")
+        report = await run_in_threadpool(importer.import_catalog, engine, stream, file_format)
+    stats.statistics_snapshot.invalidate()
+    return report
+
+
+@app.get("/books/{book_id}/copies", response_model=List[dict])
+async def get_book_copies(
+    book_id: int,
+    request: Request,
+    response: Response,
+    session: AsyncSession = Depends(get_async_session)
+):
+    """Получить все экземпляры книги"""
+    not_modified = await etags.conditional(
+        request, response, session, etags.copies_scope(book_id)
+    )
+    if not_modified:
+        return not_modified
+    statement = select(BookCopy).where(BookCopy.book_id == book_id)
+    copies = (await session.exec(statement)).all()
+    return [
+        {
+            "id": copy.id,
+            "inventory_number": copy.inventory_number,
+            "condition": copy.condition,
+            "status": copy.status
+        }
+        for copy in copies
+    ]
+
+
+@app.get("/books/{book_id}/available", response_model=List[dict])
+async def get_available_copies(
+    book_id: int,
+    request: Request,
+    response: Response,
+    session: AsyncSession = Depends(get_async_session)
+):
+    """Получить доступные экземпляры книги"""
+    not_modified = await etags.conditional(
+        request, response, session, etags.copies_scope(book_id)
+    )
+    if not_modified:
+        return not_modified
+    statement = select(BookCopy).where(
+        and_(
+            BookCopy.book_id == book_id,
+            BookCopy.status == "in_library"
+        )
+    )
+    copies = (await session.exec(statement)).all()
+    return [
+        {
+            "id": copy.id,
+            "inventory_number": copy.inventory_number,
+            "condition": copy.condition
+        }
+        for copy in copies
+    ]
+
+
+@app.post("/books/{book_id}/copies", response_model=BookCopyResponse, status_code=201)
+async def create_book_copy(
+    book_id: int,
+    copy_data: BookCopyCreate,
+    session: AsyncSession = Depends(get_async_session)
+):
+    """Добавить экземпляр книги"""
+    if not await session.get(Book, book_id):
+        raise HTTPException(status_code=404, detail="Книга не найдена")
+    copy = BookCopy(book_id=book_id, status="in_library", **copy_data.model_dump())
+    session.add(copy)
+    try:
+        await session.flush()
+    except IntegrityError:
+        raise HTTPException(status_code=400, detail="Инвентарный номер уже существует")
+
+    # Новый экземпляр, как и возвращённый, откладывается для первого
+    # в очереди резерваций книги
+    if await reservations.allocate(session, {copy.id: book_id}):
+        copy.status = reservations.HELD_COPY_STATUS
+    available = availability.status_delta(None, copy.status)
+    await counters.adjust(session, total_copies=1, available_copies=available)
+    book_ids = await availability.adjust(session, {book_id: available}, {book_id: 1})
+    await session.commit()
+    await availability.invalidate(book_ids)
+    return copy
+
+
+@app.patch("/copies/{copy_id}", response_model=BookCopyResponse)
+async def update_book_copy(
+    copy_id: int,
+    copy_data: BookCopyUpdate,
+    session: AsyncSession = Depends(get_async_session)
+):
+    """Изменить состояние или статус экземпляра (реставрация, списание)"""
+    values = copy_data.model_dump(exclude_unset=True)
+    copy = await session.get(BookCopy, copy_id)
+    if not copy:
+        raise HTTPException(status_code=404, detail="Экземпляр не найден")
+    if "status" in values and copy.status in ("on_loan", reservations.HELD_COPY_STATUS):
+        raise HTTPException(
+            status_code=400,
+            detail="Статус выданного или отложенного экземпляра меняется выдачей и возвратом"
+        )
+    old_status = copy.status
+
+    # Статус мог измениться после чтения (выдача), поэтому UPDATE условный
+    updated = (await session.execute(
+        update(BookCopy)
+        .where(and_(BookCopy.id == copy_id, BookCopy.status == old_status))
+        .values(updated_at=datetime.now(), **values)
+        .returning(BookCopy),
+        execution_options={"synchronize_session": False, "populate_existing": True}
+    )).scalars().first()
+    if updated is None:
+        raise HTTPException(status_code=409, detail="Экземпляр изменён, повторите запрос")
+
+    # Экземпляр, вернувшийся в библиотеку (например, после реставрации),
+    # откладывается для первого в очереди резерваций книги, как при возврате
+    if old_status != updated.status == availability.AVAILABLE_STATUS:
+        if await reservations.allocate(session, {copy_id: updated.book_id}):
+            updated.status = reservations.HELD_COPY_STATUS
+
+    delta = availability.status_delta(old_status, updated.status)
+    if delta:
+        await counters.adjust(session, available_copies=delta)
+    book_ids = await availability.adjust(session, {updated.book_id: delta})
+    if not book_ids:
+        await etags.bump(session, etags.copies_scope(updated.book_id))
+    await session.commit()
+    await availability.invalidate(book_ids)
+    return updated
+
+
+# ==================== ENDPOINTS ДЛЯ ЧИТАТЕЛЕЙ ====================
+
+@app.get("/readers", response_model=List[ReaderResponse])
+async def get_readers(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    sort: str = "id",
+    session: AsyncSession = Depends(get_async_session)
+):
+    """Получить список всех читателей
+
+    Для следующей страницы передайте курсор из заголовка X-Next-Cursor
+    в параметре cursor (skip при этом не используется).
+    """
+    columns = pagination.sort_columns(READER_SORT_KEYS, sort)
+    statement = pagination.apply_keyset(select(Reader), columns, sort, cursor)
+    if cursor is None:
+        statement = statement.offset(skip)
+    readers = list((await session.exec(statement.limit(limit + 1))).all())
+
+    next_cursor = pagination.next_cursor(readers, columns, sort, limit)
+    if next_cursor:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = next_cursor
+    return readers[:limit]
+
+
+@app.get("/readers/{reader_id}", response_model=ReaderResponse)
+async def get_reader(reader_id: int, session: AsyncSession = Depends(get_async_session)):
+    """Получить читателя по ID"""
+    reader = await cache.get_reader(session, reader_id)
+    if not reader:
+        raise HTTPException(status_code=404, detail="Читатель не найден")
+    return reader
+
+
+@app.get("/readers/card/{card_number}", response_model=ReaderResponse)
+async def get_reader_by_card(card_number: str, session: AsyncSession = Depends(get_async_session)):
+    """Получить читателя по номеру читательского билета"""
+    reader = await cache.get_reader_by_card(session, card_number)
+    if not reader:
+        raise HTTPException(status_code=404, detail="Читатель не найден")
+    return reader
+
+
+@app.post("/readers", response_model=ReaderResponse, status_code=201)
+async def create_reader(reader: ReaderCreate, session: AsyncSession = Depends(get_async_session)):
+    """Создать нового читателя"""
+    # Проверка уникальности номера билета
+    statement = select(Reader).where(Reader.library_card_number == reader.library_card_number)
+    existing = (await session.exec(statement)).first()
+    if existing:
+        raise HTTPException(status_code=400, detail="Читатель с таким номером билета уже существует")
+    
+    db_reader = Reader(**reader.dict())
+    session.add(db_reader)
+    await counters.adjust(
+        session,
+        total_readers=1,
+        active_readers=1 if db_reader.status == "active" else 0
+    )
+    await session.commit()
+    await session.refresh(db_reader)
+    return db_reader
+
+
+@app.get("/readers/{reader_id}/loans", response_model=List[LoanResponse])
+async def get_reader_loans(reader_id: int, session: AsyncSession = Depends(get_async_session)):
+    """Получить все выдачи читателя"""
+    statement = select(Loan).where(Loan.reader_id == reader_id)
+    loans = (await session.exec(statement)).all()
+    return list(loans)
+
+
+@app.get("/readers/{reader_id}/active-loans", response_model=List[LoanResponse])
+async def get_reader_active_loans(reader_id: int, session: AsyncSession = Depends(get_async_session)):
+    """Получить активные выдачи читателя"""
+    statement = select(Loan).where(
+        and_(
+            Loan.reader_id == reader_id,
+            Loan.status == "active"
+        )
+    )
+    loans = (await session.exec(statement)).all()
+    return list(loans)
+
+
+# ==================== ENDPOINTS ДЛЯ ВЫДАЧ ====================
+
+@app.post("/loans", response_model=LoanResponse, status_code=201)
+async def create_loan(loan_data: LoanCreate, session: AsyncSession = Depends(get_async_session)):
+    """Создать новую выдачу книги
+
+    Читатель блокируется на время транзакции, а экземпляр переводится
+    в on_loan условным UPDATE, поэтому один экземпляр не выдаётся дважды
+    и лимит читателя не превышается при параллельных запросах.
+    """
+    return await loans.checkout(session, loan_data)
+
+
+@app.post("/loans/batch", response_model=LoanBatchResponse)
+async def create_loans_batch(
+    batch: LoanBatchCreate,
+    session: AsyncSession = Depends(get_async_session)
+):
+    """Выдать читателю несколько экземпляров одной транзакцией
+
+    Результат возвращается по каждому экземпляру: created, not_found,
+    unavailable, duplicate или limit_exceeded.
+    """
+    return await loans.checkout_batch(session, batch)
+
+
+@app.post("/loans/return-batch", response_model=LoanReturnBatchResponse)
+async def return_loans_batch(
+    batch: LoanReturnBatch,
+    session: AsyncSession = Depends(get_async_session)
+):
+    """Вернуть несколько книг одной транзакцией (по ID выдач или инвентарным номерам)
+
+    Результат возвращается по каждому ключу: returned, not_found,
+    already_returned, not_on_loan или duplicate.
+    """
+    return await loans.return_batch(session, batch)
+
+
+@app.post("/loans/{loan_id}/return", response_model=LoanResponse)
+async def return_loan(
+    loan_id: int,
+    loan_return: LoanReturn,
+    session: AsyncSession = Depends(get_async_session)
+):
+    """Вернуть книгу
+
+    Выдача закрывается условным UPDATE ... WHERE status = 'active', как
+    при пакетном возврате: из параллельных возвратов одной выдачи успешен
+    только один.
+    """
+    returned = await loans.close_loans(session, [loan_id], loan_return.fine_amount)
+    if not returned:
+        if await session.get(Loan, loan_id) is None:
+            raise HTTPException(status_code=404, detail="Выдача не найдена")
+        raise HTTPException(status_code=400, detail="Выдача уже закрыта")
+    return returned[0]
+
+
+@app.get("/loans/overdue", response_model=List[LoanResponse])
+async def get_overdue_loans(session: AsyncSession = Depends(get_async_session)):
+    """Получить все просроченные выдачи
+
+    Выдачи отмечает задание overdue.py (раз в OVERDUE_JOB_SECONDS);
+    чтение идёт по частичному индексу ix_loans_active_overdue.
+    """
+    statement = select(Loan).where(
+        and_(
+            Loan.status == "active",
+            Loan.is_overdue == true()
+        )
+    ).order_by(Loan.due_date, Loan.id)
+    loans = (await session.exec(statement)).all()
+    return list(loans)
+
+
+# ==================== ENDPOINTS ДЛЯ РЕЗЕРВАЦИЙ ====================
+
+@app.post("/reservations", response_model=ReservationResponse, status_code=201)
+async def create_reservation(
+    reservation_data: ReservationCreate,
+    session: AsyncSession = Depends(get_async_session)
+):
+    """Создать резервацию книги"""
+    # Проверка наличия доступных экземпляров (без загрузки самих экземпляров)
+    available = (await session.exec(
+        select(available_copy_exists(reservation_data.book_id))
+    )).one()
+    
+    if available:
+        raise HTTPException(
+            status_code=400,
+            detail="Книга доступна, резервация не требуется"
+        )
+    
+    # Проверка существующей резервации (в очереди или с отложенным экземпляром)
+    existing = (await session.exec(
+        select(Reservation).where(
+            and_(
+                Reservation.book_id == reservation_data.book_id,
+                Reservation.reader_id == reservation_data.reader_id,
+                Reservation.status.in_([reservations.QUEUED, reservations.HELD])
+            )
+        )
+    )).first()
+    
+    if existing:
+        return existing
+    
+    # Проверка читателя
+    reader = await cache.get_reader(session, reservation_data.reader_id)
+    if not reader:
+        raise HTTPException(status_code=404, detail="Читатель не найден")
+    
+    # Проверка книги
+    book = await cache.get_book(session, reservation_data.book_id)
+    if not book:
+        raise HTTPException(status_code=404, detail="Книга не найдена")
+    
+    # Создание резервации
+    reservation = Reservation(
+        book_id=reservation_data.book_id,
+        reader_id=reservation_data.reader_id,
+        reservation_date=date.today(),
+        expiry_date=date.today() + timedelta(days=reservation_data.expiry_days),
+        status="active"
+    )
+    
+    session.add(reservation)
+    await session.commit()
+    await session.refresh(reservation)
+    
+    return reservation
+
+
+@app.get("/reservations/book/{book_id}", response_model=List[ReservationResponse])
+async def get_book_reservations(book_id: int, session: AsyncSession = Depends(get_async_session)):
+    """Получить все активные резервации для книги (в порядке очереди)"""
+    statement = select(Reservation).where(
+        and_(
+            Reservation.book_id == book_id,
+            Reservation.status == "active"
+        )
+    ).order_by(*reservations.queue_order())
+    book_reservations = (await session.exec(statement)).all()
+    return list(book_reservations)
+
+
+@app.get("/reservations/reader/{reader_id}", response_model=List[ReaderReservation])
+async def get_reader_reservations(reader_id: int, session: AsyncSession = Depends(get_async_session)):
+    """Резервации читателя: место в очереди или отложенный экземпляр"""
+    rows = (await session.exec(
+        reservations.reader_reservations_statement(reader_id, date.today())
+    )).all()
+    return [
+        ReaderReservation(
+            **ReservationResponse.model_validate(reservation).model_dump(),
+            position=position
+        )
+        for reservation, position in rows
+    ]
+
+
+@app.delete("/reservations/{pk}")
+async def delete_reservation(pk: int, session: AsyncSession = Depends(get_async_session)) -> None:
+    reservation = await session.get(Reservation, pk)
+    if not reservation:
+        raise HTTPException(status_code=404, detail="Резервация не найдена")
+    # Отложенный экземпляр переходит следующему в очереди
+    held_copy = reservation.copy_id if reservation.status == reservations.HELD else None
+    book_id = reservation.book_id
+    await session.delete(reservation)
+    book_ids = []
+    if held_copy:
+        await session.flush()
+        book_ids = await reservations.release(session, {held_copy: book_id})
+    await session.commit()
+    if held_copy:
+        await availability.invalidate(book_ids)
+
+@app.patch("/reservations")
+async def update_reservation(pk: int, payload: UpdateReservation, session: AsyncSession = Depends(get_async_session)) -> ReservationResponse:
+    payload_data = payload.model_dump(exclude_unset=True)
+    reservation = await session.get(Reservation, pk)
+    if not reservation:
+        raise HTTPException(status_code=404, detail="Резервация не найдена")
+    for key, val in payload_data.items():
+        setattr(reservation, key, val)
+    await session.commit()
+    await session.refresh(reservation)
+    response = ReservationResponse.model_validate(reservation)
+    return response
+
+# ==================== ВЫГРУЗКА ====================
+
+@app.get("/export/{name}")
+async def export_table(
+    name: str,
+    file_format: str = Query("ndjson", alias="format"),
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None
+):
+    """Потоковая выгрузка books, copies, loans или reservations в NDJSON или CSV
+
+    date_from/date_to фильтруют по дате добавления книги, поступления
+    экземпляра, выдачи или резервации.
+    """
+    if name not in export.EXPORTS:
+        raise HTTPException(status_code=404, detail=f"Неизвестная выгрузка: {name}")
+    if file_format not in export.MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Неизвестный формат: {file_format}")
+    statement = export.export_statement(name, date_from, date_to)
+    return StreamingResponse(
+        export.stream_export(statement, file_format),
+        media_type=export.MEDIA_TYPES[file_format],
+        headers={"Content-Disposition": f'attachment; filename="{name}.{file_format}"'}
+    )
+
+
+# ==================== ENDPOINTS ДЛЯ СТАТИСТИКИ ====================
+
+@app.get("/statistics", response_model=LibraryStatistics)
+async def get_statistics(session: AsyncSession = Depends(get_async_session)):
+    """Получить общую статистику библиотеки (снимок обновляется раз в несколько секунд)"""
+    return await stats.statistics_snapshot.get(lambda: counters.read_statistics(session))
+
+
+@app.get("/statistics/popular-books", response_model=List[PopularBook])
+async def get_popular_books(
+    limit: int = 10,
+    days: Optional[int] = None,
+    session: AsyncSession = Depends(get_async_session)
+):
+    """Получить самые популярные книги (за всё время или за последние days дней)"""
+    return await rollups.popular_books(session, limit, days)
+
+
+@app.get("/statistics/active-readers", response_model=List[ActiveReader])
+async def get_active_readers(
+    limit: int = 10,
+    days: Optional[int] = None,
+    session: AsyncSession = Depends(get_async_session)
+):
+    """Получить самых активных читателей (за всё время или за последние days дней)"""
+    return await rollups.active_readers(session, limit, days)
+
+
+# ==================== СЛУЖЕБНЫЕ ENDPOINTS ====================
+
+@app.get("/metrics")
+async def get_metrics():
+    """Метрики в формате Prometheus (по всем worker'ам при PROMETHEUS_MULTIPROC_DIR)"""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE_LATEST)
+
+
+@app.get("/internal/pool", response_model=PoolStatistics)
+async def get_pool_statistics():
+    """Метрики пула соединений текущего worker'а"""
+    return pool_statistics()
+
+
+@app.get("/internal/cache", response_model=CacheStatistics)
+async def get_cache_statistics():
+    """Попадания и промахи кеша записей каталога текущего worker'а"""
+    return cache.entity_cache.statistics()
+
+
+@app.get("/internal/queries", response_model=QueryStatistics)
+async def get_query_statistics(reset: bool = False):
+    """Запросы к БД по маршрутам текущего worker'а: число, время, N+1
+
+    reset=true очищает отчёт после чтения.
+    """
+    statistics = query_profiler.query_report.statistics()
+    if reset:
+        query_profiler.query_report.reset()
+    return statistics
+
+
+@app.get("/internal/slow-queries", response_model=SlowQueryReport)
+async def get_slow_queries(limit: int = Query(100, ge=1, le=1000)):
+    """Медленные запросы: сводка текущего worker'а и последние записи журнала"""
+    return SlowQueryReport(
+        threshold_ms=slow_queries.SLOW_QUERY_MS,
+        log_file=slow_queries.SLOW_QUERY_LOG,
+        statements=slow_queries.slow_query_log.statistics(),
+        records=await run_in_threadpool(slow_queries.slow_query_log.tail, limit),
+    )
+
+
+@app.post("/internal/counters/reconcile", response_model=CountersReconciliation)
+async def reconcile_counters(fix: bool = False):
+    """Сверить счётчики статистики с данными (и исправить при fix=true)"""
+    async with async_engine.begin() as connection:
+        drift = await connection.run_sync(counters.reconcile, fix)
+    if fix:
+        stats.statistics_snapshot.invalidate()
+    return CountersReconciliation(drift=drift, fixed=fix and bool(drift))
+
+
+@app.post("/internal/availability/reconcile", response_model=AvailabilityReconciliation)
+async def reconcile_availability(fix: bool = False, limit: int = Query(100, ge=1, le=10000)):
+    """Сверить число экземпляров книг с book_copies (и исправить при fix=true)
+
+    В ответе - не больше limit книг с расхождениями.
+    """
+    async with async_engine.begin() as connection:
+        drift = await connection.run_sync(availability.reconcile, fix)
+    if fix:
+        await availability.invalidate(drift)
+    return AvailabilityReconciliation(
+        books=len(drift),
+        drift=dict(list(drift.items())[:limit]),
+        fixed=fix and bool(drift),
+    )
+
+
+@app.get("/internal/jobs", response_model=List[JobStatus])
+async def get_jobs():
+    """Периодические задания: интервал, отметка, последний запуск"""
+    return await run_in_threadpool(scheduler.scheduler.states)
+
+
+@app.post("/internal/jobs/{name}/run", response_model=JobRun)
+async def run_job(name: str):
+    """Выполнить задание вне расписания"""
+    if name not in scheduler.scheduler.jobs:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    return await scheduler.scheduler.run(name, force=True)
+
+
+@app.post("/internal/etags/reset")
+async def reset_etags():
+    """Сделать устаревшими все ETag каталога (после изменений в обход API)"""
+    async with async_engine.begin() as connection:
+        await connection.run_sync(etags.reset)
+    return {"reset": True}
+
+
+@app.post("/internal/rollups/rebuild")
+async def rebuild_rollups():
+    """Перестроить рейтинги книг и читателей по всей истории выдач"""
+    async with async_engine.begin() as connection:
+        loans = await connection.run_sync(rollups.rebuild)
+    return {"loans": loans}
+
+
+@app.get("/")
+async def root():
+    """Корневой endpoint"""
+    return {
+        "message": "Библиотечная система API",
+        "author": "Софья Шипенкова",
+        "version": "1.0.0",
+        "docs": "/docs"
+    }
+
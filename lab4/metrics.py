@@ -0,0 +1,200 @@
+"""
+Метрики в формате Prometheus: GET /metrics
+
+    library_http_requests_total{method, route, status}     - число запросов
+    library_http_request_duration_seconds{method, route}   - гистограмма времени ответа
+    library_http_requests_in_progress{method}              - запросы в обработке
+    library_http_request_errors_total{method, route, error}- ответы 5xx и исключения
+    library_db_pool_*                                       - пул соединений
+    library_cache_requests_total{kind, outcome}             - попадания и промахи кеша
+    library_job_*{job}                                      - периодические задания (scheduler.py)
+
+Маршрут в метках - шаблон пути (/books/{book_id}), поэтому число рядов
+не зависит от идентификаторов в запросах.
+
+Несколько worker'ов uvicorn: задайте PROMETHEUS_MULTIPROC_DIR (пустой
+каталог, очищается перед запуском сервера). Тогда каждый процесс пишет
+значения в свои файлы через mmap без межпроцессных блокировок, а /metrics
+в любом worker'е собирает сумму по всем процессам. Без переменной метрики
+хранятся в памяти процесса.
+
+Показатели пула и кеша накапливаются в самих пуле и кеше; в метрики они
+переносятся не чаще раза в METRICS_REFRESH_SECONDS на каждый процесс.
+
+Автор: Софья Шипенкова
+"""
+
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram,
+    REGISTRY, generate_latest, multiprocess
+)
+
+from database import async_engine
+import cache
+
+
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+METRICS_REFRESH_SECONDS = float(os.getenv("METRICS_REFRESH_SECONDS", "1"))
+
+# Границы гистограммы времени ответа, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+# ==================== МЕТРИКИ ====================
+
+REQUESTS = Counter(
+    "library_http_requests_total", "Число HTTP-запросов",
+    ["method", "route", "status"]
+)
+LATENCY = Histogram(
+    "library_http_request_duration_seconds", "Время ответа",
+    ["method", "route"], buckets=LATENCY_BUCKETS
+)
+IN_PROGRESS = Gauge(
+    "library_http_requests_in_progress", "Запросы в обработке",
+    ["method"], multiprocess_mode="livesum"
+)
+ERRORS = Counter(
+    "library_http_request_errors_total", "Ответы 5xx и необработанные исключения",
+    ["method", "route", "error"]
+)
+
+POOL_CONNECTIONS = Gauge(
+    "library_db_pool_connections", "Соединения пула",
+    ["state"], multiprocess_mode="livesum"
+)
+POOL_CHECKOUTS = Counter("library_db_pool_checkouts_total", "Выдачи соединений из пула")
+POOL_TIMEOUTS = Counter("library_db_pool_timeouts_total", "Таймауты ожидания соединения")
+POOL_WAIT = Counter("library_db_pool_wait_seconds_total", "Суммарное ожидание соединения")
+
+CACHE_REQUESTS = Counter(
+    "library_cache_requests_total", "Обращения к кешу записей каталога",
+    ["kind", "outcome"]
+)
+
+JOB_RUNS = Counter(
+    "library_job_runs_total", "Запуски периодических заданий",
+    ["job", "outcome"]
+)
+JOB_ROWS = Counter(
+    "library_job_rows_total", "Строки, обработанные периодическими заданиями",
+    ["job", "kind"]
+)
+JOB_DURATION = Histogram(
+    "library_job_duration_seconds", "Время выполнения периодического задания",
+    ["job"], buckets=(0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0)
+)
+JOB_LAST_SUCCESS = Gauge(
+    "library_job_last_success_timestamp_seconds", "Время последнего успешного запуска",
+    ["job"], multiprocess_mode="max"
+)
+
+
+# ==================== ПОКАЗАТЕЛИ ПУЛА И КЕША ====================
+
+class ProcessMetrics:
+    """Перенос накопленных показателей пула и кеша процесса в метрики
+
+    Счётчики пула и кеша только растут, поэтому в метрики добавляется
+    разница с прошлым переносом: при нескольких процессах суммы остаются
+    верными.
+    """
+
+    def __init__(self):
+        self._refreshed = 0.0
+        self._previous: dict = {}
+
+    def _advance(self, key, value: float) -> float:
+        delta = value - self._previous.get(key, 0)
+        self._previous[key] = value
+        return max(delta, 0)
+
+    def refresh(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._refreshed < METRICS_REFRESH_SECONDS:
+            return
+        self._refreshed = now
+
+        pool = async_engine.pool
+        if hasattr(pool, "metrics"):
+            POOL_CONNECTIONS.labels("checked_out").set(pool.checkedout())
+            POOL_CONNECTIONS.labels("idle").set(pool.checkedin())
+            POOL_CONNECTIONS.labels("overflow").set(max(0, pool.overflow()))
+            with pool.metrics._lock:
+                checkouts = pool.metrics.checkouts
+                timeouts = pool.metrics.timeouts
+                wait_total = pool.metrics.wait_total
+            POOL_CHECKOUTS.inc(self._advance("checkouts", checkouts))
+            POOL_TIMEOUTS.inc(self._advance("timeouts", timeouts))
+            POOL_WAIT.inc(self._advance("wait", wait_total))
+
+        for kind, counts in cache.entity_cache.statistics()["kinds"].items():
+            for outcome in ("hits", "misses"):
+                CACHE_REQUESTS.labels(kind, outcome).inc(
+                    self._advance((kind, outcome), counts[outcome])
+                )
+
+
+process_metrics = ProcessMetrics()
+
+
+def render() -> bytes:
+    """Текст метрик для /metrics (сумма по всем процессам в multiprocess-режиме)"""
+    process_metrics.refresh(force=True)
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def mark_process_dead() -> None:
+    """Убрать значения gauge завершающегося процесса (при остановке worker'а)"""
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+# ==================== MIDDLEWARE ====================
+
+class MetricsMiddleware:
+    """ASGI middleware: число, время и ошибки запросов по маршрутам"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = 500
+        error = None
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_progress = IN_PROGRESS.labels(method)
+        in_progress.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception as exception:
+            error = type(exception).__name__
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            in_progress.dec()
+            route = getattr(scope.get("route"), "path", "<unmatched>")
+            REQUESTS.labels(method, route, str(status)).inc()
+            LATENCY.labels(method, route).observe(elapsed)
+            if error or status >= 500:
+                ERRORS.labels(method, route, error or str(status)).inc()
+            process_metrics.refresh()
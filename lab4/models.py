@@ -1,189 +1,335 @@
-"""
-Модели SQLModel для системы управления библиотекой
-
-Автор: Софья Шипенкова
-"""
-
-from datetime import date, datetime
-from typing import Optional, List
-from sqlmodel import SQLModel, Field, Relationship
-from decimal import Decimal
-
-
-# Базовые модели для связей многие-ко-многим
-class BookAuthorLink(SQLModel, table=True):
-    """Связь между книгами и авторами (многие-ко-многим)"""
-    __tablename__ = "book_authors"
-    
-    id: Optional[int] = Field(default=None, primary_key=True)
-    book_id: int = Field(foreign_key="books.id")
-    author_id: int = Field(foreign_key="authors.id")
-    created_at: datetime = Field(default_factory=datetime.now)
-
-
-class Author(SQLModel, table=True):
-    """Модель автора книги"""
-    __tablename__ = "authors"
-    
-    id: Optional[int] = Field(default=None, primary_key=True)
-    first_name: str = Field(max_length=100)
-    last_name: str = Field(max_length=100)
-    middle_name: Optional[str] = Field(default=None, max_length=100)
-    birth_date: Optional[date] = None
-    biography: Optional[str] = None
-    nationality: Optional[str] = Field(default=None, max_length=50)
-    created_at: datetime = Field(default_factory=datetime.now)
-    updated_at: datetime = Field(default_factory=datetime.now)
-    
-    # Связи
-    books: List["Book"] = Relationship(back_populates="authors", link_model=BookAuthorLink)
-
-
-class Publisher(SQLModel, table=True):
-    """Модель издательства"""
-    __tablename__ = "publishers"
-    
-    id: Optional[int] = Field(default=None, primary_key=True)
-    name: str = Field(max_length=200, unique=True)
-    country: Optional[str] = Field(default=None, max_length=100)
-    city: Optional[str] = Field(default=None, max_length=100)
-    website: Optional[str] = Field(default=None, max_length=255)
-    contact_email: Optional[str] = Field(default=None, max_length=255)
-    created_at: datetime = Field(default_factory=datetime.now)
-    updated_at: datetime = Field(default_factory=datetime.now)
-    
-    # Связи
-    books: List["Book"] = Relationship(back_populates="publisher")
-
-
-class Book(SQLModel, table=True):
-    """Модель книги"""
-    __tablename__ = "books"
-    
-    id: Optional[int] = Field(default=None, primary_key=True)
-    isbn: Optional[str] = Field(default=None, max_length=20, unique=True)
-    title: str = Field(max_length=500)
-    publisher_id: Optional[int] = Field(default=None, foreign_key="publishers.id")
-    year: Optional[int] = None
-    genre: Optional[str] = Field(default=None, max_length=100)
-    pages: Optional[int] = None
-    language: str = Field(default="ru", max_length=50)
-    description: Optional[str] = None
-    date_added: date = Field(default_factory=date.today)
-    location: Optional[str] = Field(default=None, max_length=100)
-    status: str = Field(default="available", max_length=20)
-    created_at: datetime = Field(default_factory=datetime.now)
-    updated_at: datetime = Field(default_factory=datetime.now)
-    
-    # Связи
-    publisher: Optional[Publisher] = Relationship(back_populates="books")
-    authors: List[Author] = Relationship(back_populates="books", link_model=BookAuthorLink)
-    copies: List["BookCopy"] = Relationship(back_populates="book")
-    reservations: List["Reservation"] = Relationship(back_populates="book")
-
-
-class BookCopy(SQLModel, table=True):
-    """Модель экземпляра книги"""
-    __tablename__ = "book_copies"
-    
-    id: Optional[int] = Field(default=None, primary_key=True)
-    book_id: int = Field(foreign_key="books.id")
-    inventory_number: str = Field(max_length=50, unique=True)
-    condition: str = Field(default="good", max_length=20)
-    status: str = Field(default="in_library", max_length=20)
-    acquisition_date: date
-    price: Optional[Decimal] = None
-    notes: Optional[str] = None
-    created_at: datetime = Field(default_factory=datetime.now)
-    updated_at: datetime = Field(default_factory=datetime.now)
-    
-    # Связи
-    book: Book = Relationship(back_populates="copies")
-    loans: List["Loan"] = Relationship(back_populates="copy")
-
-
-class Reader(SQLModel, table=True):
-    """Модель читателя"""
-    __tablename__ = "readers"
-    
-    id: Optional[int] = Field(default=None, primary_key=True)
-    library_card_number: str = Field(max_length=50, unique=True)
-    first_name: str = Field(max_length=100)
-    last_name: str = Field(max_length=100)
-    middle_name: Optional[str] = Field(default=None, max_length=100)
-    email: Optional[str] = Field(default=None, max_length=255)
-    phone: Optional[str] = Field(default=None, max_length=20)
-    address: Optional[str] = None
-    registration_date: date = Field(default_factory=date.today)
-    status: str = Field(default="active", max_length=20)
-    max_books: int = Field(default=5)
-    created_at: datetime = Field(default_factory=datetime.now)
-    updated_at: datetime = Field(default_factory=datetime.now)
-    
-    # Связи
-    loans: List["Loan"] = Relationship(back_populates="reader")
-    reservations: List["Reservation"] = Relationship(back_populates="reader")
-
-
-class Librarian(SQLModel, table=True):
-    """Модель библиотекаря"""
-    __tablename__ = "librarians"
-    
-    id: Optional[int] = Field(default=None, primary_key=True)
-    employee_number: str = Field(max_length=50, unique=True)
-    first_name: str = Field(max_length=100)
-    last_name: str = Field(max_length=100)
-    middle_name: Optional[str] = Field(default=None, max_length=100)
-    position: str = Field(max_length=100)
-    email: Optional[str] = Field(default=None, max_length=255)
-    phone: Optional[str] = Field(default=None, max_length=20)
-    hire_date: date
-    status: str = Field(default="working", max_length=20)
-    created_at: datetime = Field(default_factory=datetime.now)
-    updated_at: datetime = Field(default_factory=datetime.now)
-    
-    # Связи
-    loans: List["Loan"] = Relationship(back_populates="librarian")
-
-
-class Loan(SQLModel, table=True):
-    """Модель выдачи книги"""
-    __tablename__ = "loans"
-    
-    id: Optional[int] = Field(default=None, primary_key=True)
-    copy_id: int = Field(foreign_key="book_copies.id")
-    reader_id: int = Field(foreign_key="readers.id")
-    librarian_id: int = Field(foreign_key="librarians.id")
-    loan_date: date = Field(default_factory=date.today)
-    due_date: date
-    return_date: Optional[date] = None
-    status: str = Field(default="active", max_length=20)
-    fine_amount: Decimal = Field(default=Decimal("0.00"))
-    notes: Optional[str] = None
-    created_at: datetime = Field(default_factory=datetime.now)
-    updated_at: datetime = Field(default_factory=datetime.now)
-    
-    # Связи
-    copy: BookCopy = Relationship(back_populates="loans")
-    reader: Reader = Relationship(back_populates="loans")
-    librarian: Librarian = Relationship(back_populates="loans")
-
-
-class Reservation(SQLModel, table=True):
-    """Модель резервации книги"""
-    __tablename__ = "reservations"
-    
-    id: Optional[int] = Field(default=None, primary_key=True)
-    book_id: int = Field(foreign_key="books.id")
-    reader_id: int = Field(foreign_key="readers.id")
-    reservation_date: date = Field(default_factory=date.today)
-    expiry_date: date
-    status: str = Field(default="active", max_length=20)
-    notification_sent: bool = Field(default=False)
-    created_at: datetime = Field(default_factory=datetime.now)
-    updated_at: datetime = Field(default_factory=datetime.now)
-    
-    # Связи
-    book: Book = Relationship(back_populates="reservations")
-    reader: Reader = Relationship(back_populates="reservations")
-
+"""
+Модели SQLModel для системы управления библиотекой
+
+Автор: Софья Шипенкова
+"""
+
+from datetime import date, datetime
+from typing import Optional, List
+from sqlmodel import SQLModel, Field, Relationship
+from sqlalchemy import DDL, Index, event, false, text
+from decimal import Decimal
+
+
+# Базовые модели для связей многие-ко-многим
+class BookAuthorLink(SQLModel, table=True):
+    """Связь между книгами и авторами (многие-ко-многим)"""
+    __tablename__ = "book_authors"
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    book_id: int = Field(foreign_key="books.id")
+    author_id: int = Field(foreign_key="authors.id")
+    created_at: datetime = Field(default_factory=datetime.now)
+
+
+class Author(SQLModel, table=True):
+    """Модель автора книги"""
+    __tablename__ = "authors"
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    first_name: str = Field(max_length=100)
+    last_name: str = Field(max_length=100)
+    middle_name: Optional[str] = Field(default=None, max_length=100)
+    birth_date: Optional[date] = None
+    biography: Optional[str] = None
+    nationality: Optional[str] = Field(default=None, max_length=50)
+    created_at: datetime = Field(default_factory=datetime.now)
+    updated_at: datetime = Field(default_factory=datetime.now)
+    
+    # Связи
+    books: List["Book"] = Relationship(back_populates="authors", link_model=BookAuthorLink)
+
+
+class Publisher(SQLModel, table=True):
+    """Модель издательства"""
+    __tablename__ = "publishers"
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    name: str = Field(max_length=200, unique=True)
+    country: Optional[str] = Field(default=None, max_length=100)
+    city: Optional[str] = Field(default=None, max_length=100)
+    website: Optional[str] = Field(default=None, max_length=255)
+    contact_email: Optional[str] = Field(default=None, max_length=255)
+    created_at: datetime = Field(default_factory=datetime.now)
+    updated_at: datetime = Field(default_factory=datetime.now)
+    
+    # Связи
+    books: List["Book"] = Relationship(back_populates="publisher")
+
+
+class Book(SQLModel, table=True):
+    """Модель книги"""
+    __tablename__ = "books"
+    __table_args__ = (
+        # Поиск по подстроке названия: /books/search (только PostgreSQL,
+        # для SQLite используется собственный индекс из search.py)
+        Index(
+            "ix_books_title_trgm",
+            "title",
+            postgresql_using="gin",
+            postgresql_ops={"title": "gin_trgm_ops"},
+        ).ddl_if(dialect="postgresql"),
+        # Постраничный вывод по курсору с сортировкой по названию
+        Index("ix_books_title_id", "title", "id"),
+        # Доступные книги жанра по курсору: /books/available?genre=...
+        Index("ix_books_genre_id", "genre", "id"),
+    )
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    isbn: Optional[str] = Field(default=None, max_length=20, unique=True)
+    title: str = Field(max_length=500)
+    publisher_id: Optional[int] = Field(default=None, foreign_key="publishers.id")
+    year: Optional[int] = None
+    genre: Optional[str] = Field(default=None, max_length=100)
+    pages: Optional[int] = None
+    language: str = Field(default="ru", max_length=50)
+    description: Optional[str] = None
+    date_added: date = Field(default_factory=date.today)
+    location: Optional[str] = Field(default=None, max_length=100)
+    status: str = Field(default="available", max_length=20)
+    # Число экземпляров и экземпляров в библиотеке (lab4/availability.py)
+    total_copies: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    available_copies: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    created_at: datetime = Field(default_factory=datetime.now)
+    updated_at: datetime = Field(default_factory=datetime.now)
+    
+    # Связи
+    publisher: Optional[Publisher] = Relationship(back_populates="books")
+    authors: List[Author] = Relationship(back_populates="books", link_model=BookAuthorLink)
+    copies: List["BookCopy"] = Relationship(back_populates="book")
+    reservations: List["Reservation"] = Relationship(back_populates="book")
+
+
+class BookCopy(SQLModel, table=True):
+    """Модель экземпляра книги"""
+    __tablename__ = "book_copies"
+    __table_args__ = (
+        # Доступные экземпляры книги: /books/{id}/available, create_reservation
+        Index("ix_book_copies_book_id_status", "book_id", "status"),
+    )
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    book_id: int = Field(foreign_key="books.id")
+    inventory_number: str = Field(max_length=50, unique=True)
+    condition: str = Field(default="good", max_length=20)
+    status: str = Field(default="in_library", max_length=20)
+    acquisition_date: date
+    price: Optional[Decimal] = None
+    notes: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.now)
+    updated_at: datetime = Field(default_factory=datetime.now)
+    
+    # Связи
+    book: Book = Relationship(back_populates="copies")
+    loans: List["Loan"] = Relationship(back_populates="copy")
+
+
+class Reader(SQLModel, table=True):
+    """Модель читателя"""
+    __tablename__ = "readers"
+    __table_args__ = (
+        # Постраничный вывод по курсору с сортировкой по фамилии
+        Index("ix_readers_last_name_id", "last_name", "id"),
+    )
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    library_card_number: str = Field(max_length=50, unique=True)
+    first_name: str = Field(max_length=100)
+    last_name: str = Field(max_length=100)
+    middle_name: Optional[str] = Field(default=None, max_length=100)
+    email: Optional[str] = Field(default=None, max_length=255)
+    phone: Optional[str] = Field(default=None, max_length=20)
+    address: Optional[str] = None
+    registration_date: date = Field(default_factory=date.today)
+    status: str = Field(default="active", max_length=20)
+    max_books: int = Field(default=5)
+    created_at: datetime = Field(default_factory=datetime.now)
+    updated_at: datetime = Field(default_factory=datetime.now)
+    
+    # Связи
+    loans: List["Loan"] = Relationship(back_populates="reader")
+    reservations: List["Reservation"] = Relationship(back_populates="reader")
+
+
+class Librarian(SQLModel, table=True):
+    """Модель библиотекаря"""
+    __tablename__ = "librarians"
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    employee_number: str = Field(max_length=50, unique=True)
+    first_name: str = Field(max_length=100)
+    last_name: str = Field(max_length=100)
+    middle_name: Optional[str] = Field(default=None, max_length=100)
+    position: str = Field(max_length=100)
+    email: Optional[str] = Field(default=None, max_length=255)
+    phone: Optional[str] = Field(default=None, max_length=20)
+    hire_date: date
+    status: str = Field(default="working", max_length=20)
+    created_at: datetime = Field(default_factory=datetime.now)
+    updated_at: datetime = Field(default_factory=datetime.now)
+    
+    # Связи
+    loans: List["Loan"] = Relationship(back_populates="librarian")
+
+
+class Loan(SQLModel, table=True):
+    """Модель выдачи книги"""
+    __tablename__ = "loans"
+    __table_args__ = (
+        # Активные выдачи читателя: create_loan, /readers/{id}/active-loans
+        Index("ix_loans_reader_id_status", "reader_id", "status"),
+        # Выдачи с истёкшим сроком: отметка заданием overdue.py
+        Index("ix_loans_status_due_date", "status", "due_date"),
+        # Отмеченные просроченные выдачи: /loans/overdue, начисление штрафов
+        Index(
+            "ix_loans_active_overdue",
+            "is_overdue", "due_date",
+            postgresql_where=text("status = 'active'"),
+            sqlite_where=text("status = 'active'"),
+        ),
+        # Частичный индекс только по активным выдачам: остаётся маленьким,
+        # сколько бы закрытых выдач ни накопилось в истории
+        Index(
+            "ix_loans_active_due_date",
+            "due_date",
+            postgresql_where=text("status = 'active'"),
+            sqlite_where=text("status = 'active'"),
+        ),
+        # Соединение экземпляров с выдачами: /statistics/popular-books
+        Index("ix_loans_copy_id", "copy_id"),
+    )
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    copy_id: int = Field(foreign_key="book_copies.id")
+    reader_id: int = Field(foreign_key="readers.id")
+    librarian_id: int = Field(foreign_key="librarians.id")
+    loan_date: date = Field(default_factory=date.today)
+    due_date: date
+    return_date: Optional[date] = None
+    status: str = Field(default="active", max_length=20)
+    fine_amount: Decimal = Field(default=Decimal("0.00"))
+    # Отмечается заданием overdue.py, когда срок истёк, а выдача не закрыта
+    is_overdue: bool = Field(default=False, sa_column_kwargs={"server_default": false()})
+    # Дата, на которую начислен штраф fine_amount
+    fine_assessed_on: Optional[date] = None
+    notes: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.now)
+    updated_at: datetime = Field(default_factory=datetime.now)
+    
+    # Связи
+    copy: BookCopy = Relationship(back_populates="loans")
+    reader: Reader = Relationship(back_populates="loans")
+    librarian: Librarian = Relationship(back_populates="loans")
+
+
+class Reservation(SQLModel, table=True):
+    """Модель резервации книги"""
+    __tablename__ = "reservations"
+    __table_args__ = (
+        # Очередь резерваций книги в порядке (reservation_date, id):
+        # следующий в очереди при возврате, место читателя в очереди,
+        # /reservations/book/{id}; expiry_date - для отбора без чтения строк
+        Index(
+            "ix_reservations_queue",
+            "book_id", "status", "reservation_date", "id",
+            postgresql_include=["expiry_date"],
+        ),
+        # Резервации читателя: /reservations/reader/{id}, выдача отложенного экземпляра
+        Index("ix_reservations_reader_id_status", "reader_id", "status"),
+        # Истёкшие резервации в очереди и отложенные: reservation_expiry.py
+        Index("ix_reservations_status_expiry_date", "status", "expiry_date"),
+    )
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    book_id: int = Field(foreign_key="books.id")
+    reader_id: int = Field(foreign_key="readers.id")
+    reservation_date: date = Field(default_factory=date.today)
+    expiry_date: date
+    # active - в очереди, ready - экземпляр copy_id отложен для читателя,
+    # fulfilled - выдан, cancelled, expired
+    status: str = Field(default="active", max_length=20)
+    copy_id: Optional[int] = Field(default=None, foreign_key="book_copies.id")
+    notification_sent: bool = Field(default=False)
+    created_at: datetime = Field(default_factory=datetime.now)
+    updated_at: datetime = Field(default_factory=datetime.now)
+    
+    # Связи
+    book: Book = Relationship(back_populates="reservations")
+    reader: Reader = Relationship(back_populates="reservations")
+
+
+
+class LibraryCounters(SQLModel, table=True):
+    """Счётчики общей статистики (единственная строка)
+
+    Обновляются в тех же транзакциях, что и выдачи, возвраты и создание
+    книг и читателей, поэтому /statistics читает одну строку вместо
+    подсчёта по таблицам. overdue_loans - активные выдачи, отмеченные
+    заданием overdue.py (is_overdue); overdue_as_of - дата его прохода.
+    """
+    __tablename__ = "library_counters"
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    total_books: int = Field(default=0)
+    total_copies: int = Field(default=0)
+    available_copies: int = Field(default=0)
+    total_readers: int = Field(default=0)
+    active_readers: int = Field(default=0)
+    active_loans: int = Field(default=0)
+    overdue_loans: int = Field(default=0)
+    overdue_as_of: date = Field(default_factory=date.today)
+    updated_at: datetime = Field(default_factory=datetime.now)
+
+
+class JobState(SQLModel, table=True):
+    """Состояние периодического задания (scheduler.py)
+
+    next_run_at не даёт нескольким worker'ам выполнить задание одновременно,
+    watermark - до какой даты задание уже обработало данные.
+    """
+    __tablename__ = "job_state"
+    
+    name: str = Field(primary_key=True, max_length=50)
+    watermark: Optional[date] = None
+    next_run_at: Optional[datetime] = None
+    last_run_at: Optional[datetime] = None
+    last_rows: int = Field(default=0)
+
+
+class BookLoanRollup(SQLModel, table=True):
+    """Количество выдач книги за месяц (для рейтинга популярных книг)"""
+    __tablename__ = "book_loan_rollups"
+    
+    month: date = Field(primary_key=True)
+    book_id: int = Field(primary_key=True, foreign_key="books.id")
+    loan_count: int = Field(default=0)
+
+
+class ReaderLoanRollup(SQLModel, table=True):
+    """Количество выдач читателю за месяц (для рейтинга активных читателей)"""
+    __tablename__ = "reader_loan_rollups"
+    
+    month: date = Field(primary_key=True)
+    reader_id: int = Field(primary_key=True, foreign_key="readers.id")
+    loan_count: int = Field(default=0)
+
+
+class CatalogVersion(SQLModel, table=True):
+    """Счётчик изменений части каталога (для ETag условных GET-запросов)
+
+    scope - что изменилось: "books" (список книг), "book:{id}" (книга),
+    "copies:{id}" (экземпляры книги) или "epoch" (все ETag сразу).
+    """
+    __tablename__ = "catalog_versions"
+    
+    scope: str = Field(primary_key=True, max_length=100)
+    version: int = Field(default=0)
+    updated_at: datetime = Field(default_factory=datetime.now)
+
+
+# Расширение для триграммного индекса должно существовать до создания таблиц
+event.listen(
+    SQLModel.metadata,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
@@ -0,0 +1,188 @@
+"""
+Отметка просроченных выдач и начисление штрафов
+
+Периодическое задание (scheduler.py, раз в OVERDUE_JOB_SECONDS) отмечает
+is_overdue у активных выдач с истёкшим сроком и начисляет им штраф по
+тарифу: FINE_PER_DAY за каждый день просрочки сверх FINE_GRACE_DAYS,
+не больше FINE_MAX (0 - без ограничения). /loans/overdue читает только
+отмеченные выдачи по частичному индексу ix_loans_active_overdue.
+Отметка - единственное определение просроченной выдачи: счётчик
+overdue_loans для /statistics (counters.py) задание увеличивает в той же
+транзакции, что и отметку, а дату прохода сохраняет в overdue_as_of.
+
+Работа делится на порции по OVERDUE_CHUNK_SIZE выдач, каждая - отдельная
+короткая транзакция (выбор ID с LIMIT n и UPDATE ... WHERE id IN (...)
+с повторной проверкой условий), поэтому строки не остаются
+заблокированными на время всего прохода, а выдача и возврат книг не ждут
+задание. Проход заканчивается, только когда выбор порции пуст. Отметка
+watermark - дата прошлого прохода: отмечаются только выдачи со сроком
+после неё (те, что просрочились с тех пор), без повторного просмотра
+всех активных выдач; новая отметка сохраняется после всего прохода.
+
+Штраф - сумма на дату начисления (fine_assessed_on), а не приращение,
+поэтому повторный проход за тот же день ничего не меняет. При возврате
+штраф считается по тому же тарифу на дату возврата.
+
+Запуск вне расписания:
+    python overdue.py           # с отметки прошлого прохода
+    python overdue.py --full    # по всем активным выдачам
+
+Автор: Софья Шипенкова
+"""
+
+import argparse
+import os
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Dict, Optional
+
+from sqlalchemy import Date, Integer, Numeric, case, cast, literal, true, false, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import aliased
+from sqlmodel import select, and_, or_, func
+
+from models import Loan
+import counters
+import scheduler
+
+
+# Тариф штрафа
+FINE_PER_DAY = Decimal(os.getenv("FINE_PER_DAY", "10.00"))
+FINE_GRACE_DAYS = int(os.getenv("FINE_GRACE_DAYS", "0"))
+FINE_MAX = Decimal(os.getenv("FINE_MAX", "0"))
+
+# Сколько выдач обрабатывается одной транзакцией
+OVERDUE_CHUNK_SIZE = int(os.getenv("OVERDUE_CHUNK_SIZE", "1000"))
+
+# Как часто выполняется задание, с
+OVERDUE_JOB_SECONDS = float(os.getenv("OVERDUE_JOB_SECONDS", "3600"))
+
+NO_FINE = Decimal("0.00")
+
+
+# ==================== ТАРИФ ====================
+
+def fine_for(due_date: date, on_date: date) -> Decimal:
+    """Штраф за выдачу со сроком due_date на дату on_date"""
+    days = (on_date - due_date).days - FINE_GRACE_DAYS
+    if days <= 0:
+        return NO_FINE
+    amount = FINE_PER_DAY * days
+    return min(amount, FINE_MAX) if FINE_MAX else amount
+
+
+def days_overdue(dialect_name: str, today: date):
+    """Выражение SQL: число дней просрочки выдачи на дату today"""
+    if dialect_name == "postgresql":
+        # Разность дат в PostgreSQL - целое число дней
+        return literal(today, Date) - Loan.due_date
+    if dialect_name == "sqlite":
+        return cast(func.julianday(literal(today, Date)) - func.julianday(Loan.due_date), Integer)
+    raise NotImplementedError(f"Штрафы не поддерживаются для {dialect_name}")
+
+
+def fine_expression(dialect_name: str, today: date):
+    """Выражение SQL: штраф выдачи на дату today (как fine_for)"""
+    days = days_overdue(dialect_name, today) - FINE_GRACE_DAYS
+    amount = days * literal(FINE_PER_DAY, Numeric(10, 2))
+    if FINE_MAX:
+        cap = literal(FINE_MAX, Numeric(10, 2))
+        amount = case((amount > cap, cap), else_=amount)
+    return case((days > 0, amount), else_=literal(NO_FINE, Numeric(10, 2)))
+
+
+# ==================== ЗАДАНИЕ ====================
+
+def _run_chunks(engine: Engine, conditions, values: dict, counter: Optional[str] = None) -> int:
+    """Обновлять выдачи, подходящие под conditions(таблица), порциями
+
+    Каждая порция - своя транзакция: выбор до OVERDUE_CHUNK_SIZE ID и
+    UPDATE по ним с повторной проверкой условий (выдачу могли закрыть
+    после выбора). Проход заканчивается, когда выбор порции пуст:
+    неполная порция ещё не значит, что подходящих выдач не осталось.
+    Счётчик counter (library_counters) увеличивается на число обновлённых
+    выдач в той же транзакции.
+    """
+    candidate = aliased(Loan)
+    chunk = (
+        select(candidate.id)
+        .where(and_(*conditions(candidate)))
+        .order_by(candidate.due_date, candidate.id)
+        .limit(OVERDUE_CHUNK_SIZE)
+    )
+    total = 0
+    while True:
+        with engine.begin() as connection:
+            loan_ids = connection.execute(chunk).scalars().all()
+            if not loan_ids:
+                return total
+            rows = connection.execute(
+                update(Loan)
+                .where(and_(Loan.id.in_(loan_ids), *conditions(Loan)))
+                .values(updated_at=datetime.now(), **values)
+            ).rowcount
+            if counter and rows:
+                connection.execute(counters.adjust_statement(**{counter: rows}))
+            total += rows
+
+
+def mark_overdue(engine: Engine, today: date, since: Optional[date] = None) -> int:
+    """Отметить выдачи, срок которых истёк (с since - только после него)"""
+    def conditions(table):
+        result = [
+            table.status == "active",
+            table.is_overdue == false(),
+            table.due_date < today,
+        ]
+        if since is not None:
+            result.append(table.due_date >= since)
+        return result
+
+    marked = _run_chunks(engine, conditions, {"is_overdue": True}, counter="overdue_loans")
+    with engine.begin() as connection:
+        connection.execute(counters.adjust_statement().values(overdue_as_of=today))
+    return marked
+
+
+def accrue_fines(engine: Engine, today: date) -> int:
+    """Начислить штраф отмеченным выдачам, у которых он не начислен сегодня"""
+    def conditions(table):
+        return [
+            table.status == "active",
+            table.is_overdue == true(),
+            or_(table.fine_assessed_on.is_(None), table.fine_assessed_on < today),
+        ]
+
+    return _run_chunks(engine, conditions, {
+        "fine_amount": fine_expression(engine.dialect.name, today),
+        "fine_assessed_on": today,
+    })
+
+
+def run(engine: Engine, watermark: Optional[date] = None) -> scheduler.JobResult:
+    """Отметить новые просроченные выдачи и начислить штрафы"""
+    today = date.today()
+    rows: Dict[str, int] = {
+        "marked": mark_overdue(engine, today, since=watermark),
+        "fined": accrue_fines(engine, today),
+    }
+    return today, rows
+
+
+job = scheduler.Job("overdue", OVERDUE_JOB_SECONDS, run)
+
+
+if __name__ == "__main__":
+    from database import init_db
+
+    parser = argparse.ArgumentParser(description="Отметка просроченных выдач и штрафы")
+    parser.add_argument("--full", action="store_true", help="просмотреть все активные выдачи")
+    args = parser.parse_args()
+
+    init_db()
+    if args.full:
+        # Отметка прошлого прохода не учитывается, новая сохраняется как обычно
+        job = scheduler.Job(job.name, job.interval, lambda engine, watermark: run(engine))
+    result = scheduler.run_once(job)
+    print(f"Отмечено просроченных: {result['rows']['marked']}, "
+          f"начислено штрафов: {result['rows']['fined']}")
@@ -0,0 +1,76 @@
+"""
+Постраничный вывод по курсору (keyset pagination)
+
+Вместо OFFSET следующая страница выбирается условием «ключ сортировки
+больше последнего ключа предыдущей страницы», поэтому любая страница
+читается по индексу за одинаковое время. Курсор - непрозрачная строка
+(base64 от JSON с именем сортировки и последним ключом).
+
+Автор: Софья Шипенкова
+"""
+
+import base64
+import binascii
+import json
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import tuple_
+
+
+# Заголовок ответа с курсором следующей страницы
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(sort: str, values: Sequence) -> str:
+    """Упаковать ключ последней строки страницы в курсор"""
+    payload = json.dumps({"s": sort, "k": list(values)}, ensure_ascii=False)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str, size: int) -> List:
+    """Распаковать курсор, проверив, что он выдан для той же сортировки"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded))
+        values = payload["k"]
+        cursor_sort = payload["s"]
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
+    if cursor_sort != sort or not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Курсор не соответствует сортировке")
+    return values
+
+
+def sort_columns(sort_keys: Dict[str, Tuple], sort: str) -> Tuple:
+    """Колонки сортировки по её имени"""
+    if sort not in sort_keys:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Недопустимая сортировка. Доступны: {', '.join(sort_keys)}"
+        )
+    return sort_keys[sort]
+
+
+def apply_keyset(statement, columns: Tuple, sort: str, cursor: Optional[str]):
+    """Добавить к запросу сортировку и условие продолжения с курсора"""
+    statement = statement.order_by(*columns)
+    if cursor is None:
+        return statement
+
+    values = decode_cursor(cursor, sort, len(columns))
+    if len(columns) == 1:
+        return statement.where(columns[0] > values[0])
+    return statement.where(tuple_(*columns) > tuple_(*values))
+
+
+def next_cursor(items: List, columns: Tuple, sort: str, limit: int) -> Optional[str]:
+    """Курсор следующей страницы или None, если страница последняя
+
+    Запрос должен выбирать limit + 1 строку: лишняя строка лишь
+    показывает, что следующая страница существует.
+    """
+    if limit < 1 or len(items) <= limit:
+        return None
+    last = items[limit - 1]
+    return encode_cursor(sort, [getattr(last, column.key) for column in columns])
@@ -0,0 +1,89 @@
+"""
+Пул соединений с метриками использования
+
+Пул считает выдачи соединений, время их ожидания (включая установку
+нового соединения и pre-ping) и использование переполнения (overflow).
+Метрики относятся к одному процессу: при запуске нескольких worker'ов
+uvicorn у каждого свой пул.
+
+Автор: Софья Шипенкова
+"""
+
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+
+class PoolMetrics:
+    """Счётчики выдачи соединений из пула"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.overflow_checkouts = 0
+        self.overflow_peak = 0
+
+    def observe(self, wait: float, overflow: int, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            if overflow > 0:
+                self.overflow_checkouts += 1
+                self.overflow_peak = max(self.overflow_peak, overflow)
+
+
+class InstrumentedPoolMixin:
+    """Замер времени получения соединения из пула"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.metrics.observe(time.perf_counter() - started, 0, timed_out=True)
+            raise
+        # Сверх pool_size выдано соединений - значит, используется overflow
+        overflow_in_use = max(0, self.checkedout() - self.size())
+        self.metrics.observe(time.perf_counter() - started, overflow_in_use)
+        return connection
+
+    def statistics(self) -> dict:
+        """Текущее состояние пула и накопленные метрики"""
+        metrics = self.metrics
+        with metrics._lock:
+            checkouts = metrics.checkouts
+            return {
+                "pool_size": self.size(),
+                "max_overflow": self._max_overflow,
+                "timeout": self._timeout,
+                "checked_out": self.checkedout(),
+                "idle": self.checkedin(),
+                "overflow": max(0, self.overflow()),
+                "checkouts": checkouts,
+                "timeouts": metrics.timeouts,
+                "wait_avg_ms": round(metrics.wait_total / checkouts * 1000, 3) if checkouts else 0.0,
+                "wait_max_ms": round(metrics.wait_max * 1000, 3),
+                "overflow_checkouts": metrics.overflow_checkouts,
+                "overflow_peak": metrics.overflow_peak,
+            }
+
+
+class InstrumentedQueuePool(InstrumentedPoolMixin, QueuePool):
+    """QueuePool с метриками (синхронный движок)"""
+
+
+class InstrumentedAsyncQueuePool(InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool с метриками (асинхронный движок)"""
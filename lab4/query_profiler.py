@@ -0,0 +1,254 @@
+"""
+Число SQL-запросов и время базы данных на каждый HTTP-запрос
+
+События before/after_cursor_execute движков (database.py) замеряют каждое
+обращение к базе и записывают его в профиль текущего HTTP-запроса
+(contextvars: профиль виден и в greenlet'ах асинхронного движка, и в
+run_in_threadpool). Middleware создаёт профиль, добавляет к ответу
+заголовок Server-Timing и накапливает отчёт по маршрутам:
+    GET /internal/queries
+
+Если запрос выполняет один и тот же по форме SQL больше NPLUSONE_THRESHOLD
+раз (значения параметров и длина списков IN (...) не учитываются), это
+признак N+1: запрос отмечается в отчёте и в журнале.
+
+Отчёт относится к одному процессу, как и метрики пула.
+
+Автор: Софья Шипенкова
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+logger = logging.getLogger(__name__)
+
+PROFILER_ENABLED = os.getenv("QUERY_PROFILER", "true").lower() in ("1", "true", "yes")
+
+# Сколько повторов одного SQL за запрос ещё не считается N+1
+NPLUSONE_THRESHOLD = int(os.getenv("NPLUSONE_THRESHOLD", "5"))
+
+# Максимальная длина SQL в отчёте
+STATEMENT_PREVIEW_LENGTH = 500
+
+_current_profile: ContextVar[Optional["RequestProfile"]] = ContextVar(
+    "query_profile", default=None
+)
+
+
+# ==================== ФОРМА ЗАПРОСА ====================
+
+# Параметры всех драйверов: ?, $1, %s, %(name)s, :name
+_PLACEHOLDER = r"(?:\?|\$\d+|%s|%\(\w+\)s|:\w+)"
+_PLACEHOLDER_LIST = re.compile(rf"\(\s*{_PLACEHOLDER}(?:\s*,\s*{_PLACEHOLDER})*\s*\)")
+_VALUES_ROWS = re.compile(r"(VALUES\s*\(\.\.\.\))(?:\s*,\s*\(\.\.\.\))+", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+
+
+def statement_shape(statement: str) -> str:
+    """SQL без различий в числе параметров: IN (?, ?, ?) и IN (?) совпадают"""
+    shape = _PLACEHOLDER_LIST.sub("(...)", statement)
+    shape = _VALUES_ROWS.sub(r"\1", shape)
+    return _WHITESPACE.sub(" ", shape).strip()
+
+
+# ==================== ПРОФИЛЬ ЗАПРОСА ====================
+
+class RequestProfile:
+    """Обращения к базе данных в рамках одного HTTP-запроса"""
+
+    def __init__(self, scope: Optional[dict] = None):
+        self.scope = scope
+        self.queries = 0
+        self.db_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement: Optional[str] = None
+        self.shapes: Counter = Counter()
+
+    def observe(self, statement: str, duration: float) -> None:
+        self.queries += 1
+        self.db_time += duration
+        if duration >= self.slowest_time:
+            self.slowest_time = duration
+            self.slowest_statement = statement
+        self.shapes[statement_shape(statement)] += 1
+
+    def repeated(self) -> Optional[Tuple[str, int]]:
+        """Самый частый SQL, если он повторяется больше порога (N+1)"""
+        if not self.shapes:
+            return None
+        shape, count = self.shapes.most_common(1)[0]
+        return (shape, count) if count > NPLUSONE_THRESHOLD else None
+
+
+def route_name(scope: dict) -> str:
+    """Метод и шаблон пути (/books/{book_id}); известен после маршрутизации,
+    ненайденные пути собираются в одну запись"""
+    return f"{scope['method']} {getattr(scope.get('route'), 'path', '<unmatched>')}"
+
+
+def current_endpoint() -> Optional[str]:
+    """Endpoint, в рамках которого выполняется запрос к БД (None вне HTTP-запроса)"""
+    profile = _current_profile.get()
+    if profile is None or profile.scope is None:
+        return None
+    return route_name(profile.scope)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and _current_profile.get() is not None:
+        context._profiler_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_profiler_started", None)
+    profile = _current_profile.get()
+    if started is not None and profile is not None:
+        profile.observe(statement, time.perf_counter() - started)
+
+
+def instrument(engine: Engine) -> None:
+    """Подключить замер запросов к движку (для асинхронного - к sync_engine)"""
+    if PROFILER_ENABLED:
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+# ==================== ОТЧЁТ ПО МАРШРУТАМ ====================
+
+class RouteQueryStatistics:
+    """Накопленные показатели одного маршрута"""
+
+    def __init__(self):
+        self.requests = 0
+        self.queries_total = 0
+        self.queries_max = 0
+        self.db_time_total = 0.0
+        self.db_time_max = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement: Optional[str] = None
+        self.n_plus_one = 0
+        self.repeated_statement: Optional[str] = None
+        self.repeated_max = 0
+
+
+class QueryReport:
+    """Отчёт по маршрутам: число запросов, время БД, самый медленный SQL, N+1"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes: Dict[str, RouteQueryStatistics] = {}
+
+    def record(self, route: str, profile: RequestProfile) -> None:
+        repeated = profile.repeated()
+        if repeated:
+            logger.warning(
+                "Возможный N+1 в %s: %d раз выполнен запрос %s",
+                route, repeated[1], repeated[0][:STATEMENT_PREVIEW_LENGTH]
+            )
+        with self._lock:
+            statistics = self._routes.setdefault(route, RouteQueryStatistics())
+            statistics.requests += 1
+            statistics.queries_total += profile.queries
+            statistics.queries_max = max(statistics.queries_max, profile.queries)
+            statistics.db_time_total += profile.db_time
+            statistics.db_time_max = max(statistics.db_time_max, profile.db_time)
+            if profile.slowest_statement and profile.slowest_time >= statistics.slowest_time:
+                statistics.slowest_time = profile.slowest_time
+                statistics.slowest_statement = profile.slowest_statement
+            if repeated:
+                statistics.n_plus_one += 1
+                if repeated[1] >= statistics.repeated_max:
+                    statistics.repeated_max = repeated[1]
+                    statistics.repeated_statement = repeated[0]
+
+    def statistics(self) -> dict:
+        with self._lock:
+            routes = {
+                route: {
+                    "requests": item.requests,
+                    "queries_avg": round(item.queries_total / item.requests, 2),
+                    "queries_max": item.queries_max,
+                    "db_avg_ms": round(item.db_time_total / item.requests * 1000, 3),
+                    "db_max_ms": round(item.db_time_max * 1000, 3),
+                    "slowest_ms": round(item.slowest_time * 1000, 3),
+                    "slowest_statement": _preview(item.slowest_statement),
+                    "n_plus_one": item.n_plus_one,
+                    "repeated_statement": _preview(item.repeated_statement),
+                    "repeated_max": item.repeated_max,
+                }
+                for route, item in sorted(self._routes.items())
+            }
+        return {"enabled": PROFILER_ENABLED, "threshold": NPLUSONE_THRESHOLD, "routes": routes}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._routes.clear()
+
+
+def _preview(statement: Optional[str]) -> Optional[str]:
+    if statement is None:
+        return None
+    return _WHITESPACE.sub(" ", statement).strip()[:STATEMENT_PREVIEW_LENGTH]
+
+
+query_report = QueryReport()
+
+
+# ==================== MIDDLEWARE ====================
+
+def server_timing(profile: RequestProfile, total: float) -> str:
+    """Значение заголовка Server-Timing (длительности в миллисекундах)"""
+    parts = [
+        f'db;desc="{profile.queries} queries";dur={profile.db_time * 1000:.3f}',
+        f"db-slowest;dur={profile.slowest_time * 1000:.3f}",
+        f"app;dur={total * 1000:.3f}",
+    ]
+    if profile.repeated():
+        parts.append('n-plus-one;desc="repeated statement"')
+    return ", ".join(parts)
+
+
+class QueryProfilerMiddleware:
+    """ASGI middleware: профиль запросов к БД на каждый HTTP-запрос
+
+    Server-Timing отражает запросы, выполненные до начала ответа; запросы
+    потоковых ответов (выгрузки) попадают только в отчёт.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not PROFILER_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope)
+        token = _current_profile.set(profile)
+        started = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((
+                    b"server-timing",
+                    server_timing(profile, time.perf_counter() - started).encode("latin-1"),
+                ))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_profile.reset(token)
+            query_report.record(route_name(scope), profile)
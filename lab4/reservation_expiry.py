@@ -0,0 +1,146 @@
+"""
+Истечение резерваций
+
+Периодическое задание (scheduler.py, раз в RESERVATION_SWEEP_SECONDS)
+переводит в expired резервации, срок которых прошёл:
+    active - резервации в очереди: один запрос UPDATE ... WHERE id IN
+        (SELECT ... LIMIT n) на порцию;
+    ready  - отложенные экземпляры, которые читатель не забрал: экземпляр
+        переходит следующему в очереди или возвращается в библиотеку
+        (reservations.release), с ним меняются счётчики и число
+        экземпляров книги.
+
+Каждая порция - не больше RESERVATION_SWEEP_BATCH резерваций в отдельной
+короткой транзакции, поэтому строки не остаются заблокированными на время
+всего прохода, а создание резерваций, выдача и возврат не ждут задание.
+Порядок блокировок в порции с отложенными экземплярами тот же, что
+у выдачи: сначала экземпляры, затем резервации.
+
+Запуск вне расписания:
+    python reservation_expiry.py
+
+Автор: Софья Шипенкова
+"""
+
+import os
+from datetime import date, datetime
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.orm import aliased
+from sqlmodel import select, and_
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from models import BookCopy, Reservation
+import availability
+import reservations
+import scheduler
+
+
+EXPIRED = "expired"
+
+# Сколько резерваций обрабатывается одной транзакцией
+RESERVATION_SWEEP_BATCH = int(os.getenv("RESERVATION_SWEEP_BATCH", "500"))
+
+# Как часто выполняется задание, с
+RESERVATION_SWEEP_SECONDS = float(os.getenv("RESERVATION_SWEEP_SECONDS", "300"))
+
+
+def expired(status: str, today: date, table=Reservation):
+    """Условие: резервация в статусе status и её срок прошёл"""
+    return and_(table.status == status, table.expiry_date < today)
+
+
+async def expire_queued(engine: AsyncEngine, today: date) -> int:
+    """Перевести в expired истёкшие резервации в очереди, порциями"""
+    candidate = aliased(Reservation)
+    chunk = (
+        select(candidate.id)
+        .where(expired(reservations.QUEUED, today, candidate))
+        .order_by(candidate.expiry_date)
+        .limit(RESERVATION_SWEEP_BATCH)
+    )
+    # Условие проверяется ещё раз: резервацию могли занять после выбора порции
+    statement = (
+        update(Reservation)
+        .where(and_(Reservation.id.in_(chunk), expired(reservations.QUEUED, today)))
+        .values(status=EXPIRED, updated_at=datetime.now())
+    )
+    # Неполная порция не значит, что истёкших не осталось: часть выбранных
+    # могли занять параллельно. Проход заканчивается на пустой порции
+    total = 0
+    while True:
+        async with engine.begin() as connection:
+            rows = (await connection.execute(statement)).rowcount
+        if not rows:
+            return total
+        total += rows
+
+
+async def _release_batch(session: AsyncSession, today: date) -> Tuple[int, int]:
+    """Одна порция отложенных резерваций: (выбрано, переведено в expired)"""
+    held = (await session.exec(
+        select(Reservation.id, Reservation.copy_id)
+        .where(expired(reservations.HELD, today))
+        .order_by(Reservation.expiry_date, Reservation.id)
+        .limit(RESERVATION_SWEEP_BATCH)
+    )).all()
+    if not held:
+        return 0, 0
+
+    # Экземпляры блокируются раньше резерваций, как при выдаче
+    await session.exec(
+        select(BookCopy.id)
+        .where(BookCopy.id.in_(sorted({copy_id for _, copy_id in held})))
+        .order_by(BookCopy.id)
+        .with_for_update()
+    )
+    # Резервацию могли забрать или отменить после выбора порции
+    copies = dict((await session.execute(
+        update(Reservation)
+        .where(and_(
+            Reservation.id.in_([reservation_id for reservation_id, _ in held]),
+            expired(reservations.HELD, today)
+        ))
+        .values(status=EXPIRED, updated_at=datetime.now())
+        .returning(Reservation.copy_id, Reservation.book_id),
+        execution_options={"synchronize_session": False}
+    )).all())
+    book_ids = await reservations.release(session, copies)
+    await session.commit()
+    await availability.invalidate(book_ids)
+    return len(held), len(copies)
+
+
+async def release_held(engine: AsyncEngine, today: date) -> int:
+    """Перевести в expired незабранные отложенные резервации, порциями"""
+    total = 0
+    while True:
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            selected, released = await _release_batch(session, today)
+        total += released
+        if selected < RESERVATION_SWEEP_BATCH:
+            return total
+
+
+async def run(engine: AsyncEngine, watermark: Optional[date] = None) -> scheduler.JobResult:
+    """Перевести в expired истёкшие резервации"""
+    today = date.today()
+    rows: Dict[str, int] = {
+        "expired": await expire_queued(engine, today),
+        "released": await release_held(engine, today),
+    }
+    return today, rows
+
+
+job = scheduler.Job("reservation_expiry", RESERVATION_SWEEP_SECONDS, run)
+
+
+if __name__ == "__main__":
+    from database import init_db
+
+    init_db()
+    result = scheduler.run_once(job)
+    print(f"Истекло резерваций в очереди: {result['rows']['expired']}, "
+          f"отложенных: {result['rows']['released']}")
@@ -0,0 +1,255 @@
+"""
+Очередь резерваций книги
+
+Резервации книги образуют очередь в порядке (reservation_date, id).
+Возвращённый экземпляр (а также новый и вернувшийся из реставрации)
+в той же транзакции откладывается для первой действующей резервации
+очереди (expiry_date не прошла): резервация переходит в ready с copy_id
+и сроком получения RESERVATION_HOLD_DAYS, экземпляр - в статус reserved.
+Выдать отложенный экземпляр можно только этому читателю; выдача переводит
+резервацию в fulfilled. Если отложенная резервация отменена, экземпляр
+переходит следующему в очереди или возвращается в библиотеку.
+
+Первые в очередях книг выбираются одним запросом (UNION ALL по книгам,
+в каждой ветви - чтение индекса ix_reservations_queue с LIMIT), поэтому
+пакетный возврат не читает таблицу резерваций целиком. Место читателя
+в очереди - подсчёт по тому же индексу только среди резерваций книги,
+стоящих впереди.
+
+Поиск места стоит O(log n + k), где k - число резерваций впереди, а не
+O(log n): спуск по индексу к началу очереди книги и подсчёт k записей.
+Для O(log n) пришлось бы хранить место в строке резервации, но тогда
+отмена или истечение резервации в середине очереди переписывали бы места
+всех стоящих за ней. Очереди одной книги короткие (десятки читателей),
+поэтому подсчёт дешевле.
+
+Автор: Софья Шипенкова
+"""
+
+import os
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Set
+
+from sqlalchemy import case, tuple_, union_all, update
+from sqlalchemy.orm import aliased
+from sqlmodel import select, and_, func
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from models import BookCopy, Reservation
+import availability
+import counters
+import etags
+
+
+# Сколько дней отложенный экземпляр ждёт читателя
+RESERVATION_HOLD_DAYS = int(os.getenv("RESERVATION_HOLD_DAYS", "3"))
+
+# Сколько раз выбираются следующие в очереди, если первых перехватила
+# параллельная транзакция (другой возврат той же книги, отмена)
+ALLOCATION_ATTEMPTS = 3
+
+QUEUED = "active"
+HELD = "ready"
+HELD_COPY_STATUS = "reserved"
+
+
+def queue_order():
+    return (Reservation.reservation_date, Reservation.id)
+
+
+def waiting(today: date):
+    """Условие: резервация стоит в очереди и не истекла"""
+    return and_(Reservation.status == QUEUED, Reservation.expiry_date >= today)
+
+
+def held_for(copy_id, reader_id):
+    """Условие EXISTS: экземпляр отложен для читателя"""
+    return select(Reservation.id).where(
+        and_(
+            Reservation.reader_id == reader_id,
+            Reservation.status == HELD,
+            Reservation.copy_id == copy_id
+        )
+    ).exists()
+
+
+# ==================== ОЧЕРЕДЬ ====================
+
+def queue_heads_statement(needed: Dict[int, int], today: date, skipped: Set[int]):
+    """Первые needed[book_id] действующих резерваций каждой книги"""
+    branches = []
+    for book_id, count in sorted(needed.items()):
+        statement = (
+            select(Reservation.id, Reservation.book_id, Reservation.reservation_date)
+            .where(and_(Reservation.book_id == book_id, waiting(today)))
+            .order_by(*queue_order())
+            .limit(count)
+        )
+        if skipped:
+            statement = statement.where(Reservation.id.not_in(skipped))
+        # Подзапрос: LIMIT ветви не должен относиться ко всему UNION
+        branches.append(select(statement.subquery()))
+    return branches[0] if len(branches) == 1 else union_all(*branches)
+
+
+async def allocate(session: AsyncSession, copies: Dict[int, int]) -> Dict[int, int]:
+    """Отложить экземпляры {copy_id: book_id} для первых в очередях их книг
+
+    Возвращает {copy_id: reservation_id} отложенных экземпляров; статус
+    самих экземпляров меняет вызывающий (hold_copies). Резервация
+    занимается условным UPDATE ... WHERE status = 'active': если её
+    успела занять другая транзакция, выбирается следующая в очереди.
+    """
+    today = date.today()
+    pending: Dict[int, List[int]] = defaultdict(list)
+    for copy_id, book_id in sorted(copies.items()):
+        pending[book_id].append(copy_id)
+
+    allocated: Dict[int, int] = {}
+    skipped: Set[int] = set()
+    for _ in range(ALLOCATION_ATTEMPTS):
+        needed = {book_id: len(copy_ids) for book_id, copy_ids in pending.items() if copy_ids}
+        if not needed:
+            break
+        heads = (await session.execute(queue_heads_statement(needed, today, skipped))).all()
+        if not heads:
+            break
+
+        # Экземпляры книги - первым в её очереди, по порядку
+        offered: Dict[int, int] = {}
+        by_book: Dict[int, list] = defaultdict(list)
+        for head in heads:
+            by_book[head.book_id].append(head)
+        for book_id, book_heads in by_book.items():
+            book_heads.sort(key=lambda head: (head.reservation_date, head.id))
+            for head, copy_id in zip(book_heads, pending[book_id]):
+                offered[head.id] = copy_id
+        skipped.update(offered)
+
+        taken = dict((await session.execute(
+            update(Reservation)
+            .where(and_(Reservation.id.in_(sorted(offered)), Reservation.status == QUEUED))
+            .values(
+                status=HELD,
+                copy_id=case(offered, value=Reservation.id),
+                expiry_date=today + timedelta(days=RESERVATION_HOLD_DAYS),
+                notification_sent=False,
+                updated_at=datetime.now(),
+            )
+            .returning(Reservation.copy_id, Reservation.id),
+            execution_options={"synchronize_session": False}
+        )).all())
+        allocated.update(taken)
+        for book_id in pending:
+            pending[book_id] = [copy_id for copy_id in pending[book_id] if copy_id not in taken]
+
+        # Все предложенные резервации заняты: у оставшихся экземпляров
+        # очередь исчерпана. Иначе - выбрать следующих в очереди
+        if len(taken) == len(offered):
+            break
+
+    if allocated:
+        await etags.bump(session, *(
+            etags.copies_scope(copies[copy_id]) for copy_id in allocated
+        ))
+    return allocated
+
+
+async def hold_copies(session: AsyncSession, copy_ids: Iterable[int]) -> None:
+    """Перевести отложенные экземпляры в статус reserved"""
+    copy_ids = sorted(copy_ids)
+    if copy_ids:
+        await session.execute(
+            update(BookCopy)
+            .where(BookCopy.id.in_(copy_ids))
+            .values(status=HELD_COPY_STATUS, updated_at=datetime.now()),
+            execution_options={"synchronize_session": False}
+        )
+
+
+async def release(session: AsyncSession, copies: Dict[int, int]) -> List[int]:
+    """Освободить отложенные экземпляры {copy_id: book_id} (отмена, истечение)
+
+    Экземпляр переходит следующему в очереди или возвращается
+    в библиотеку. Возвращает ID книг, записи которых нужно сбросить
+    в кеше после commit.
+    """
+    if not copies:
+        return []
+    allocated = await allocate(session, copies)
+    rest = sorted(set(copies) - set(allocated))
+    if not rest:
+        return []
+    returned = dict((await session.execute(
+        update(BookCopy)
+        .where(and_(BookCopy.id.in_(rest), BookCopy.status == HELD_COPY_STATUS))
+        .values(status=availability.AVAILABLE_STATUS, updated_at=datetime.now())
+        .returning(BookCopy.id, BookCopy.book_id),
+        execution_options={"synchronize_session": False}
+    )).all())
+    if not returned:
+        return []
+    await counters.adjust(session, available_copies=len(returned))
+    return await availability.adjust(session, Counter(returned.values()))
+
+
+def picked_up_statement(reader_id: int, copy_ids):
+    """UPDATE резерваций читателя, отложенные экземпляры которых выданы
+
+    copy_ids - список ID или подзапрос (выдача одним запросом, loans.py).
+    """
+    return (
+        update(Reservation)
+        .where(and_(
+            Reservation.reader_id == reader_id,
+            Reservation.status == HELD,
+            Reservation.copy_id.in_(copy_ids)
+        ))
+        .values(status="fulfilled", updated_at=datetime.now())
+    )
+
+
+async def picked_up(session: AsyncSession, reader_id: int, copy_ids: Iterable[int]) -> None:
+    """Закрыть резервации читателя, отложенные экземпляры которых выданы"""
+    copy_ids = sorted(copy_ids)
+    if copy_ids:
+        await session.execute(
+            picked_up_statement(reader_id, copy_ids),
+            execution_options={"synchronize_session": False}
+        )
+
+
+# ==================== МЕСТО В ОЧЕРЕДИ ====================
+
+def reader_reservations_statement(reader_id: int, today: date):
+    """Резервации читателя в очереди и отложенные, с местом в очереди
+
+    Место - число действующих резерваций той же книги впереди плюс один;
+    считается по индексу ix_reservations_queue от начала очереди книги
+    до резервации читателя (O(log n + k), см. описание модуля).
+    """
+    ahead = aliased(Reservation)
+    position = (
+        select(func.count())
+        .select_from(ahead)
+        .where(and_(
+            ahead.book_id == Reservation.book_id,
+            ahead.status == QUEUED,
+            tuple_(ahead.reservation_date, ahead.id)
+            < tuple_(Reservation.reservation_date, Reservation.id),
+            ahead.expiry_date >= today
+        ))
+        .scalar_subquery()
+    )
+    return (
+        select(
+            Reservation,
+            case((Reservation.status == QUEUED, position + 1), else_=None).label("position")
+        )
+        .where(and_(
+            Reservation.reader_id == reader_id,
+            Reservation.status.in_([QUEUED, HELD])
+        ))
+        .order_by(*queue_order())
+    )
@@ -0,0 +1,243 @@
+"""
+Предагрегированные рейтинги популярных книг и активных читателей
+
+Таблицы book_loan_rollups и reader_loan_rollups хранят количество выдач
+по месяцам. При каждой выдаче соответствующие строки увеличиваются
+(INSERT ... ON CONFLICT DO UPDATE) в той же транзакции, поэтому рейтинги
+суммируют несколько строк на книгу вместо группировки всей истории
+выдач. Окно рейтинга (последние N дней) округляется до начала месяца.
+
+Полное перестроение по истории выдач:
+    python rollups.py --rebuild
+Перестроение блокирует таблицы рейтингов (в PostgreSQL - LOCK TABLE
+IN EXCLUSIVE MODE, чтение не блокируется): выдачи, уже изменившие
+рейтинги, завершаются до пересчёта и попадают в него, а новые ждут его
+commit и увеличивают уже пересчитанные строки. Поэтому выдача во время
+перестроения не теряется и не учитывается дважды. В SQLite запись
+и так блокирует всю базу.
+
+Автор: Софья Шипенкова
+"""
+
+import argparse
+from collections import Counter
+from datetime import date, timedelta
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import Date, cast, delete, exc, insert, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection
+from sqlmodel import select, func
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from models import Book, BookCopy, BookLoanRollup, Loan, Reader, ReaderLoanRollup
+from schemas import ActiveReader, PopularBook
+
+
+def month_start(day: date) -> date:
+    """Первое число месяца"""
+    return day.replace(day=1)
+
+
+def _increment_on_conflict(statement, model, key_name: str):
+    return statement.on_conflict_do_update(
+        index_elements=["month", key_name],
+        set_={"loan_count": model.loan_count + statement.excluded.loan_count},
+    )
+
+
+def _upsert_increments(dialect_name: str, model, key_name: str, counts: Counter):
+    """INSERT новых строк или увеличение loan_count существующих"""
+    if dialect_name == "postgresql":
+        statement = postgresql.insert(model)
+    elif dialect_name == "sqlite":
+        statement = sqlite.insert(model)
+    else:
+        raise NotImplementedError(f"Рейтинги не поддерживаются для {dialect_name}")
+
+    # Строки упорядочены, чтобы параллельные транзакции блокировали их в одном порядке
+    return _increment_on_conflict(statement.values([
+        {"month": month, key_name: key, "loan_count": count}
+        for (month, key), count in sorted(counts.items())
+    ]), model, key_name)
+
+
+def upsert_from_select(model, key_name: str, rows):
+    """То же для строк (month, ключ, loan_count) из запроса rows
+    (PostgreSQL, для CTE: INSERT ... SELECT)"""
+    statement = postgresql.insert(model).from_select(["month", key_name, "loan_count"], rows)
+    return _increment_on_conflict(statement, model, key_name)
+
+
+async def loans_created(session: AsyncSession, loans: Iterable[Tuple[int, int, date]]) -> None:
+    """Учесть новые выдачи (book_id, reader_id, loan_date) в рейтингах
+
+    Каждая таблица обновляется одним запросом в текущей транзакции.
+    """
+    books: Counter = Counter()
+    readers: Counter = Counter()
+    for book_id, reader_id, loan_date in loans:
+        month = month_start(loan_date)
+        books[(month, book_id)] += 1
+        readers[(month, reader_id)] += 1
+    if not books:
+        return
+
+    dialect_name = session.bind.dialect.name
+    await session.execute(
+        _upsert_increments(dialect_name, BookLoanRollup, "book_id", books)
+    )
+    await session.execute(
+        _upsert_increments(dialect_name, ReaderLoanRollup, "reader_id", readers)
+    )
+
+
+async def loan_created(session: AsyncSession, book_id: int, reader_id: int, loan_date: date) -> None:
+    """Учесть новую выдачу в рейтингах (в текущей транзакции)"""
+    await loans_created(session, [(book_id, reader_id, loan_date)])
+
+
+def window_start(days: Optional[int], today: Optional[date] = None) -> Optional[date]:
+    """Первый месяц, входящий в окно последних days дней"""
+    if days is None:
+        return None
+    today = today or date.today()
+    return month_start(today - timedelta(days=days))
+
+
+async def popular_books(session: AsyncSession, limit: int, days: Optional[int] = None) -> List[PopularBook]:
+    """Самые популярные книги за всё время или за последние days дней"""
+    totals = select(
+        BookLoanRollup.book_id,
+        func.sum(BookLoanRollup.loan_count).label("loan_count")
+    )
+    since = window_start(days)
+    if since:
+        totals = totals.where(BookLoanRollup.month >= since)
+    totals = (
+        totals.group_by(BookLoanRollup.book_id)
+        .order_by(func.sum(BookLoanRollup.loan_count).desc(), BookLoanRollup.book_id)
+        .limit(limit)
+        .subquery()
+    )
+
+    statement = (
+        select(Book.id, Book.title, totals.c.loan_count)
+        .join(totals, totals.c.book_id == Book.id)
+        .order_by(totals.c.loan_count.desc(), Book.id)
+    )
+    results = (await session.exec(statement)).all()
+    return [
+        PopularBook(book_id=r[0], title=r[1], loan_count=r[2])
+        for r in results
+    ]
+
+
+async def active_readers(session: AsyncSession, limit: int, days: Optional[int] = None) -> List[ActiveReader]:
+    """Самые активные читатели за всё время или за последние days дней"""
+    totals = select(
+        ReaderLoanRollup.reader_id,
+        func.sum(ReaderLoanRollup.loan_count).label("loan_count")
+    )
+    since = window_start(days)
+    if since:
+        totals = totals.where(ReaderLoanRollup.month >= since)
+    totals = (
+        totals.group_by(ReaderLoanRollup.reader_id)
+        .order_by(func.sum(ReaderLoanRollup.loan_count).desc(), ReaderLoanRollup.reader_id)
+        .limit(limit)
+        .subquery()
+    )
+
+    statement = (
+        select(
+            Reader.id,
+            Reader.first_name,
+            Reader.last_name,
+            Reader.library_card_number,
+            totals.c.loan_count
+        )
+        .join(totals, totals.c.reader_id == Reader.id)
+        .order_by(totals.c.loan_count.desc(), Reader.id)
+    )
+    results = (await session.exec(statement)).all()
+    return [
+        ActiveReader(
+            reader_id=r[0],
+            name=f"{r[1]} {r[2]}",
+            card_number=r[3],
+            loan_count=r[4]
+        )
+        for r in results
+    ]
+
+
+# ==================== ПЕРЕСТРОЕНИЕ ПО ИСТОРИИ ====================
+
+def _month_expression(column, dialect_name: str):
+    """Начало месяца даты средствами SQL"""
+    if dialect_name == "sqlite":
+        return func.date(column, "start of month")
+    return cast(func.date_trunc("month", column), Date)
+
+
+def rebuild(connection: Connection) -> int:
+    """Перестроить рейтинги по всей истории выдач, вернуть число выдач"""
+    dialect_name = connection.dialect.name
+    month = _month_expression(Loan.loan_date, dialect_name)
+
+    if dialect_name == "postgresql":
+        # До commit никто, кроме перестроения, не меняет рейтинги
+        connection.execute(text(
+            f"LOCK TABLE {BookLoanRollup.__tablename__}, {ReaderLoanRollup.__tablename__} "
+            "IN EXCLUSIVE MODE"
+        ))
+    connection.execute(delete(BookLoanRollup))
+    connection.execute(delete(ReaderLoanRollup))
+    connection.execute(
+        insert(BookLoanRollup).from_select(
+            ["month", "book_id", "loan_count"],
+            select(month, BookCopy.book_id, func.count())
+            .select_from(Loan)
+            .join(BookCopy, BookCopy.id == Loan.copy_id)
+            .group_by(month, BookCopy.book_id)
+        )
+    )
+    connection.execute(
+        insert(ReaderLoanRollup).from_select(
+            ["month", "reader_id", "loan_count"],
+            select(month, Loan.reader_id, func.count())
+            .group_by(month, Loan.reader_id)
+        )
+    )
+    return connection.execute(
+        select(func.coalesce(func.sum(ReaderLoanRollup.loan_count), 0))
+    ).scalar_one()
+
+
+def ensure_rollups(connection: Connection) -> None:
+    """Заполнить рейтинги, если они пусты, а выдачи уже есть"""
+    if connection.execute(select(ReaderLoanRollup.month).limit(1)).first():
+        return
+    if not connection.execute(select(Loan.id).limit(1)).first():
+        return
+    try:
+        with connection.begin_nested():
+            rebuild(connection)
+    except exc.IntegrityError:
+        # Рейтинги одновременно заполнил другой worker
+        pass
+
+
+if __name__ == "__main__":
+    from database import engine, init_db
+
+    parser = argparse.ArgumentParser(description="Рейтинги книг и читателей")
+    parser.add_argument("--rebuild", action="store_true", help="перестроить по истории выдач")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        init_db()
+        with engine.begin() as connection:
+            count = rebuild(connection)
+        print(f"Учтено выдач: {count}")
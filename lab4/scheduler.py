@@ -0,0 +1,217 @@
+"""
+Периодические задания внутри процесса приложения
+
+Задание - функция run(engine, watermark), которая сама делит работу
+на короткие транзакции и возвращает новую отметку watermark и число
+обработанных строк по видам. Синхронная функция получает синхронный
+движок и выполняется в отдельном потоке, асинхронная (async def) -
+асинхронный движок и выполняется в цикле событий worker'а.
+
+Каждый worker запускает цикл задания в фоне (задача asyncio), но
+выполняет его только тот, кто первым займёт строку job_state условным
+UPDATE ... WHERE next_run_at <= now: при нескольких worker'ах и
+нескольких репликах задание выполняется один раз за интервал.
+
+Метрики library_job_* (metrics.py): запуски, обработанные строки,
+время выполнения. Состояние заданий и запуск вне расписания:
+    GET  /internal/jobs
+    POST /internal/jobs/{name}/run
+
+SCHEDULER_ENABLED=false отключает фоновые циклы (например, если задания
+запускаются по cron из командной строки).
+
+Автор: Софья Шипенкова
+"""
+
+import asyncio
+import logging
+import os
+import time
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel import select, and_, or_
+
+from database import async_engine as default_async_engine, engine as default_engine
+from models import JobState
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Как часто worker проверяет, не пора ли выполнить задание, с
+SCHEDULER_POLL_SECONDS = float(os.getenv("SCHEDULER_POLL_SECONDS", "60"))
+
+# Результат задания: новая отметка и число строк по видам
+JobResult = Tuple[Optional[date], Dict[str, int]]
+
+
+class Job:
+    """Периодическое задание"""
+
+    def __init__(self, name: str, interval: float, run: Callable):
+        self.name = name
+        self.interval = interval
+        self.run = run
+
+    @property
+    def is_async(self) -> bool:
+        return asyncio.iscoroutinefunction(self.run)
+
+
+# ==================== СОСТОЯНИЕ ЗАДАНИЙ ====================
+
+def _ensure_statement(dialect_name: str, name: str):
+    """INSERT строки задания, если её ещё нет"""
+    if dialect_name == "postgresql":
+        statement = postgresql.insert(JobState)
+    elif dialect_name == "sqlite":
+        statement = sqlite.insert(JobState)
+    else:
+        raise NotImplementedError(f"Задания не поддерживаются для {dialect_name}")
+    return statement.values(name=name).on_conflict_do_nothing(index_elements=["name"])
+
+
+def claim(connection: Connection, job: Job, force: bool = False):
+    """Занять задание на интервал; строка (watermark,) или None, если
+    задание уже выполняет или недавно выполнил другой процесс"""
+    connection.execute(_ensure_statement(connection.dialect.name, job.name))
+    now = datetime.now()
+    condition = JobState.name == job.name
+    if not force:
+        condition = and_(
+            condition,
+            or_(JobState.next_run_at.is_(None), JobState.next_run_at <= now)
+        )
+    return connection.execute(
+        update(JobState)
+        .where(condition)
+        .values(next_run_at=now + timedelta(seconds=job.interval))
+        .returning(JobState.watermark)
+    ).first()
+
+
+def finish(connection: Connection, job: Job, watermark: Optional[date], rows: int) -> None:
+    connection.execute(
+        update(JobState)
+        .where(JobState.name == job.name)
+        .values(watermark=watermark, last_run_at=datetime.now(), last_rows=rows)
+    )
+
+
+# ==================== ПЛАНИРОВЩИК ====================
+
+class Scheduler:
+    """Фоновые циклы заданий одного процесса"""
+
+    def __init__(self, engine: Engine, async_engine: AsyncEngine):
+        self.engine = engine
+        self.async_engine = async_engine
+        self.jobs: Dict[str, Job] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    def add(self, job: Job) -> None:
+        self.jobs[job.name] = job
+
+    async def run(self, name: str, force: bool = False) -> Optional[dict]:
+        """Выполнить задание, если его удалось занять
+
+        force - выполнить вне расписания. Возвращает итог запуска или None.
+        """
+        job = self.jobs[name]
+        async with self.async_engine.begin() as connection:
+            state = await connection.run_sync(claim, job, force)
+        if state is None:
+            return None
+
+        started = time.perf_counter()
+        try:
+            if job.is_async:
+                watermark, rows = await job.run(self.async_engine, state.watermark)
+            else:
+                watermark, rows = await asyncio.to_thread(job.run, self.engine, state.watermark)
+        except Exception:
+            metrics.JOB_RUNS.labels(name, "error").inc()
+            raise
+        elapsed = time.perf_counter() - started
+
+        async with self.async_engine.begin() as connection:
+            await connection.run_sync(finish, job, watermark, sum(rows.values()))
+        metrics.JOB_RUNS.labels(name, "success").inc()
+        metrics.JOB_DURATION.labels(name).observe(elapsed)
+        metrics.JOB_LAST_SUCCESS.labels(name).set(time.time())
+        for kind, count in rows.items():
+            metrics.JOB_ROWS.labels(name, kind).inc(count)
+        logger.info("Задание %s: %s за %.3f с", name, rows, elapsed)
+        return {"job": name, "rows": rows, "watermark": watermark, "seconds": round(elapsed, 3)}
+
+    async def _loop(self, job: Job) -> None:
+        while True:
+            try:
+                await self.run(job.name)
+            except Exception:
+                logger.exception("Задание %s завершилось ошибкой", job.name)
+            await asyncio.sleep(min(job.interval, SCHEDULER_POLL_SECONDS))
+
+    def start(self) -> None:
+        """Запустить фоновые циклы заданий (при старте worker'а)"""
+        if not SCHEDULER_ENABLED or self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._loop(job)) for job in self.jobs.values()]
+
+    async def stop(self) -> None:
+        """Остановить фоновые циклы
+
+        Прерванная порция асинхронного задания откатывается, синхронное
+        задание дорабатывает текущую порцию в своём потоке.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def states(self) -> List[dict]:
+        """Состояние зарегистрированных заданий"""
+        with self.engine.connect() as connection:
+            rows = {
+                state.name: state
+                for state in connection.execute(
+                    select(JobState).where(JobState.name.in_(sorted(self.jobs)))
+                )
+            }
+        return [
+            {
+                "name": name,
+                "interval": job.interval,
+                "watermark": getattr(rows.get(name), "watermark", None),
+                "next_run_at": getattr(rows.get(name), "next_run_at", None),
+                "last_run_at": getattr(rows.get(name), "last_run_at", None),
+                "last_rows": getattr(rows.get(name), "last_rows", 0),
+            }
+            for name, job in sorted(self.jobs.items())
+        ]
+
+
+scheduler = Scheduler(default_engine, default_async_engine)
+
+
+def add(job: Job) -> None:
+    scheduler.add(job)
+
+
+def run_once(job: Job) -> dict:
+    """Выполнить задание из командной строки (вне расписания)"""
+    async def run() -> dict:
+        try:
+            return await scheduler.run(job.name, force=True)
+        finally:
+            await scheduler.async_engine.dispose()
+
+    add(job)
+    return asyncio.run(run())
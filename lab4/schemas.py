@@ -1,144 +1,350 @@
-"""
-Pydantic схемы для API запросов и ответов
-
-Автор: Софья Шипенкова
-"""
-
-from datetime import date
-from typing import Optional, List
-from pydantic import BaseModel, EmailStr
-from decimal import Decimal
-
-
-# ==================== СХЕМЫ ДЛЯ КНИГ ====================
-
-class BookBase(BaseModel):
-    isbn: Optional[str] = None
-    title: str
-    publisher_id: Optional[int] = None
-    year: Optional[int] = None
-    genre: Optional[str] = None
-    pages: Optional[int] = None
-    language: str = "ru"
-    description: Optional[str] = None
-    location: Optional[str] = None
-
-
-class BookCreate(BookBase):
-    pass
-
-
-class BookResponse(BookBase):
-    id: int
-    date_added: date
-    status: str
-    
-    class Config:
-        from_attributes = True
-
-
-# ==================== СХЕМЫ ДЛЯ ЧИТАТЕЛЕЙ ====================
-
-class ReaderBase(BaseModel):
-    library_card_number: str
-    first_name: str
-    last_name: str
-    middle_name: Optional[str] = None
-    email: Optional[EmailStr] = None
-    phone: Optional[str] = None
-    address: Optional[str] = None
-    max_books: int = 5
-
-
-class ReaderCreate(ReaderBase):
-    pass
-
-
-class ReaderResponse(ReaderBase):
-    id: int
-    registration_date: date
-    status: str
-    
-    class Config:
-        from_attributes = True
-
-
-# ==================== СХЕМЫ ДЛЯ ВЫДАЧ ====================
-
-class LoanCreate(BaseModel):
-    copy_id: int
-    reader_id: int
-    librarian_id: int
-    loan_days: int = 14
-
-
-class LoanResponse(BaseModel):
-    id: int
-    copy_id: int
-    reader_id: int
-    librarian_id: int
-    loan_date: date
-    due_date: date
-    return_date: Optional[date] = None
-    status: str
-    fine_amount: Decimal
-    
-    class Config:
-        from_attributes = True
-
-
-class LoanReturn(BaseModel):
-    fine_amount: Decimal = Decimal("0.00")
-
-
-# ==================== СХЕМЫ ДЛЯ РЕЗЕРВАЦИЙ ====================
-
-class ReservationCreate(BaseModel):
-    book_id: int
-    reader_id: int
-    expiry_days: int = 7
-
-
-class UpdateReservation(BaseModel):
-    book_id: Optional[int] = None
-    reader_id: Optional[int] = None
-    reservation_date: Optional[date] = None
-    expiry_date: Optional[date] = None
-
-class ReservationResponse(BaseModel):
-    id: int
-    book_id: int
-    reader_id: int
-    reservation_date: date
-    expiry_date: date
-    status: str
-    
-    class Config:
-        from_attributes = True
-
-
-# ==================== СХЕМЫ ДЛЯ СТАТИСТИКИ ====================
-
-class LibraryStatistics(BaseModel):
-    total_books: int
-    total_copies: int
-    available_copies: int
-    on_loan_copies: int
-    total_readers: int
-    active_readers: int
-    active_loans: int
-    overdue_loans: int
-
-
-class PopularBook(BaseModel):
-    book_id: int
-    title: str
-    loan_count: int
-
-
-class ActiveReader(BaseModel):
-    reader_id: int
-    name: str
-    card_number: str
-    loan_count: int
-
+"""
+Pydantic схемы для API запросов и ответов
+
+Автор: Софья Шипенкова
+"""
+
+from datetime import date, datetime
+from typing import Optional, List, Dict
+from pydantic import BaseModel, EmailStr, Field, field_validator
+from decimal import Decimal
+
+
+# ==================== СХЕМЫ ДЛЯ КНИГ ====================
+
+class BookBase(BaseModel):
+    isbn: Optional[str] = None
+    title: str
+    publisher_id: Optional[int] = None
+    year: Optional[int] = None
+    genre: Optional[str] = None
+    pages: Optional[int] = None
+    language: str = "ru"
+    description: Optional[str] = None
+    location: Optional[str] = None
+
+
+class BookCreate(BookBase):
+    pass
+
+
+class BookResponse(BookBase):
+    id: int
+    date_added: date
+    status: str
+    total_copies: int = 0
+    available_copies: int = 0
+    
+    class Config:
+        from_attributes = True
+
+
+class BookCopyCreate(BaseModel):
+    inventory_number: str = Field(max_length=50)
+    condition: str = "good"
+    acquisition_date: date = Field(default_factory=date.today)
+    price: Optional[Decimal] = None
+    notes: Optional[str] = None
+
+
+class BookCopyUpdate(BaseModel):
+    condition: Optional[str] = None
+    # on_loan задаётся только выдачей
+    status: Optional[str] = Field(default=None, pattern="^(in_library|restoration|written_off)$")
+    notes: Optional[str] = None
+
+    @field_validator("condition", "status")
+    @classmethod
+    def not_null(cls, value):
+        # Поле можно не передавать, но не обнулять: в таблице оно NOT NULL
+        if value is None:
+            raise ValueError("значение не может быть null")
+        return value
+
+
+class BookCopyResponse(BaseModel):
+    id: int
+    book_id: int
+    inventory_number: str
+    condition: str
+    status: str
+    acquisition_date: date
+    price: Optional[Decimal] = None
+    notes: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+
+class ImportReport(BaseModel):
+    records: int
+    invalid: int
+    rejected: int
+    books: int
+    copies: int
+    authors: int
+    publishers: int
+    book_authors: int
+    skipped_books: int
+    skipped_copies: int
+    errors: List[str]
+    seconds: float
+    records_per_second: float
+    rows_per_second: float
+
+
+# ==================== СХЕМЫ ДЛЯ ЧИТАТЕЛЕЙ ====================
+
+class ReaderBase(BaseModel):
+    library_card_number: str
+    first_name: str
+    last_name: str
+    middle_name: Optional[str] = None
+    email: Optional[EmailStr] = None
+    phone: Optional[str] = None
+    address: Optional[str] = None
+    max_books: int = 5
+
+
+class ReaderCreate(ReaderBase):
+    pass
+
+
+class ReaderResponse(ReaderBase):
+    id: int
+    registration_date: date
+    status: str
+    
+    class Config:
+        from_attributes = True
+
+
+# ==================== СХЕМЫ ДЛЯ ВЫДАЧ ====================
+
+class LoanCreate(BaseModel):
+    copy_id: int
+    reader_id: int
+    librarian_id: int
+    # Выдача не может начинаться просроченной (см. overdue.py)
+    loan_days: int = Field(14, ge=1, le=365)
+
+
+class LoanResponse(BaseModel):
+    id: int
+    copy_id: int
+    reader_id: int
+    librarian_id: int
+    loan_date: date
+    due_date: date
+    return_date: Optional[date] = None
+    status: str
+    fine_amount: Decimal
+    is_overdue: bool = False
+    
+    class Config:
+        from_attributes = True
+
+
+class LoanReturn(BaseModel):
+    # Без суммы штраф считается по тарифу (lab4/overdue.py)
+    fine_amount: Optional[Decimal] = None
+
+
+class LoanBatchCreate(BaseModel):
+    reader_id: int
+    librarian_id: int
+    copy_ids: List[int] = Field(min_length=1, max_length=100)
+    # Выдача не может начинаться просроченной (см. overdue.py)
+    loan_days: int = Field(14, ge=1, le=365)
+
+
+class LoanBatchItem(BaseModel):
+    copy_id: int
+    # created, not_found, unavailable, duplicate, limit_exceeded
+    status: str
+    loan: Optional[LoanResponse] = None
+
+
+class LoanBatchResponse(BaseModel):
+    reader_id: int
+    created: int
+    items: List[LoanBatchItem]
+
+
+class LoanReturnBatch(BaseModel):
+    loan_ids: List[int] = Field(default_factory=list, max_length=1000)
+    inventory_numbers: List[str] = Field(default_factory=list, max_length=1000)
+
+
+class LoanReturnBatchItem(BaseModel):
+    loan_id: Optional[int] = None
+    inventory_number: Optional[str] = None
+    # returned, not_found, already_returned, not_on_loan, duplicate
+    status: str
+    loan: Optional[LoanResponse] = None
+
+
+class LoanReturnBatchResponse(BaseModel):
+    returned: int
+    items: List[LoanReturnBatchItem]
+
+
+# ==================== СХЕМЫ ДЛЯ РЕЗЕРВАЦИЙ ====================
+
+class ReservationCreate(BaseModel):
+    book_id: int
+    reader_id: int
+    expiry_days: int = 7
+
+
+class UpdateReservation(BaseModel):
+    book_id: Optional[int] = None
+    reader_id: Optional[int] = None
+    reservation_date: Optional[date] = None
+    expiry_date: Optional[date] = None
+
+class ReservationResponse(BaseModel):
+    id: int
+    book_id: int
+    reader_id: int
+    reservation_date: date
+    expiry_date: date
+    status: str
+    copy_id: Optional[int] = None
+    
+    class Config:
+        from_attributes = True
+
+
+class ReaderReservation(ReservationResponse):
+    # Место в очереди книги (1 - следующий); None, если экземпляр уже отложен
+    position: Optional[int] = None
+
+
+# ==================== СХЕМЫ ДЛЯ СТАТИСТИКИ ====================
+
+class LibraryStatistics(BaseModel):
+    total_books: int
+    total_copies: int
+    available_copies: int
+    on_loan_copies: int
+    total_readers: int
+    active_readers: int
+    active_loans: int
+    overdue_loans: int
+
+
+class PopularBook(BaseModel):
+    book_id: int
+    title: str
+    loan_count: int
+
+
+class ActiveReader(BaseModel):
+    reader_id: int
+    name: str
+    card_number: str
+    loan_count: int
+
+
+# ==================== СХЕМЫ ДЛЯ СЛУЖЕБНЫХ ENDPOINTS ====================
+
+class PoolStatistics(BaseModel):
+    pool_class: str
+    workers: int
+    recycle: int
+    pre_ping: bool
+    pool_size: Optional[int] = None
+    max_overflow: Optional[int] = None
+    max_connections: Optional[int] = None
+    timeout: Optional[float] = None
+    checked_out: Optional[int] = None
+    idle: Optional[int] = None
+    overflow: Optional[int] = None
+    checkouts: Optional[int] = None
+    timeouts: Optional[int] = None
+    wait_avg_ms: Optional[float] = None
+    wait_max_ms: Optional[float] = None
+    overflow_checkouts: Optional[int] = None
+    overflow_peak: Optional[int] = None
+
+
+class CountersReconciliation(BaseModel):
+    drift: Dict[str, int]
+    fixed: bool
+
+
+class AvailabilityReconciliation(BaseModel):
+    # Книги с расхождениями: {book_id: {колонка: сохранено - факт}}
+    books: int
+    drift: Dict[int, Dict[str, int]]
+    fixed: bool
+
+
+class CacheKindStatistics(BaseModel):
+    hits: int
+    misses: int
+    hit_ratio: float
+
+
+class CacheStatistics(BaseModel):
+    backend: str
+    entries: Optional[int] = None
+    hits: int
+    misses: int
+    hit_ratio: float
+    kinds: Dict[str, CacheKindStatistics]
+
+
+class RouteQueryStatistics(BaseModel):
+    requests: int
+    queries_avg: float
+    queries_max: int
+    db_avg_ms: float
+    db_max_ms: float
+    slowest_ms: float
+    slowest_statement: Optional[str] = None
+    n_plus_one: int
+    repeated_statement: Optional[str] = None
+    repeated_max: int
+
+
+class QueryStatistics(BaseModel):
+    enabled: bool
+    threshold: int
+    routes: Dict[str, RouteQueryStatistics]
+
+
+class SlowQueryStatement(BaseModel):
+    shape: str
+    count: int
+    total_ms: float
+    avg_ms: float
+    max_ms: float
+    endpoints: List[str]
+    first_seen: datetime
+    last_seen: datetime
+    plan: Optional[List[str]] = None
+
+
+class SlowQueryReport(BaseModel):
+    threshold_ms: float
+    log_file: str
+    statements: List[SlowQueryStatement]
+    records: List[dict]
+
+
+class JobStatus(BaseModel):
+    name: str
+    interval: float
+    watermark: Optional[date] = None
+    next_run_at: Optional[datetime] = None
+    last_run_at: Optional[datetime] = None
+    last_rows: int = 0
+
+
+class JobRun(BaseModel):
+    job: str
+    rows: Dict[str, int]
+    watermark: Optional[date] = None
+    seconds: float
@@ -0,0 +1,228 @@
+"""
+Поиск книг по подстроке названия с использованием индекса
+
+PostgreSQL: расширение pg_trgm и GIN-индекс ix_books_title_trgm
+(объявлен в models.py). Условие ILIKE '%запрос%' обслуживается индексом,
+результаты упорядочиваются по similarity().
+
+SQLite: собственный инвертированный индекс триграмм в таблице
+book_title_trigrams. Кандидатами становятся книги, в названии которых
+есть все триграммы запроса; затем кандидаты проверяются на вхождение
+подстроки и ранжируются по той же мере сходства, что и в pg_trgm
+(доля общих триграмм).
+
+Перестроение индекса SQLite (например, после массовой загрузки):
+    python search.py --rebuild
+
+Автор: Софья Шипенкова
+"""
+
+import argparse
+from typing import Iterable, List, Set
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, delete, insert
+from sqlalchemy.engine import Connection
+from sqlmodel import select, func
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from models import Book
+
+
+# Максимальное количество результатов поиска
+MAX_LIMIT = 100
+
+# Размер пачки при перестроении индекса
+REBUILD_BATCH_SIZE = 1000
+
+# Таблица инвертированного индекса живёт в отдельных метаданных, чтобы
+# не создаваться в PostgreSQL, где её роль выполняет pg_trgm
+search_metadata = MetaData()
+
+book_title_trigrams = Table(
+    "book_title_trigrams",
+    search_metadata,
+    Column("trigram", String(3), primary_key=True),
+    Column("book_id", Integer, primary_key=True, index=True),
+)
+
+
+def trigrams(value: str) -> Set[str]:
+    """Множество триграмм строки без учёта регистра"""
+    value = value.casefold()
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+def similarity(query: str, title: str) -> float:
+    """Доля общих триграмм запроса и названия (как similarity() в pg_trgm)"""
+    query_grams = trigrams(query)
+    title_grams = trigrams(title)
+    union = query_grams | title_grams
+    if not union:
+        return 0.0
+    return len(query_grams & title_grams) / len(union)
+
+
+def _like_pattern(query: str) -> str:
+    """Шаблон LIKE для поиска подстроки с экранированием спецсимволов"""
+    escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+class TrigramSearchBackend:
+    """Поиск через pg_trgm и GIN-индекс (PostgreSQL)"""
+
+    async def search(self, session: AsyncSession, query: str, limit: int) -> List[Book]:
+        statement = (
+            select(Book)
+            .where(Book.title.ilike(_like_pattern(query), escape="\\"))
+            .order_by(func.similarity(Book.title, query).desc(), Book.id)
+            .limit(limit)
+        )
+        return list((await session.exec(statement)).all())
+
+    async def index_book(self, session: AsyncSession, book: Book) -> None:
+        """GIN-индекс обновляется самой базой данных"""
+
+    def index_titles(self, connection: Connection, books: Iterable) -> None:
+        """GIN-индекс обновляется самой базой данных"""
+
+    def rebuild(self, connection: Connection) -> int:
+        return 0
+
+
+class NgramIndexSearchBackend:
+    """Поиск через инвертированный индекс триграмм (SQLite)"""
+
+    async def search(self, session: AsyncSession, query: str, limit: int) -> List[Book]:
+        query_grams = trigrams(query)
+        if not query_grams:
+            # Запрос короче триграммы нельзя обслужить индексом
+            return await self._search_short(session, query, limit)
+
+        candidate_ids = (
+            select(book_title_trigrams.c.book_id)
+            .where(book_title_trigrams.c.trigram.in_(query_grams))
+            .group_by(book_title_trigrams.c.book_id)
+            .having(func.count() == len(query_grams))
+        )
+        candidates = (await session.exec(
+            select(Book.id, Book.title).where(Book.id.in_(candidate_ids))
+        )).all()
+
+        needle = query.casefold()
+        ranked = sorted(
+            (-similarity(query, title), book_id)
+            for book_id, title in candidates
+            if needle in title.casefold()
+        )[:limit]
+        if not ranked:
+            return []
+
+        ids = [book_id for _, book_id in ranked]
+        books = {
+            book.id: book
+            for book in (await session.exec(select(Book).where(Book.id.in_(ids)))).all()
+        }
+        return [books[book_id] for book_id in ids if book_id in books]
+
+    async def _search_short(self, session: AsyncSession, query: str, limit: int) -> List[Book]:
+        statement = (
+            select(Book)
+            .where(Book.title.ilike(_like_pattern(query), escape="\\"))
+            .order_by(func.length(Book.title), Book.id)
+            .limit(limit)
+        )
+        return list((await session.exec(statement)).all())
+
+    async def index_book(self, session: AsyncSession, book: Book) -> None:
+        """Добавить (или обновить) триграммы названия книги"""
+        await session.execute(
+            delete(book_title_trigrams).where(book_title_trigrams.c.book_id == book.id)
+        )
+        values = _trigram_rows([(book.id, book.title)])
+        if values:
+            await session.execute(insert(book_title_trigrams), values)
+
+    def index_titles(self, connection: Connection, books: Iterable) -> None:
+        """Добавить в индекс новые книги (пары id, название)"""
+        values = _trigram_rows(books)
+        if values:
+            connection.execute(insert(book_title_trigrams), values)
+
+    def rebuild(self, connection: Connection) -> int:
+        """Перестроить индекс по всем книгам, вернуть количество книг"""
+        search_metadata.create_all(connection)
+        connection.execute(delete(book_title_trigrams))
+        indexed = 0
+        last_id = 0
+        while True:
+            rows = connection.execute(
+                select(Book.id, Book.title)
+                .where(Book.id > last_id)
+                .order_by(Book.id)
+                .limit(REBUILD_BATCH_SIZE)
+            ).all()
+            if not rows:
+                break
+            connection.execute(insert(book_title_trigrams), _trigram_rows(rows))
+            indexed += len(rows)
+            last_id = rows[-1][0]
+        return indexed
+
+
+def _trigram_rows(books: Iterable) -> List[dict]:
+    """Строки индекса для пар (id книги, название)"""
+    return [
+        {"trigram": gram, "book_id": book_id}
+        for book_id, title in books
+        for gram in trigrams(title)
+    ]
+
+
+def get_search_backend(bind):
+    """Выбрать реализацию поиска по диалекту базы данных"""
+    if bind.dialect.name == "sqlite":
+        return NgramIndexSearchBackend()
+    return TrigramSearchBackend()
+
+
+def init_search_index(connection: Connection) -> None:
+    """Создать индекс SQLite и заполнить его, если книги уже есть"""
+    if connection.dialect.name != "sqlite":
+        return
+    search_metadata.create_all(connection)
+    indexed = connection.execute(
+        select(func.count()).select_from(book_title_trigrams)
+    ).scalar_one()
+    has_books = connection.execute(select(Book.id).limit(1)).first() is not None
+    if not indexed and has_books:
+        NgramIndexSearchBackend().rebuild(connection)
+
+
+async def search_books(session: AsyncSession, query: str, limit: int = 20) -> List[Book]:
+    """Найти книги по подстроке названия, по убыванию сходства"""
+    limit = max(1, min(limit, MAX_LIMIT))
+    return await get_search_backend(session.bind).search(session, query, limit)
+
+
+async def index_book(session: AsyncSession, book: Book) -> None:
+    """Обновить поисковый индекс для книги (в текущей транзакции)"""
+    await get_search_backend(session.bind).index_book(session, book)
+
+
+def index_titles(connection: Connection, books: Iterable) -> None:
+    """Добавить в поисковый индекс новые книги (например, при массовой загрузке)"""
+    get_search_backend(connection).index_titles(connection, books)
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="Поисковый индекс книг")
+    parser.add_argument("--rebuild", action="store_true", help="перестроить индекс")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        with engine.begin() as connection:
+            count = get_search_backend(connection).rebuild(connection)
+        print(f"Проиндексировано книг: {count}")
@@ -0,0 +1,292 @@
+"""
+Журнал медленных запросов с планами выполнения
+
+Запрос к базе данных дольше SLOW_QUERY_MS записывается в журнал вместе
+с параметрами, endpoint'ом и планом EXPLAIN. План снимается в фоне
+(задачей asyncio для асинхронного движка, в отдельном потоке для
+синхронного) тем же драйвером и с теми же параметрами, поэтому медленный
+запрос его не ждёт. EXPLAIN выполняется без ANALYZE: сам запрос
+повторно не выполняется.
+
+Повторы одного и того же по форме SQL (query_profiler.statement_shape)
+не дублируются: план снимается один раз, а в журнал не чаще раза
+в SLOW_QUERY_REPEAT_SECONDS добавляется сводка повторов.
+
+Журнал - строки JSON в файле SLOW_QUERY_LOG с ротацией по размеру.
+Последние записи и сводка по запросам текущего worker'а:
+    GET /internal/slow-queries
+
+Автор: Софья Шипенкова
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from typing import Dict, List, Optional, Union
+
+from sqlalchemy import event
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from query_profiler import current_endpoint, statement_shape
+
+
+# Порог медленного запроса, мс (0 - журнал отключён)
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+
+# По умолчанию - рядом с модулем, из какого бы каталога ни запускалось приложение
+SLOW_QUERY_LOG = os.getenv(
+    "SLOW_QUERY_LOG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "slow_queries.log")
+)
+SLOW_QUERY_LOG_BYTES = int(os.getenv("SLOW_QUERY_LOG_BYTES", str(10 * 1024 * 1024)))
+SLOW_QUERY_LOG_BACKUPS = int(os.getenv("SLOW_QUERY_LOG_BACKUPS", "5"))
+
+# Как часто писать сводку повторов одного запроса, с
+SLOW_QUERY_REPEAT_SECONDS = float(os.getenv("SLOW_QUERY_REPEAT_SECONDS", "60"))
+
+# Сколько разных запросов хранится в сводке процесса
+MAX_TRACKED_STATEMENTS = 500
+
+# Максимальная длина SQL и параметров в журнале
+PREVIEW_LENGTH = 2000
+
+# Запросы, для которых снимается план
+EXPLAINABLE = ("select", "with", "insert", "update", "delete")
+
+
+def explain_plan(connection: Connection, statement: str, parameters) -> Optional[List[str]]:
+    """План запроса без выполнения (EXPLAIN, для SQLite - EXPLAIN QUERY PLAN)"""
+    dialect = connection.dialect.name
+    if dialect == "postgresql":
+        rows = connection.exec_driver_sql(f"EXPLAIN (ANALYZE false) {statement}", parameters)
+        return [row[0] for row in rows]
+    if dialect == "sqlite":
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+        return [row[-1] for row in rows]
+    return None
+
+
+def _preview(value) -> str:
+    return str(value)[:PREVIEW_LENGTH]
+
+
+class SlowStatement:
+    """Сводка по одному (по форме) медленному запросу"""
+
+    def __init__(self, shape: str):
+        self.shape = shape
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.endpoints = set()
+        self.first_seen = datetime.now()
+        self.last_seen = self.first_seen
+        self.plan: Optional[List[str]] = None
+        self.logged_count = 0
+        self.logged_at = time.monotonic()
+
+    def observe(self, duration: float, endpoint: Optional[str]) -> None:
+        self.count += 1
+        self.total_time += duration
+        self.max_time = max(self.max_time, duration)
+        self.last_seen = datetime.now()
+        if endpoint and len(self.endpoints) < 20:
+            self.endpoints.add(endpoint)
+
+
+class SlowQueryLog:
+    """Замер запросов, фоновый EXPLAIN и запись журнала"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._statements: Dict[str, SlowStatement] = {}
+        self._async_engines: Dict[int, AsyncEngine] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._tasks = set()
+        self._logger: Optional[logging.Logger] = None
+
+    # ---------- подключение к движкам ----------
+
+    def instrument(self, engine: Union[Engine, AsyncEngine]) -> None:
+        """Замерять запросы движка (синхронного или асинхронного)"""
+        if SLOW_QUERY_MS <= 0:
+            return
+        if isinstance(engine, AsyncEngine):
+            self._async_engines[id(engine.sync_engine)] = engine
+            engine = engine.sync_engine
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._slow_query_started = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_slow_query_started", None)
+        if started is None:
+            return
+        duration = time.perf_counter() - started
+        if duration * 1000 < SLOW_QUERY_MS or statement.lstrip()[:7].upper() == "EXPLAIN":
+            return
+        if executemany and parameters:
+            parameters = parameters[0]
+        self.observe(conn.engine, statement, parameters, duration)
+
+    # ---------- учёт ----------
+
+    def observe(self, engine: Engine, statement: str, parameters, duration: float) -> None:
+        """Учесть медленный запрос; для нового запроса - снять план в фоне"""
+        shape = statement_shape(statement)
+        endpoint = current_endpoint()
+        record = {
+            "time": datetime.now().isoformat(timespec="milliseconds"),
+            "pid": os.getpid(),
+            "endpoint": endpoint,
+            "duration_ms": round(duration * 1000, 3),
+            "statement": _preview(statement),
+            "parameters": _preview(parameters),
+        }
+
+        with self._lock:
+            entry = self._statements.get(shape)
+            first = entry is None
+            if first:
+                if len(self._statements) >= MAX_TRACKED_STATEMENTS:
+                    # Вытесняется запрос с наименьшим суммарным временем
+                    least = min(self._statements.values(), key=lambda item: item.total_time)
+                    del self._statements[least.shape]
+                entry = self._statements[shape] = SlowStatement(shape)
+            entry.observe(duration, endpoint)
+            if first:
+                entry.logged_count = entry.count
+            repeats_due = (
+                not first
+                and time.monotonic() - entry.logged_at >= SLOW_QUERY_REPEAT_SECONDS
+            )
+            if repeats_due:
+                record.update({
+                    "event": "repeated",
+                    "shape": _preview(shape),
+                    "repeats": entry.count - entry.logged_count,
+                    "max_ms": round(entry.max_time * 1000, 3),
+                })
+                entry.logged_count = entry.count
+                entry.logged_at = time.monotonic()
+
+        if first:
+            record["event"] = "slow"
+            self._explain(engine, entry, statement, parameters, record)
+        elif repeats_due:
+            self._write(record)
+
+    def _explain(self, engine: Engine, entry: SlowStatement, statement, parameters, record) -> None:
+        if not statement.lstrip().lower().startswith(EXPLAINABLE):
+            self._write(record)
+            return
+        async_engine = self._async_engines.get(id(engine))
+        if async_engine is None:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(1, thread_name_prefix="slow-query-explain")
+            self._executor.submit(
+                self._explain_sync, engine, entry, statement, parameters, record
+            )
+            return
+        # Задача запускается с пустым контекстом, чтобы EXPLAIN не попал
+        # в профиль HTTP-запроса (query_profiler)
+        task = contextvars.Context().run(
+            asyncio.get_running_loop().create_task,
+            self._explain_async(async_engine, entry, statement, parameters, record)
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _explain_sync(self, engine: Engine, entry, statement, parameters, record) -> None:
+        try:
+            with engine.connect() as connection:
+                plan = explain_plan(connection, statement, parameters)
+        except Exception as error:
+            plan = [f"EXPLAIN не выполнен: {error}"]
+        self._store_plan(entry, plan, record)
+
+    async def _explain_async(self, engine: AsyncEngine, entry, statement, parameters, record) -> None:
+        try:
+            async with engine.connect() as connection:
+                plan = await connection.run_sync(explain_plan, statement, parameters)
+        except Exception as error:
+            plan = [f"EXPLAIN не выполнен: {error}"]
+        self._store_plan(entry, plan, record)
+
+    def _store_plan(self, entry: SlowStatement, plan: Optional[List[str]], record: dict) -> None:
+        with self._lock:
+            entry.plan = plan
+        record["plan"] = plan
+        self._write(record)
+
+    # ---------- файл журнала ----------
+
+    def _write(self, record: dict) -> None:
+        if self._logger is None:
+            logger = logging.getLogger("slow_queries")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            handler = RotatingFileHandler(
+                SLOW_QUERY_LOG,
+                maxBytes=SLOW_QUERY_LOG_BYTES,
+                backupCount=SLOW_QUERY_LOG_BACKUPS,
+                encoding="utf-8"
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+            self._logger = logger
+        self._logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+    def tail(self, limit: int) -> List[dict]:
+        """Последние записи журнала (текущий файл, все worker'ы)"""
+        try:
+            with open(SLOW_QUERY_LOG, encoding="utf-8") as file:
+                lines = deque(file, maxlen=limit)
+        except FileNotFoundError:
+            return []
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+        return records
+
+    def statistics(self) -> List[dict]:
+        """Медленные запросы процесса по убыванию суммарного времени"""
+        with self._lock:
+            entries = sorted(
+                self._statements.values(), key=lambda item: item.total_time, reverse=True
+            )
+            return [
+                {
+                    "shape": _preview(entry.shape),
+                    "count": entry.count,
+                    "total_ms": round(entry.total_time * 1000, 3),
+                    "avg_ms": round(entry.total_time / entry.count * 1000, 3),
+                    "max_ms": round(entry.max_time * 1000, 3),
+                    "endpoints": sorted(entry.endpoints),
+                    "first_seen": entry.first_seen,
+                    "last_seen": entry.last_seen,
+                    "plan": entry.plan,
+                }
+                for entry in entries
+            ]
+
+
+slow_query_log = SlowQueryLog()
+
+
+def instrument(engine: Union[Engine, AsyncEngine]) -> None:
+    slow_query_log.instrument(engine)
@@ -0,0 +1,102 @@
+"""
+Общая статистика библиотеки
+
+Полный пересчёт всех показателей выполняется одним запросом: каждая
+таблица читается один раз, а условные счётчики вычисляются агрегатами
+COUNT(*) FILTER (WHERE ...) (или SUM(CASE ...) для баз без FILTER).
+Он используется для сверки счётчиков library_counters (counters.py).
+
+Ответ /statistics кешируется на STATISTICS_TTL_SECONDS секунд; при
+устаревании снимок обновляет только один запрос, остальные ждут его
+результата.
+
+Автор: Софья Шипенкова
+"""
+
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable
+
+from sqlalchemy import case, true
+from sqlmodel import select, func
+
+from models import Book, BookCopy, Loan, Reader
+
+
+# Время жизни снимка статистики
+STATISTICS_TTL_SECONDS = float(os.getenv("STATISTICS_TTL_SECONDS", "5"))
+
+# Диалекты, поддерживающие агрегатный FILTER (WHERE ...)
+FILTER_DIALECTS = {"postgresql", "sqlite"}
+
+
+def count_where(condition, dialect_name: str):
+    """Количество строк, удовлетворяющих условию, внутри агрегата"""
+    if dialect_name in FILTER_DIALECTS:
+        return func.count().filter(condition)
+    return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+
+def statistics_statement(dialect_name: str):
+    """Один запрос, считающий все показатели статистики
+
+    Просроченные выдачи - отмеченные заданием overdue.py (is_overdue),
+    как в /loans/overdue.
+    """
+    books = select(func.count().label("total_books")).select_from(Book).subquery()
+    copies = select(
+        func.count().label("total_copies"),
+        count_where(BookCopy.status == "in_library", dialect_name).label("available_copies"),
+    ).select_from(BookCopy).subquery()
+    readers = select(
+        func.count().label("total_readers"),
+        count_where(Reader.status == "active", dialect_name).label("active_readers"),
+    ).select_from(Reader).subquery()
+    # Читаются только активные выдачи - по индексу (status, due_date)
+    loans = select(
+        func.count().label("active_loans"),
+        count_where(Loan.is_overdue == true(), dialect_name).label("overdue_loans"),
+    ).select_from(Loan).where(Loan.status == "active").subquery()
+
+    return select(
+        books.c.total_books,
+        copies.c.total_copies,
+        copies.c.available_copies,
+        readers.c.total_readers,
+        readers.c.active_readers,
+        loans.c.active_loans,
+        loans.c.overdue_loans,
+    ).select_from(
+        books.join(copies, true()).join(readers, true()).join(loans, true())
+    )
+
+
+class Snapshot:
+    """Значение с ограниченным временем жизни и единственным пересчётом"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._value = None
+        self._expires_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _fresh(self) -> bool:
+        return self._value is not None and time.monotonic() < self._expires_at
+
+    async def get(self, load: Callable[[], Awaitable]):
+        """Вернуть снимок, при необходимости пересчитав его через load()"""
+        if self._fresh():
+            return self._value
+        async with self._lock:
+            # Пока ждали блокировку, снимок мог обновить другой запрос
+            if not self._fresh():
+                self._value = await load()
+                self._expires_at = time.monotonic() + self.ttl
+            return self._value
+
+    def invalidate(self) -> None:
+        self._expires_at = 0.0
+
+
+statistics_snapshot = Snapshot(STATISTICS_TTL_SECONDS)